@@ -1,11 +1,36 @@
+import io
 import os
+import hmac
+import gzip
+import base64
+import binascii
 import sqlite3
+import mimetypes
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g, send_from_directory, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, send_from_directory, jsonify, Response, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
-from db import get_db, init_db, close_connection
+from werkzeug.utils import safe_join
+from werkzeug.datastructures import FileStorage
+from db import get_db, init_db, close_connection, fetch_page, configure_db, pool_stats, run_write
 from admin_config import is_admin_email, get_user_role
+from counters import read_counters
+import geo
+from duplicates import cluster_assignment, configure_duplicates, find_primary
+from images import dhash
+import routing
+import scheduler
+import events
+import sync
+import batch
+import export
+import archive
+import upload_gc
+import profiling
+from claims import claim_complaint
+from search import configure_search, search_page, match_expression
+import jobs
+from uploads import store_upload, ensure_stored, image_kind, UploadRequest, count_rejection, rejection_stats
+from storage import configure_storage, upload_url, get_storage, is_immutable
 
 # Import Firebase admin config (optional - will work without it)
 try:
@@ -22,8 +47,121 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app = Flask(__name__)
+# File parts are sniffed, size-checked and hashed while they stream in (see uploads.py)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Request body limit everywhere, and per-file limits for the upload endpoints
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['UPLOAD_LIMITS'] = {
+    'create_complaint': 8 * 1024 * 1024,
+    'worker_update': 8 * 1024 * 1024,
+    'complaints_batch': 8 * 1024 * 1024,
+}
+# Whole-body limits for endpoints taking several files
+app.config['UPLOAD_BODY_LIMITS'] = {
+    'complaints_batch': 64 * 1024 * 1024,
+}
 app.config['SECRET_KEY'] = 'change-this-secret-for-production'
+# Keyset pagination for report lists (?limit= is capped at MAX_PAGE_SIZE)
+app.config['PAGE_SIZE'] = 20
+app.config['MAX_PAGE_SIZE'] = 100
+# SQLite connection tuning (see db.DB_CONFIG); connections are reused per thread
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = 5000
+app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'
+app.config['SQLITE_CACHE_SIZE_KB'] = 16384
+app.config['SQLITE_MMAP_SIZE'] = 128 * 1024 * 1024
+# GET handlers read through read-only connections; submissions go through a
+# single writer thread that commits queued writes in groups
+app.config['SQLITE_READONLY_GET'] = True
+app.config['SQLITE_WRITER_ENABLED'] = True
+app.config['SQLITE_WRITER_MAX_BATCH'] = 64
+app.config['SQLITE_WRITER_MAX_LATENCY_MS'] = 2
+# Downscaled copies of uploads used by list pages (longest edge in pixels)
+app.config['IMAGE_SIZES'] = {'thumb': 320, 'medium': 960}
+app.config['IMAGE_WEBP'] = True
+# Background jobs (image derivatives etc.) run on a pool outside the request thread
+app.config['JOBS_ENABLED'] = True
+app.config['JOBS_EXECUTOR'] = 'thread'
+app.config['JOBS_WORKERS'] = 2
+# Where uploads live: 'local' (sharded below UPLOAD_FOLDER) or 's3'
+# (S3_ENDPOINT_URL may point at a local S3-compatible server such as MinIO)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['STORAGE_SHARD_DEPTH'] = 2
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = ''
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+app.config['S3_PUBLIC_URL'] = os.environ.get('S3_PUBLIC_URL')
+# /uploads/<key> caching: content-addressed and timestamped names never change
+app.config['UPLOAD_CACHE_MAX_AGE'] = 365 * 24 * 3600
+app.config['UPLOAD_CACHE_MUTABLE_MAX_AGE'] = 3600
+# Hand file bodies to the front-end server instead of copying them in Python:
+# USE_X_SENDFILE for Apache/lighttpd, or an nginx `internal` location prefix
+# (e.g. '/protected-uploads/' aliased to static/uploads) for X-Accel-Redirect
+app.config['USE_X_SENDFILE'] = False
+app.config['UPLOAD_ACCEL_REDIRECT'] = None
+# /api/complaints/nearby and /bbox (radius in metres)
+app.config['NEARBY_DEFAULT_RADIUS_M'] = 1000
+app.config['NEARBY_MAX_RADIUS_M'] = 10000
+app.config['NEARBY_MAX_RESULTS'] = 200
+# New reports near an open complaint from the last few days join its cluster
+app.config['DUPLICATE_DETECTION'] = True
+app.config['DUPLICATE_RADIUS_M'] = 50
+app.config['DUPLICATE_WINDOW_HOURS'] = 72
+app.config['DUPLICATE_PHASH'] = True
+app.config['DUPLICATE_PHASH_MAX_DISTANCE'] = 12
+# Worker route planning (/worker/route)
+app.config['ROUTE_MAX_STOPS'] = 300
+app.config['ROUTE_TIME_LIMIT'] = 1.0
+# Pending complaints are assigned to workers periodically (see scheduler.py);
+# off by default, workers claim complaints themselves
+app.config['SCHEDULER_ENABLED'] = False
+app.config['SCHEDULER_INTERVAL'] = 30
+app.config['SCHEDULER_MAX_OPEN'] = 10
+# Full-text search (FTS5); existing complaints are indexed by a background job
+app.config['SEARCH_BACKFILL_BATCH'] = 500
+app.config['SEARCH_MAX_RESULTS'] = 50
+# Live dashboard updates (Server-Sent Events)
+app.config['EVENTS_ENABLED'] = True
+app.config['EVENTS_BUFFER'] = 1000
+app.config['EVENTS_CLIENT_BUFFER'] = 256
+app.config['EVENTS_HEARTBEAT'] = 15
+app.config['EVENTS_MAX_STREAM_SECONDS'] = 300
+# Worker delta sync
+app.config['SYNC_PAGE_SIZE'] = 500
+app.config['SYNC_RETENTION_DAYS'] = 30
+# JSON API responses at least this large are gzipped for clients that accept it
+app.config['GZIP_MIN_SIZE'] = 1024
+app.config['GZIP_LEVEL'] = 6
+# Batch submission of reports collected offline
+app.config['BATCH_MAX_ITEMS'] = 50
+# Completed complaints older than this move to complaints_archive (see archive.py)
+app.config['ARCHIVE_ENABLED'] = True
+app.config['ARCHIVE_AFTER_DAYS'] = 90
+app.config['ARCHIVE_BATCH_SIZE'] = 200
+# Daily removal of uploaded files nothing references (see upload_gc.py)
+app.config['UPLOAD_GC_ENABLED'] = True
+app.config['UPLOAD_GC_GRACE_SECONDS'] = 3600
+# Per-request timing and SQL tracing, exposed at /admin/metrics (see profiling.py);
+# scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`. Off unless
+# PROFILING_ENABLED=1: tracing slows query-heavy requests by up to half
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+app.config['PROFILING_SLOW_QUERY_MS'] = 100
+app.config['PROFILING_N_PLUS_ONE_THRESHOLD'] = 10
+app.config['PROFILING_CPROFILE_SAMPLE_RATE'] = 0.0
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+jobs.configure_jobs(app.config)
+configure_db(app.config)
+configure_storage(app.config)
+configure_duplicates(app.config)
+scheduler.configure_scheduler(app.config)
+configure_search(app.config)
+events.configure_events(app.config)
+sync.configure_sync(app.config)
+batch.configure_batch(app.config)
+archive.configure_archive(app.config)
+upload_gc.configure_upload_gc(app.config)
+profiling.configure_profiling(app.config)
+app.add_template_filter(upload_url)
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -39,6 +177,86 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def _reject_upload(status, reason, message):
+    count_rejection(reason)
+    if wants_json() or request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': message}), status
+    flash(message, 'danger')
+    return redirect(request.referrer or url_for('index'))
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return _reject_upload(413, 'too_large', e.description)
+
+
+@app.errorhandler(415)
+def upload_not_an_image(e):
+    return _reject_upload(415, 'bad_type', e.description)
+
+
+def enqueue_derivatives(conn, complaint_id, field, rel_path, owner_id):
+    # Queue thumbnail/medium generation for an upload (inside the caller's write)
+    return jobs.enqueue(conn, 'images.derivatives', {
+        'complaint_id': complaint_id,
+        'field': field,
+        'path': rel_path,
+        'sizes': app.config['IMAGE_SIZES'],
+        'webp': app.config['IMAGE_WEBP']
+    }, owner_id=owner_id)
+
+
+def gzip_response(response):
+    """Compress a buffered response body when the client accepts gzip"""
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    data = response.get_data()
+    if len(data) < app.config['GZIP_MIN_SIZE']:
+        return response
+    response.set_data(gzip.compress(data, app.config['GZIP_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def page_args():
+    # Keyset paging arguments from the query string: ?after= / ?before= / ?limit=
+    limit = request.args.get('limit', type=int) or app.config['PAGE_SIZE']
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    return {'after': request.args.get('after'), 'before': request.args.get('before'), 'limit': limit}
+
+
+def wants_json():
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def render_page(template, key, page, **context):
+    """Render a keyset page as HTML, or as JSON for ?format=json / Accept: application/json"""
+    rows, next_cursor, prev_cursor = page
+    if wants_json():
+        return jsonify({
+            'success': True,
+            key: [dict(r) for r in rows],
+            'next': next_cursor,
+            'prev': prev_cursor
+        })
+    return render_template(template, next_cursor=next_cursor, prev_cursor=prev_cursor, **{key: rows}, **context)
+
+
+@app.context_processor
+def inject_page_url():
+    def page_url(**changes):
+        # Current URL with the paging cursor replaced, other filters preserved
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        args.update({k: v for k, v in changes.items() if v is not None})
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+    return {'page_url': page_url}
+
+
 # Some Flask versions may not have `before_first_request` available in the same way.
 # Initialize the database immediately within the app context so tables are present.
 with app.app_context():
@@ -48,6 +266,35 @@ with app.app_context():
 app.teardown_appcontext(close_connection)
 
 
+@app.before_request
+def start_profiling():
+    # Registered first, so the other before_request hooks are timed as well
+    profiling.start_request()
+
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_profiling(e=None):
+    # Runs after errors too; an unhandled exception never produced a response
+    profiling.finish_request(request.endpoint, request.method, g.get('response_status', 500))
+
+
+@app.before_request
+def ensure_job_runner():
+    # Started lazily so each (forked) server process runs its own job runner
+    jobs.get_runner()
+
+
+@app.before_request
+def ensure_scheduler():
+    scheduler.get_scheduler()
+
+
 def login_required(f):
     from functools import wraps
 
@@ -78,66 +325,71 @@ def role_required(role):
 
 
 def get_user_counts(user_id):
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT COUNT(*) FROM complaints WHERE user_id=?', (user_id,))
-    total = cur.fetchone()[0]
+    cur = get_db().cursor()
+    counts = read_counters(cur, 'user', user_id)
+    total = sum(counts.values())
     # Count in-progress (accepted/in progress) separately from pending submissions
-    cur.execute("SELECT COUNT(*) FROM complaints WHERE user_id=? AND status IN ('Accepted','In Progress')", (user_id,))
-    in_progress = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM complaints WHERE user_id=? AND status='Completed'", (user_id,))
-    completed = cur.fetchone()[0]
+    in_progress = counts.get('Accepted', 0) + counts.get('In Progress', 0)
+    completed = counts.get('Completed', 0)
     return total, in_progress, completed
 
 
 def get_worker_counts(worker_id):
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT COUNT(*) FROM complaints WHERE status IN ('Pending','Accepted','In Progress')")
-    open_count = cur.fetchone()[0]
-    cur.execute('SELECT COUNT(*) FROM complaints WHERE worker_id=? AND status="Completed"', (worker_id,))
-    completed = cur.fetchone()[0]
+    cur = get_db().cursor()
+    status_counts = read_counters(cur, 'complaints')
+    open_count = sum(status_counts.get(s, 0) for s in ('Pending', 'Accepted', 'In Progress'))
+    completed = read_counters(cur, 'worker', worker_id).get('Completed', 0)
     return open_count, completed
 
 
 def get_admin_stats():
-    db = get_db()
-    cur = db.cursor()
-    
-    # Total complaints
-    cur.execute('SELECT COUNT(*) FROM complaints')
-    total_complaints = cur.fetchone()[0]
-    
-    # Total users (excluding workers and admins)
-    cur.execute('SELECT COUNT(*) FROM users WHERE role="user"')
-    total_users = cur.fetchone()[0]
-    
-    # Total workers
-    cur.execute('SELECT COUNT(*) FROM users WHERE role="worker"')
-    total_workers = cur.fetchone()[0]
-    
-    # Pending complaints
-    cur.execute('SELECT COUNT(*) FROM complaints WHERE status="Pending"')
-    pending = cur.fetchone()[0]
-    
-    # In Progress complaints
-    cur.execute('SELECT COUNT(*) FROM complaints WHERE status IN ("Accepted", "In Progress")')
-    in_progress = cur.fetchone()[0]
-    
-    # Completed complaints
-    cur.execute('SELECT COUNT(*) FROM complaints WHERE status="Completed"')
-    completed = cur.fetchone()[0]
-    
+    # Counters are maintained by triggers, so this reads a few rows instead of scanning
+    cur = get_db().cursor()
+    status_counts = read_counters(cur, 'complaints')
+    role_counts = read_counters(cur, 'users')
+
     return {
-        'total_complaints': total_complaints,
-        'total_users': total_users,
-        'total_workers': total_workers,
-        'pending': pending,
-        'in_progress': in_progress,
-        'completed': completed
+        'total_complaints': sum(status_counts.values()),
+        'total_users': role_counts.get('user', 0),
+        'total_workers': role_counts.get('worker', 0),
+        'pending': status_counts.get('Pending', 0),
+        'in_progress': status_counts.get('Accepted', 0) + status_counts.get('In Progress', 0),
+        'completed': status_counts.get('Completed', 0)
     }
 
 
+def dashboard_stats(role, user_id):
+    # The counters shown on the admin or worker dashboard
+    if role == 'admin':
+        return get_admin_stats()
+    open_count, completed = get_worker_counts(user_id)
+    return {'open_count': open_count, 'completed': completed}
+
+
+def dashboard_view(role, user_id):
+    """Turn complaint events into deltas of the counters on this user's dashboard"""
+    def view(event):
+        if event.kind != 'complaint':
+            return event.data
+        statuses = event.data['deltas']['statuses']
+        if role == 'admin':
+            stats = {
+                'total_complaints': sum(statuses.values()),
+                'pending': statuses.get('Pending', 0),
+                'in_progress': statuses.get('Accepted', 0) + statuses.get('In Progress', 0),
+                'completed': statuses.get('Completed', 0),
+            }
+        else:
+            mine = event.data['deltas']['workers'].get(str(user_id), {})
+            stats = {
+                'open_count': sum(statuses.get(s, 0) for s in ('Pending', 'Accepted', 'In Progress')),
+                'completed': mine.get('Completed', 0),
+            }
+        return {'action': event.data['action'], 'complaint': event.data['complaint'],
+                'stats': {k: v for k, v in stats.items() if v}}
+    return view
+
+
 @app.route('/admin/reports')
 @login_required
 @role_required('admin')
@@ -146,16 +398,26 @@ def admin_reports():
     cur = db.cursor()
     # filter param: pending | inprogress | completed | all
     f = (request.args.get('filter') or '').strip().lower()
-    if f == 'pending':
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status='Pending' ORDER BY c.created_at DESC")
-    elif f == 'inprogress':
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status IN ('Accepted','In Progress') ORDER BY c.created_at DESC")
-    elif f == 'completed':
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status='Completed' ORDER BY c.updated_at DESC")
+    where, sort_col = {
+        'pending': ("c.status='Pending'", 'c.created_at'),
+        'inprogress': ("c.status IN ('Accepted','In Progress')", 'c.created_at'),
+        'completed': ("c.status='Completed'", 'c.updated_at'),
+    }.get(f, ('', 'c.created_at'))
+    # Open work is only in the hot table; completed and all include archived complaints
+    table = 'complaints' if f in ('pending', 'inprogress') else 'complaints_all'
+    if f == 'inprogress':
+        # Otherwise planned as a status index lookup plus a sort of every open row
+        table += ' c INDEXED BY idx_complaints_inprogress'
     else:
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id ORDER BY c.created_at DESC")
-    reports = cur.fetchall()
-    return render_template('admin_reports.html', reports=reports, filter=f)
+        table += ' c'
+    select = f"SELECT c.*, u.username as reporter FROM {table} JOIN users u ON c.user_id=u.id"
+    # ?q= switches to full-text search within the filter, best match first
+    q = (request.args.get('q') or '').strip()
+    if q:
+        page = search_page(cur, q, where, (), **page_args())
+    else:
+        page = fetch_page(cur, select, where, (), sort_col, **page_args())
+    return render_page('admin_reports.html', 'reports', page, filter=f, q=q)
 
 
 @app.route('/admin/users')
@@ -180,6 +442,38 @@ def admin_workers():
     return render_template('admin_workers.html', workers=workers)
 
 
+@app.route('/uploads/<path:key>')
+def serve_upload(key):
+    """Uploaded images with strong ETags, long-lived caching and Range support"""
+    storage = get_storage()
+    root = app.config['UPLOAD_FOLDER']
+    if storage.local_path(key) is None:
+        # Object storage serves its own files
+        return redirect(storage.url(key), code=301)
+    immutable = is_immutable(key)
+    max_age = app.config['UPLOAD_CACHE_MAX_AGE'] if immutable else app.config['UPLOAD_CACHE_MUTABLE_MAX_AGE']
+    # A content-addressed name already is the hash of the bytes
+    etag = os.path.splitext(os.path.basename(key))[0] if immutable else True
+    accel = app.config['UPLOAD_ACCEL_REDIRECT']
+    if accel:
+        path = safe_join(root, key)
+        if path is None or not os.path.isfile(path):
+            return 'Not Found', 404
+        response = app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel.rstrip('/') + '/' + key
+        st = os.stat(path)
+        response.set_etag(etag if immutable else f'{st.st_mtime_ns:x}-{st.st_size:x}')
+        response.last_modified = st.st_mtime
+        response.make_conditional(request)
+    else:
+        # send_file handles If-None-Match/If-Modified-Since, Range and USE_X_SENDFILE
+        response = send_from_directory(root, key, etag=etag, max_age=max_age)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable
+    return response
+
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -575,11 +869,10 @@ def get_workers():
         cur = db.cursor()
         cur.execute('''
             SELECT u.id, u.username, u.email, u.phone, u.created_at,
-                   COUNT(DISTINCT c.id) as total_completed
+                   COALESCE(k.value, 0) as total_completed
             FROM users u
-            LEFT JOIN complaints c ON u.id = c.worker_id AND c.status = 'Completed'
+            LEFT JOIN counters k ON k.scope = 'worker' AND k.scope_id = u.id AND k.name = 'Completed'
             WHERE u.role = 'worker'
-            GROUP BY u.id
             ORDER BY u.created_at DESC
         ''')
         workers = cur.fetchall()
@@ -659,6 +952,118 @@ def remove_worker(worker_id):
         return jsonify({'success': False, 'message': f'Error removing worker: {str(e)}'}), 500
 
 
+@app.route('/api/admin/db-stats', methods=['GET'])
+@login_required
+def db_stats():
+    """Admin endpoint exposing connection reuse statistics"""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    return jsonify({'success': True, 'stats': pool_stats()}), 200
+
+
+@app.route('/api/admin/upload-stats', methods=['GET'])
+@login_required
+def upload_stats():
+    """Admin endpoint with counts of rejected uploads (this process)"""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    return jsonify({
+        'success': True,
+        'rejections': rejection_stats(),
+        'limits': dict(app.config['UPLOAD_LIMITS'], default=app.config['MAX_CONTENT_LENGTH'])
+    }), 200
+
+
+@app.route('/api/admin/scheduler', methods=['GET'])
+@login_required
+def scheduler_overview():
+    """Admin endpoint with scheduler ticks and assignment latency (this process)"""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    return jsonify({
+        'success': True,
+        'watermark': scheduler.get_state(get_db().cursor(), scheduler.WATERMARK, 0),
+        'stats': scheduler.scheduler_stats()
+    }), 200
+
+
+@app.route('/api/admin/events', methods=['GET'])
+@login_required
+def events_overview():
+    """Admin endpoint with live event bus counters (this process)"""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    return jsonify({'success': True, 'events': events.bus_stats()}), 200
+
+
+@app.route('/admin/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this process, for admins and for scrapers sending METRICS_TOKEN"""
+    token = app.config['METRICS_TOKEN']
+    scraper = token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if session.get('role') != 'admin' and not scraper:
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    stats = pool_stats()
+    writer = stats.get('writer', {})
+    extra = [
+        ('db_connections_opened_total', 'Read-write SQLite connections opened', 'counter', stats['opened']),
+        ('db_readonly_connections_opened_total', 'Read-only SQLite connections opened', 'counter', stats['readonly_opened']),
+        ('db_connections_reused_total', 'Requests served by an already open connection', 'counter', stats['reused']),
+        ('db_open_connections', 'SQLite connections currently open', 'gauge', stats['open_connections']),
+        ('db_writer_queued', 'Writes waiting for the writer thread', 'gauge', writer.get('queued', 0)),
+        ('db_writer_writes_total', 'Writes committed by the writer thread', 'counter', writer.get('writes', 0)),
+        ('db_writer_failed_total', 'Writes the writer thread rolled back', 'counter', writer.get('failed', 0)),
+        ('upload_rejections_total', 'Uploads rejected (size, type)', 'counter', sum(rejection_stats().values())),
+    ]
+    return Response(profiling.render_metrics(extra), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/admin/export', methods=['GET'])
+@login_required
+def export_complaints():
+    """Stream complaints as CSV or NDJSON: ?format=csv|ndjson&status=&since=&until="""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({'success': False, 'message': 'format must be csv or ndjson'}), 400
+    try:
+        since = export.parse_date(request.args.get('since'))
+        until = export.parse_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'since and until must be dates (YYYY-MM-DD)'}), 400
+    statuses = [part for value in request.args.getlist('status') for part in value.split(',') if part]
+    body = export.stream_export(get_db(), fmt, statuses, since, until)
+    filename = f"complaints-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    return Response(stream_with_context(body), mimetype=export.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    """Status of a background job, visible to its owner and to admins"""
+    job = jobs.get_job(get_db().cursor(), job_id)
+    if job is None or (session.get('role') != 'admin' and job['owner_id'] != session['user_id']):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job}), 200
+
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@login_required
+def jobs_overview():
+    """Admin endpoint with job counts by kind and status"""
+    if session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized. Admin access required.'}), 403
+    runner = jobs.get_runner()
+    return jsonify({
+        'success': True,
+        'jobs': jobs.job_summary(get_db().cursor()),
+        'runner': dict(runner.stats, running=runner.running) if runner else None
+    }), 200
+
+
 @app.route('/user/dashboard')
 @login_required
 @role_required('user')
@@ -690,27 +1095,144 @@ def create_complaint():
 
     rel_path = ''
     if file and file.filename != '':
-        if allowed_file(file.filename):
-            filename = secure_filename(f"before_{int(datetime.utcnow().timestamp())}_{file.filename}")
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(save_path)
-            # Use POSIX-style path for URLs (works cross-platform)
-            rel_path = f"static/uploads/{filename}"
+        if allowed_file(file.filename) and image_kind(file):
+            # Stored under its content hash; an identical photo is not written twice
+            rel_path = store_upload(file)
         else:
             flash('Invalid image file.', 'danger')
             return redirect(url_for('new_complaint'))
-        db = get_db()
-        cur = db.cursor()
-        cur.execute('INSERT INTO complaints (user_id, description, image_before_path, latitude, longitude, status, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?)',
-                (session['user_id'], description, rel_path, latitude, longitude, 'Pending', datetime.utcnow(), datetime.utcnow()))
-        db.commit()
-        flash('Complaint submitted successfully.', 'success')
+        user_id = session['user_id']
+        phash = dhash(file.stream) if app.config['DUPLICATE_PHASH'] else None
+
+        def insert_complaint(conn):
+            ensure_stored(file, rel_path)
+            # A report of something already reported nearby joins that complaint's cluster
+            primary_id = find_primary(conn.cursor(), latitude, longitude, phash)
+            status, worker_id, assigned_at = cluster_assignment(conn.cursor(), primary_id)
+            now = datetime.utcnow()
+            cur = conn.execute('INSERT INTO complaints (user_id, description, image_before_path, latitude, longitude, status, worker_id, assigned_at, cluster_id, image_phash, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+                               (user_id, description, rel_path, latitude, longitude, status, worker_id, assigned_at, primary_id, phash, now, now))
+            # Thumbnails are made in the background; the citizen only waits for the upload
+            enqueue_derivatives(conn, cur.lastrowid, 'before', rel_path, user_id)
+            return {'id': cur.lastrowid, 'status': status, 'worker_id': worker_id, 'cluster_id': primary_id,
+                    'description': description[:120], 'created_at': now}
+        complaint = run_write(insert_complaint)
+        primary_id = complaint['cluster_id']
+        jobs.notify()
+        workers = {str(complaint['worker_id']): {complaint['status']: 1}} if complaint['worker_id'] else {}
+        events.publish('complaint', {'action': 'created', 'complaint': complaint,
+                                     'deltas': {'statuses': {complaint['status']: 1}, 'workers': workers}})
+        if primary_id is not None:
+            flash(f'Complaint submitted. It was already reported nearby, so it was linked to complaint #{primary_id} and will be resolved with it.', 'success')
+        else:
+            flash('Complaint submitted successfully.', 'success')
         return redirect(url_for('my_complaints'))
     else:
         flash('Invalid image file.', 'danger')
         return redirect(url_for('new_complaint'))
 
 
+def _batch_image(item):
+    """FileStorage for a batch item's photo (file part or base64), or an error message"""
+    if item['image_base64']:
+        try:
+            data = base64.b64decode(item['image_base64'], validate=True)
+        except (binascii.Error, ValueError):
+            return None, 'image_base64 is not valid base64.'
+        if len(data) > app.config['UPLOAD_LIMITS']['complaints_batch']:
+            return None, 'Image is too large.'
+        file = FileStorage(io.BytesIO(data), filename=item['client_id'])
+    else:
+        file = request.files.get(item['image'] or item['client_id'])
+        if file is None or file.filename == '':
+            return None, 'Image is required.'
+    if not image_kind(file):
+        return None, 'Only JPEG, PNG and GIF images can be uploaded.'
+    return file, None
+
+
+@app.route('/api/complaints/batch', methods=['POST'])
+@login_required
+def complaints_batch():
+    """
+    Submit several complaints at once: multipart with an `items` field, or
+    an NDJSON body. Idempotent per client_id; one result per item (batch.py).
+    """
+    if session.get('role') != 'user':
+        return jsonify({'success': False, 'message': 'Unauthorized. Citizen access required.'}), 403
+    user_id = session['user_id']
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            raw_items = batch.parse_items(request.get_data(as_text=True))
+        else:
+            raw_items = batch.parse_items(request.form.get('items'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    results = [None] * len(raw_items)
+    valid, repeats = {}, []
+    for index, raw in enumerate(raw_items):
+        item, error = batch.validate_item(raw)
+        if error:
+            client_id = raw.get('client_id') if isinstance(raw, dict) else None
+            results[index] = {'client_id': client_id, 'status': 'error', 'message': error}
+        elif item['client_id'] in valid:
+            repeats.append((index, item['client_id']))
+        else:
+            valid[item['client_id']] = (index, item)
+
+    # Photos of items stored by an earlier attempt are not stored again
+    known = batch.existing_ids(get_db().cursor(), user_id, list(valid))
+    pending = []
+    for client_id, (index, item) in valid.items():
+        if client_id in known:
+            results[index] = {'client_id': client_id, 'status': 'duplicate', 'id': known[client_id]}
+            continue
+        file, error = _batch_image(item)
+        if error:
+            results[index] = {'client_id': client_id, 'status': 'error', 'message': error}
+            continue
+        item['file'] = file
+        item['image_path'] = store_upload(file)
+        item['phash'] = dhash(file.stream) if app.config['DUPLICATE_PHASH'] else None
+        pending.append(item)
+
+    def insert_items(conn):
+        for item in pending:
+            ensure_stored(item['file'], item['image_path'])
+        existing, created = batch.insert_batch(conn, user_id, pending)
+        for client_id, complaint in created.items():
+            enqueue_derivatives(conn, complaint['id'], 'before', valid[client_id][1]['image_path'], user_id)
+        return existing, created
+    existing, created = run_write(insert_items) if pending else ({}, {})
+    if created:
+        jobs.notify()
+
+    for item in pending:
+        index, client_id = valid[item['client_id']][0], item['client_id']
+        if client_id in created:
+            complaint = created[client_id]
+            results[index] = {'client_id': client_id, 'status': 'created', 'id': complaint['id'], 'cluster_id': complaint['cluster_id']}
+            events.publish('complaint', {
+                'action': 'created',
+                'complaint': {'id': complaint['id'], 'status': complaint['status'], 'worker_id': complaint['worker_id'],
+                              'cluster_id': complaint['cluster_id'],
+                              'description': item['description'][:120], 'created_at': datetime.utcnow()},
+                'deltas': {'statuses': {complaint['status']: 1},
+                           'workers': {str(complaint['worker_id']): {complaint['status']: 1}} if complaint['worker_id'] else {}},
+            })
+        else:
+            # Stored by a concurrent retry of the same batch
+            results[index] = {'client_id': client_id, 'status': 'duplicate', 'id': existing.get(client_id)}
+            release_uploads_later(item['image_path'])
+    for index, client_id in repeats:
+        first = results[valid[client_id][0]]
+        results[index] = dict(first, status='duplicate') if first.get('id') else dict(first)
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'duplicate', 'error')}
+    return jsonify({'success': True, **counts, 'results': results}), 200
+
+
 @app.route('/complaints/my')
 @login_required
 @role_required('user')
@@ -723,13 +1245,14 @@ def my_complaints():
         # Treat 'Pending' filter as open statuses (Pending, Accepted, In Progress)
         s = status.strip().lower()
         if s == 'pending' or s == 'open':
-            cur.execute("SELECT * FROM complaints WHERE user_id=? AND status IN ('Pending','Accepted','In Progress') ORDER BY created_at DESC", (session['user_id'],))
+            page = fetch_page(cur, 'SELECT * FROM complaints', "user_id=? AND status IN ('Pending','Accepted','In Progress')",
+                              (session['user_id'],), 'created_at', **page_args())
         else:
-            cur.execute('SELECT * FROM complaints WHERE user_id=? AND status=? ORDER BY created_at DESC', (session['user_id'], status))
+            page = fetch_page(cur, 'SELECT * FROM complaints_all', 'user_id=? AND status=?',
+                              (session['user_id'], status), 'created_at', **page_args())
     else:
-        cur.execute('SELECT * FROM complaints WHERE user_id=? ORDER BY created_at DESC', (session['user_id'],))
-    complaints = cur.fetchall()
-    return render_template('my_complaints.html', complaints=complaints)
+        page = fetch_page(cur, 'SELECT * FROM complaints_all', 'user_id=?', (session['user_id'],), 'created_at', **page_args())
+    return render_page('my_complaints.html', 'complaints', page)
 
 
 @app.route('/complaints/<int:cid>')
@@ -737,7 +1260,7 @@ def my_complaints():
 def complaint_detail(cid):
     db = get_db()
     cur = db.cursor()
-    cur.execute('SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.id=?', (cid,))
+    cur.execute('SELECT c.*, u.username as reporter FROM complaints_all c JOIN users u ON c.user_id=u.id WHERE c.id=?', (cid,))
     complaint = cur.fetchone()
     if complaint is None:
         flash('Complaint not found.', 'danger')
@@ -754,12 +1277,87 @@ def public_reports():
     cur = db.cursor()
     # Show all reports publicly; optional ?status=Completed to filter
     status = request.args.get('status')
-    if status:
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status=? ORDER BY c.created_at DESC", (status,))
+    select = "SELECT c.*, u.username as reporter FROM complaints_all c JOIN users u ON c.user_id=u.id"
+    where, params = ('c.status=?', (status,)) if status else ('', ())
+    q = (request.args.get('q') or '').strip()
+    if q:
+        page = search_page(cur, q, where, params, **page_args())
     else:
-        cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id ORDER BY c.created_at DESC")
-    reports = cur.fetchall()
-    return render_template('public_reports.html', reports=reports)
+        page = fetch_page(cur, select, where, params, 'c.created_at', **page_args())
+    return render_page('public_reports.html', 'reports', page, q=q)
+
+
+def _geo_statuses():
+    # ?status=open (default), ?status=all, or a comma-separated list of statuses
+    status = request.args.get('status', 'open')
+    if status == 'open':
+        return geo.OPEN_STATUSES
+    if status == 'all':
+        return None
+    return tuple(s.strip() for s in status.split(',') if s.strip())
+
+
+def _geo_json(rows):
+    for row in rows:
+        thumb, original = row.pop('image_before_thumb'), row.pop('image_before_path')
+        row['image_url'] = upload_url(thumb or original)
+    return rows
+
+
+@app.route('/api/complaints/nearby', methods=['GET'])
+def complaints_nearby():
+    """Complaints around a point, nearest first: ?lat=&lon=&radius=&status=&limit="""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'success': False, 'message': 'lat and lon are required'}), 400
+    radius = request.args.get('radius', type=float) or app.config['NEARBY_DEFAULT_RADIUS_M']
+    radius = max(1.0, min(radius, app.config['NEARBY_MAX_RADIUS_M']))
+    limit = max(1, min(request.args.get('limit', type=int) or 50, app.config['NEARBY_MAX_RESULTS']))
+    rows = geo.nearby(get_db().cursor(), lat, lon, radius, _geo_statuses(), limit)
+    return jsonify({'success': True, 'radius': radius, 'complaints': _geo_json(rows)}), 200
+
+
+@app.route('/api/complaints/bbox', methods=['GET'])
+def complaints_bbox():
+    """Complaints inside a map viewport: ?min_lat=&min_lon=&max_lat=&max_lon=&status=&limit="""
+    box = [request.args.get(k, type=float) for k in ('min_lat', 'min_lon', 'max_lat', 'max_lon')]
+    if None in box or box[0] > box[2]:
+        return jsonify({'success': False, 'message': 'min_lat, min_lon, max_lat and max_lon are required'}), 400
+    limit = max(1, min(request.args.get('limit', type=int) or app.config['NEARBY_MAX_RESULTS'], app.config['NEARBY_MAX_RESULTS']))
+    rows = geo.in_bbox(get_db().cursor(), *box, statuses=_geo_statuses(), limit=limit)
+    return jsonify({'success': True, 'complaints': _geo_json(rows)}), 200
+
+
+@app.route('/api/complaints/search', methods=['GET'])
+def complaints_search():
+    """Full-text search, best match first: ?q=&status=&limit=&after=&before="""
+    q = request.args.get('q', '')
+    if match_expression(q) is None:
+        return jsonify({'success': False, 'message': 'q must contain at least one word'}), 400
+    where, params = '', ()
+    # ?status= is open, or a comma-separated list of statuses; all statuses by default
+    status = request.args.get('status')
+    if status:
+        statuses = geo.OPEN_STATUSES if status == 'open' else tuple(s.strip() for s in status.split(',') if s.strip())
+        where, params = f"c.status IN ({','.join('?' * len(statuses))})", statuses
+    paging = page_args()
+    paging['limit'] = min(paging['limit'], app.config['SEARCH_MAX_RESULTS'])
+    rows, next_cursor, prev_cursor = search_page(get_db().cursor(), q, where, params, **paging)
+    complaints = [{
+        'id': r['id'],
+        'description': r['description'],
+        'snippet': r['snippet'],
+        'reporter': r['reporter'],
+        'status': r['status'],
+        'latitude': r['latitude'],
+        'longitude': r['longitude'],
+        'created_at': r['created_at'],
+        'updated_at': r['updated_at'],
+        'score': r['score'],
+        'image_url': upload_url(r['image_before_thumb'] or r['image_before_path']),
+    } for r in rows]
+    return jsonify({'success': True, 'complaints': complaints, 'next': next_cursor, 'prev': prev_cursor}), 200
 
 
 @app.route('/worker/dashboard')
@@ -771,6 +1369,21 @@ def worker_dashboard():
     return render_template('worker_dashboard.html', open_count=open_count, completed=completed)
 
 
+@app.route('/api/events/stream')
+@login_required
+def event_stream():
+    """Server-Sent Events feed of counter deltas and complaint changes for the dashboards"""
+    role, user_id = session.get('role'), session['user_id']
+    if role not in ('admin', 'worker'):
+        return jsonify({'success': False, 'message': 'Unauthorized. Staff access required.'}), 403
+    # Browsers send Last-Event-ID when they reconnect
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    body = events.stream(dashboard_view(role, user_id), last_event_id,
+                         snapshot=lambda: {'stats': dashboard_stats(role, user_id)})
+    return Response(stream_with_context(body), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/admin/dashboard')
 @login_required
 @role_required('admin')
@@ -814,36 +1427,29 @@ def change_password():
     return redirect(url_for('profile'))
 
 
-def _remove_file_if_exists(path):
-    try:
-        # path stored as 'static/uploads/filename'
-        if path:
-            fp = os.path.join(BASE_DIR, path.replace('/', os.sep))
-            if os.path.exists(fp):
-                os.remove(fp)
-    except Exception:
-        pass
+def release_uploads_later(*paths):
+    # A background job unlinks the files (and derivatives) if nothing references them
+    if run_write(upload_gc.enqueue_release, paths):
+        jobs.notify()
 
 
 @app.route('/profile/delete', methods=['POST'])
 @login_required
 def delete_account():
     user_id = session['user_id']
-    db = get_db()
-    cur = db.cursor()
-    # Delete related complaint images from disk
-    cur.execute('SELECT image_before_path, image_after_path FROM complaints WHERE user_id=?', (user_id,))
-    rows = cur.fetchall()
-    for r in rows:
-        if r['image_before_path']:
-            _remove_file_if_exists(r['image_before_path'])
-        if r['image_after_path']:
-            _remove_file_if_exists(r['image_after_path'])
-    # Delete complaints
-    cur.execute('DELETE FROM complaints WHERE user_id=?', (user_id,))
-    # Delete user
-    cur.execute('DELETE FROM users WHERE id=?', (user_id,))
-    db.commit()
+
+    def delete_user(conn):
+        rows = conn.execute('SELECT image_before_path, image_after_path FROM complaints_all WHERE user_id=?', (user_id,)).fetchall()
+        # Delete complaints, hot and archived
+        conn.execute('DELETE FROM complaints WHERE user_id=?', (user_id,))
+        conn.execute('DELETE FROM complaints_archive WHERE user_id=?', (user_id,))
+        # Delete user
+        conn.execute('DELETE FROM users WHERE id=?', (user_id,))
+        # Reference counts dropped with the rows; a job unlinks the images nobody else uses
+        return upload_gc.enqueue_release(conn, [path for r in rows for path in r])
+
+    if run_write(delete_user):
+        jobs.notify()
     session.clear()
     flash('Your account and related complaints have been deleted.', 'info')
     return redirect(url_for('login'))
@@ -855,9 +1461,66 @@ def delete_account():
 def worker_open_complaints():
     db = get_db()
     cur = db.cursor()
-    cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status IN ('Pending','Accepted','In Progress') ORDER BY c.created_at ASC")
-    complaints = cur.fetchall()
-    return render_template('worker_open_complaints.html', complaints=complaints)
+    # Linked duplicate reports are handled through their primary complaint. The
+    # planner prefers idx_complaints_cluster (cluster_id IS NULL) and then sorts
+    # every open row; the partial index returns them already in page order.
+    page = fetch_page(cur, "SELECT c.*, u.username as reporter, "
+                           "(SELECT COUNT(*) FROM complaints d WHERE d.cluster_id=c.id) AS duplicates "
+                           "FROM complaints c INDEXED BY idx_complaints_open_primary JOIN users u ON c.user_id=u.id",
+                      "c.status IN ('Pending','Accepted','In Progress') AND c.cluster_id IS NULL", (), 'c.created_at',
+                      descending=False, **page_args())
+    return render_page('worker_open_complaints.html', 'complaints', page)
+
+
+def plan_worker_route(worker_id, lat=None, lon=None):
+    """
+    Visiting order for the open complaints a worker can take (unassigned or
+    their own), starting at (lat, lon) or at the oldest complaint
+
+    Returns:
+        tuple: (list of stop dicts in visiting order, total metres, start)
+    """
+    cur = get_db().cursor()
+    # Same partial index as the open-work list; otherwise planned as a lookup of
+    # cluster_id IS NULL (nearly every row) and a sort of the whole queue
+    cur.execute("""SELECT c.id, c.description, c.status, c.latitude, c.longitude, c.created_at, u.username as reporter
+                   FROM complaints c INDEXED BY idx_complaints_open_primary JOIN users u ON c.user_id=u.id
+                   WHERE c.status IN ('Pending','Accepted','In Progress') AND c.cluster_id IS NULL
+                     AND (c.worker_id IS NULL OR c.worker_id=?)
+                     AND typeof(c.latitude) IN ('real','integer') AND typeof(c.longitude) IN ('real','integer')
+                   ORDER BY c.created_at ASC, c.id ASC LIMIT ?""", (worker_id, app.config['ROUTE_MAX_STOPS']))
+    stops = [dict(row) for row in cur.fetchall()]
+    if not stops:
+        return [], 0.0, None
+    start = (lat, lon) if lat is not None and lon is not None else (stops[0]['latitude'], stops[0]['longitude'])
+    plan = routing.plan_route(start, [(s['latitude'], s['longitude']) for s in stops],
+                              time_limit=app.config['ROUTE_TIME_LIMIT'])
+    ordered = []
+    total = 0.0
+    for index, leg in zip(plan['order'], plan['legs']):
+        total += leg
+        ordered.append(dict(stops[index], leg_m=round(leg, 1), cumulative_m=round(total, 1)))
+    return ordered, total, start
+
+
+@app.route('/worker/route')
+@login_required
+@role_required('worker')
+def worker_route():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    stops, total, start = plan_worker_route(session['user_id'], lat, lon)
+    return render_template('worker_route.html', stops=stops, total=total, start=start, located=lat is not None and lon is not None)
+
+
+@app.route('/api/worker/route', methods=['GET'])
+@login_required
+def worker_route_api():
+    """Planned visiting order of open complaints: ?lat=&lon="""
+    if session.get('role') != 'worker':
+        return jsonify({'success': False, 'message': 'Unauthorized. Worker access required.'}), 403
+    stops, total, start = plan_worker_route(session['user_id'], request.args.get('lat', type=float), request.args.get('lon', type=float))
+    return jsonify({'success': True, 'start': start, 'distance_m': round(total, 1), 'stops': stops}), 200
 
 
 @app.route('/worker/complaints/completed')
@@ -866,9 +1529,9 @@ def worker_open_complaints():
 def worker_completed_complaints():
     db = get_db()
     cur = db.cursor()
-    cur.execute("SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.status='Completed' AND c.worker_id=? ORDER BY c.updated_at DESC", (session['user_id'],))
-    complaints = cur.fetchall()
-    return render_template('worker_completed_complaints.html', complaints=complaints)
+    page = fetch_page(cur, "SELECT c.*, u.username as reporter FROM complaints_all c JOIN users u ON c.user_id=u.id",
+                      "c.status='Completed' AND c.worker_id=?", (session['user_id'],), 'c.updated_at', **page_args())
+    return render_page('worker_completed_complaints.html', 'complaints', page)
 
 
 @app.route('/worker/complaints/<int:cid>', methods=['GET'])
@@ -877,7 +1540,7 @@ def worker_completed_complaints():
 def worker_complaint_view(cid):
     db = get_db()
     cur = db.cursor()
-    cur.execute('SELECT c.*, u.username as reporter FROM complaints c JOIN users u ON c.user_id=u.id WHERE c.id=?', (cid,))
+    cur.execute('SELECT c.*, u.username as reporter FROM complaints_all c JOIN users u ON c.user_id=u.id WHERE c.id=?', (cid,))
     complaint = cur.fetchone()
     if complaint is None:
         flash('Complaint not found.', 'danger')
@@ -891,29 +1554,55 @@ def worker_complaint_view(cid):
 def worker_update(cid):
     new_status = request.form.get('status')
     after_file = request.files.get('image_after')
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM complaints WHERE id=?', (cid,))
+    # Version the form was rendered with; every write below is conditional on it
+    expected_version = request.form.get('version', type=int)
+    worker_id = session['user_id']
+    if new_status not in ('Accepted', 'In Progress', 'Completed'):
+        flash('Invalid status.', 'danger')
+        return redirect(url_for('worker_complaint_view', cid=cid))
+
+    cur = get_db().cursor()
+    cur.execute('SELECT image_after_path, version FROM complaints WHERE id=?', (cid,))
     complaint = cur.fetchone()
     if complaint is None:
         flash('Complaint not found.', 'danger')
         return redirect(url_for('worker_open_complaints'))
-
-    # Assign worker for accepted/in-progress/completed
-    worker_id = session['user_id']
+    version = complaint['version'] if expected_version is None else expected_version
+    # Only unassigned complaints or the worker's own, and only if nobody changed it since
+    condition = 'id=? AND version=? AND (worker_id IS NULL OR worker_id=?)'
 
     if new_status == 'Completed':
         if not after_file or after_file.filename == '':
             flash('Please upload after-cleaning image when marking Completed.', 'warning')
             return redirect(url_for('worker_complaint_view', cid=cid))
-        if after_file and allowed_file(after_file.filename):
-            filename = secure_filename(f"after_{int(datetime.utcnow().timestamp())}_{after_file.filename}")
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            after_file.save(save_path)
-            rel_path = f"static/uploads/{filename}"
-            cur.execute('UPDATE complaints SET status=?, image_after_path=?, worker_id=?, updated_at=? WHERE id=?',
-                        (new_status, rel_path, worker_id, datetime.utcnow(), cid))
-            db.commit()
+        if after_file and allowed_file(after_file.filename) and image_kind(after_file):
+            rel_path = store_upload(after_file)
+
+            def complete(conn):
+                ensure_stored(after_file, rel_path)
+                now = datetime.utcnow()
+                before = events.cluster_counts(conn, cid)
+                row = conn.execute(f'UPDATE complaints SET status=?, image_after_path=?, image_after_thumb=NULL, image_after_medium=NULL, worker_id=?, updated_at=?, version=version+1 WHERE {condition} RETURNING id',
+                                   (new_status, rel_path, worker_id, now, cid, version, worker_id)).fetchone()
+                if row is None:
+                    return None
+                # Linked duplicate reports are resolved in the same transaction
+                conn.execute('UPDATE complaints SET status=?, image_after_path=?, image_after_thumb=NULL, image_after_medium=NULL, worker_id=?, updated_at=?, version=version+1 WHERE cluster_id=?',
+                             (new_status, rel_path, worker_id, now, cid))
+                enqueue_derivatives(conn, cid, 'after', rel_path, worker_id)
+                # A replaced after image may no longer be referenced anywhere
+                if complaint['image_after_path'] != rel_path:
+                    upload_gc.enqueue_release(conn, [complaint['image_after_path']], worker_id)
+                return events.counter_deltas(before, events.cluster_counts(conn, cid))
+            deltas = run_write(complete)
+            if deltas is None:
+                # Nothing references the new upload; drop it unless it is shared
+                release_uploads_later(rel_path)
+                flash('This complaint was changed by someone else. Please review it and try again.', 'warning')
+                return redirect(url_for('worker_complaint_view', cid=cid))
+            jobs.notify()
+            events.publish('complaint', {'action': 'updated', 'deltas': deltas,
+                                         'complaint': {'id': cid, 'status': new_status, 'worker_id': worker_id}})
             flash('Complaint marked as Completed.', 'success')
             return redirect(url_for('worker_open_complaints'))
         else:
@@ -921,13 +1610,92 @@ def worker_update(cid):
             return redirect(url_for('worker_complaint_view', cid=cid))
     else:
         # Update status and set worker if accepting
-        cur.execute('UPDATE complaints SET status=?, worker_id=?, updated_at=? WHERE id=?',
-                    (new_status, worker_id, datetime.utcnow(), cid))
-        db.commit()
+        def update(conn):
+            now = datetime.utcnow()
+            before = events.cluster_counts(conn, cid)
+            row = conn.execute(f'UPDATE complaints SET status=?, worker_id=?, updated_at=?, version=version+1 WHERE {condition} RETURNING id',
+                               (new_status, worker_id, now, cid, version, worker_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE complaints SET status=?, worker_id=?, updated_at=?, version=version+1 WHERE cluster_id=?',
+                         (new_status, worker_id, now, cid))
+            return events.counter_deltas(before, events.cluster_counts(conn, cid))
+        deltas = run_write(update)
+        if deltas is None:
+            flash('This complaint was changed by someone else. Please review it and try again.', 'warning')
+            return redirect(url_for('worker_complaint_view', cid=cid))
+        events.publish('complaint', {'action': 'updated', 'deltas': deltas,
+                                     'complaint': {'id': cid, 'status': new_status, 'worker_id': worker_id}})
         flash('Status updated.', 'success')
         return redirect(url_for('worker_open_complaints'))
 
 
+@app.route('/api/worker/sync', methods=['GET'])
+@login_required
+def worker_sync():
+    """
+    Open complaints changed since a cursor: ?since=&limit=. Without since the
+    response is a (paged) snapshot. An idle poll with If-None-Match is a 304.
+    """
+    if session.get('role') != 'worker':
+        return jsonify({'success': False, 'message': 'Unauthorized. Worker access required.'}), 403
+    limit = request.args.get('limit', type=int) or app.config['SYNC_PAGE_SIZE']
+    limit = max(1, min(limit, app.config['SYNC_PAGE_SIZE']))
+    token = request.args.get('since', '')
+    cur = get_db().cursor()
+    head_seq = sync.head(cur)
+    # Weak: the same ETag covers the gzipped and the plain body
+    etag = sync.etag(token, head_seq, limit)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.vary.add('Accept-Encoding')
+    else:
+        try:
+            payload = sync.sync_page(cur, token, limit, head_seq)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid since cursor'}), 400
+        response = gzip_response(jsonify({'success': True, **payload}))
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/worker/claim', methods=['POST'])
+@login_required
+def worker_claim():
+    """
+    Atomically claim a pending complaint: JSON or form body with optional
+    complaint_id (default: the oldest claimable one) and version (the
+    version the client saw). 409 when someone else got there first.
+    """
+    if session.get('role') != 'worker':
+        return jsonify({'success': False, 'message': 'Unauthorized. Worker access required.'}), 403
+    data = request.get_json(silent=True) or request.form
+    try:
+        complaint_id = int(data['complaint_id']) if data.get('complaint_id') not in (None, '') else None
+        version = int(data['version']) if data.get('version') not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'complaint_id and version must be integers'}), 400
+
+    claimed = run_write(claim_complaint, session['user_id'], complaint_id, version)
+    if claimed is not None:
+        moved = 1 + claimed['linked']
+        events.publish('complaint', {
+            'action': 'claimed',
+            'complaint': {k: claimed[k] for k in ('id', 'status', 'worker_id')},
+            'deltas': {'statuses': {'Pending': -moved, 'Accepted': moved}, 'workers': {str(claimed['worker_id']): {'Accepted': moved}}},
+        })
+        return jsonify({'success': True, 'complaint': claimed}), 200
+    if complaint_id is None:
+        return jsonify({'success': False, 'message': 'No pending complaints to claim'}), 404
+    cur = get_db().cursor()
+    cur.execute('SELECT id, status, worker_id, version FROM complaints WHERE id=?', (complaint_id,))
+    current = cur.fetchone()
+    if current is None:
+        return jsonify({'success': False, 'message': 'Complaint not found'}), 404
+    return jsonify({'success': False, 'message': 'Complaint was already claimed or changed', 'complaint': dict(current)}), 409
+
 if __name__ == '__main__':
     # Close DB connection after each request
     app.teardown_appcontext(close_connection)
@@ -0,0 +1,141 @@
+"""
+Hot/cold archival of completed complaints
+Complaints completed more than ARCHIVE_AFTER_DAYS ago are moved from
+complaints to complaints_archive, so the open-work queries (worker lists,
+claims, the scheduler, sync) only walk the small hot table. Pages that show
+old complaints too - complaint details, public and admin reports, a user's
+own list, exports - read the complaints_all view, which SQLite turns into a
+merge of an index scan on each table.
+
+Rows are moved a cluster at a time (a primary together with its linked
+reports), ARCHIVE_BATCH_SIZE clusters per transaction. The archive.run job
+moves one batch and queues the next until nothing is left, then schedules
+itself for the next day. Counters, upload reference counts and the search
+index follow the rows through triggers (see migrations.py).
+
+Usage:
+    python archive.py --status                   # hot/archived row counts and the backlog
+    python archive.py --run [--days]             # archive now, in batches
+"""
+import sys
+import argparse
+
+from jobs import handler, enqueue
+
+ARCHIVE_CONFIG = {
+    'ARCHIVE_ENABLED': True,
+    'ARCHIVE_AFTER_DAYS': 90,       # completed (updated_at) at least this long ago
+    'ARCHIVE_BATCH_SIZE': 200,      # clusters moved per transaction
+}
+
+_RUN_INTERVAL = 24 * 3600
+
+# A cluster is archived only once every linked report is completed as well
+_CANDIDATES = ("SELECT id FROM complaints c WHERE status='Completed' AND updated_at < datetime('now', ?) "
+               "AND cluster_id IS NULL AND NOT EXISTS "
+               "(SELECT 1 FROM complaints d WHERE d.cluster_id = c.id AND d.status != 'Completed') "
+               "ORDER BY updated_at LIMIT ?")
+
+
+def configure_archive(config):
+    for key in ARCHIVE_CONFIG:
+        if key in config:
+            ARCHIVE_CONFIG[key] = config[key]
+
+
+def _age(days):
+    days = ARCHIVE_CONFIG['ARCHIVE_AFTER_DAYS'] if days is None else days
+    return f'-{int(days)} days'
+
+
+def archive_batch(conn, days=None, batch_size=None):
+    """
+    Move one batch of old completed clusters to complaints_archive; meant to
+    run through db.run_write()
+
+    Returns:
+        tuple: (clusters moved, rows moved)
+    """
+    batch_size = batch_size or ARCHIVE_CONFIG['ARCHIVE_BATCH_SIZE']
+    primaries = [row[0] for row in conn.execute(_CANDIDATES, (_age(days), batch_size)).fetchall()]
+    if not primaries:
+        return 0, 0
+    marks = ','.join('?' * len(primaries))
+    members = [row[0] for row in conn.execute(f'SELECT id FROM complaints WHERE cluster_id IN ({marks})', primaries)]
+    # Explicit columns: a schema mismatch fails here instead of shifting values
+    columns = ', '.join(row[1] for row in conn.execute('PRAGMA table_info(complaints)').fetchall())
+    moved = 0
+    # Linked reports go first; deleting a primary that still has them would re-link the cluster
+    for ids in (members, primaries):
+        if not ids:
+            continue
+        marks = ','.join('?' * len(ids))
+        conn.execute(f'INSERT INTO complaints_archive ({columns}) SELECT {columns} FROM complaints WHERE id IN ({marks})', ids)
+        moved += conn.execute(f'DELETE FROM complaints WHERE id IN ({marks})', ids).rowcount
+    return len(primaries), moved
+
+
+def _archive_step(conn, days, batch_size):
+    clusters, rows = archive_batch(conn, days, batch_size)
+    # Queued in the same transaction: the next batch right away, or tomorrow's run once caught up
+    more = clusters == (batch_size or ARCHIVE_CONFIG['ARCHIVE_BATCH_SIZE'])
+    enqueue(conn, 'archive.run', {'days': days, 'batch_size': batch_size}, delay=0 if more else _RUN_INTERVAL)
+    return clusters, rows, more
+
+
+@handler('archive.run')
+def archive_job(days=None, batch_size=None):
+    """Background job: archive one batch, then queue the next (or the next day's run)"""
+    from db import run_write
+
+    if not ARCHIVE_CONFIG['ARCHIVE_ENABLED']:
+        run_write(enqueue, 'archive.run', {'days': days, 'batch_size': batch_size}, delay=_RUN_INTERVAL)
+        return {'skipped': True}
+    clusters, rows, more = run_write(_archive_step, days, batch_size)
+    return {'clusters': clusters, 'rows': rows, 'done': not more}
+
+
+def archive_status(cur, days=None):
+    cur.execute('SELECT COUNT(*) FROM complaints')
+    hot = cur.fetchone()[0]
+    cur.execute('SELECT COUNT(*) FROM complaints_archive')
+    archived = cur.fetchone()[0]
+    cur.execute(f'SELECT COUNT(*) FROM ({_CANDIDATES})', (_age(days), -1))
+    return {'hot': hot, 'archived': archived, 'eligible_clusters': cur.fetchone()[0]}
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Move old completed complaints to the archive table')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--status', action='store_true', help='show hot and archived row counts')
+    group.add_argument('--run', action='store_true', help='archive eligible complaints now')
+    parser.add_argument('--days', type=int, default=ARCHIVE_CONFIG['ARCHIVE_AFTER_DAYS'])
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_CONFIG['ARCHIVE_BATCH_SIZE'])
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        if args.run:
+            clusters = rows = 0
+            while True:
+                moved_clusters, moved_rows = archive_batch(conn, args.days, args.batch_size)
+                # One short transaction per batch, so the app's writers are never held up for long
+                conn.commit()
+                clusters += moved_clusters
+                rows += moved_rows
+                if moved_clusters < args.batch_size:
+                    break
+            print(f"✓ Archived {rows} complaint(s) in {clusters} cluster(s).")
+        status = archive_status(cur, args.days)
+        print(f"Hot: {status['hot']}, archived: {status['archived']}, "
+              f"clusters completed over {args.days} days ago still hot: {status['eligible_clusters']}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Batch complaint submission
+Reports collected without coverage are sent together to /api/complaints/batch,
+either as multipart/form-data - an `items` field holding a JSON array (or
+NDJSON) plus one file part per photo, named by the item's `image` key - or as
+an application/x-ndjson body with each photo base64-encoded in `image_base64`.
+
+Every item carries a client-generated client_id and (user_id, client_id) is
+unique, so a batch retried after a lost response creates nothing twice: items
+already stored come back as 'duplicate' with their complaint id. Valid new
+items are inserted in a single transaction; invalid ones are reported per
+item and do not stop the others.
+"""
+import re
+import json
+from datetime import datetime, timezone
+
+from duplicates import cluster_assignment, find_primary
+
+BATCH_CONFIG = {
+    'BATCH_MAX_ITEMS': 50,
+    'BATCH_MAX_DESCRIPTION': 2000,
+}
+
+_CLIENT_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+
+def configure_batch(config):
+    for key in BATCH_CONFIG:
+        if key in config:
+            BATCH_CONFIG[key] = config[key]
+
+
+def parse_items(text):
+    """
+    Items from a JSON array or NDJSON (one object per line)
+
+    Raises:
+        ValueError: when the text is neither, or holds too many items
+    """
+    text = (text or '').strip()
+    if text.startswith('['):
+        try:
+            items = json.loads(text)
+        except ValueError:
+            raise ValueError('items is not valid JSON')
+    else:
+        items = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f'line {number} is not valid JSON')
+    if not items:
+        raise ValueError('No items in the batch')
+    if len(items) > BATCH_CONFIG['BATCH_MAX_ITEMS']:
+        raise ValueError(f"At most {BATCH_CONFIG['BATCH_MAX_ITEMS']} items per batch")
+    return items
+
+
+def _coordinate(value, bound):
+    if value in (None, ''):
+        return None
+    number = float(value)
+    if not -bound <= number <= bound:
+        raise ValueError
+    return number
+
+
+def _timestamp(value):
+    # Device clock in ISO 8601; stored as naive UTC like the other timestamps
+    if value in (None, ''):
+        return None
+    moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def validate_item(item):
+    """
+    Returns:
+        tuple: (cleaned item, None) or (None, error message)
+    """
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    client_id = item.get('client_id')
+    if not isinstance(client_id, str) or not _CLIENT_ID.match(client_id):
+        return None, 'client_id must be 1-64 letters, digits or ._:-'
+    description = item.get('description')
+    if not isinstance(description, str) or not description.strip():
+        return None, 'Description is required.'
+    if len(description) > BATCH_CONFIG['BATCH_MAX_DESCRIPTION']:
+        return None, f"Description is longer than {BATCH_CONFIG['BATCH_MAX_DESCRIPTION']} characters."
+    try:
+        latitude = _coordinate(item.get('latitude'), 90)
+        longitude = _coordinate(item.get('longitude'), 180)
+    except (TypeError, ValueError):
+        return None, 'latitude/longitude are out of range'
+    if (latitude is None) != (longitude is None):
+        return None, 'latitude and longitude go together'
+    try:
+        reported_at = _timestamp(item.get('created_at'))
+    except (TypeError, ValueError):
+        return None, 'created_at must be an ISO 8601 timestamp'
+    return {
+        'client_id': client_id,
+        'description': description.strip(),
+        'latitude': latitude,
+        'longitude': longitude,
+        'reported_at': reported_at,
+        'image': item['image'] if isinstance(item.get('image'), str) else None,
+        'image_base64': item['image_base64'] if isinstance(item.get('image_base64'), str) else None,
+    }, None
+
+
+# complaints_all: a retry can come after the first copy was archived
+_EXISTING = 'SELECT client_id, id FROM complaints_all WHERE user_id=? AND client_id IN ({marks})'
+
+
+def existing_ids(cur, user_id, client_ids):
+    """client_id -> complaint id for the ones this user already submitted, archived or not"""
+    if not client_ids:
+        return {}
+    cur.execute(_EXISTING.format(marks=','.join('?' * len(client_ids))), (user_id, *client_ids))
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def insert_batch(conn, user_id, items):
+    """
+    Insert the items not stored yet; meant to run through db.run_write()
+
+    Items are inserted one by one in the batch's transaction, so an item can
+    be linked to one inserted just before it (two photos of the same bin in
+    one batch end up in one cluster).
+
+    Args:
+        items (list): validated items with image_path and phash set
+
+    Returns:
+        tuple: (already stored: client_id -> id,
+                just created: client_id -> {id, status, worker_id, cluster_id})
+    """
+    cur = conn.cursor()
+    existing = existing_ids(cur, user_id, [item['client_id'] for item in items])
+    now = datetime.utcnow()
+    created = {}
+    for item in items:
+        if item['client_id'] in existing:
+            continue
+        # Linked to an open complaint nearby, as in app.create_complaint
+        primary_id = find_primary(cur, item['latitude'], item['longitude'], item['phash'])
+        status, worker_id, assigned_at = cluster_assignment(cur, primary_id)
+        cur.execute(
+            'INSERT INTO complaints (user_id, client_id, description, image_before_path, latitude, longitude, status, '
+            'worker_id, assigned_at, cluster_id, image_phash, reported_at, created_at, updated_at) '
+            'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+            (user_id, item['client_id'], item['description'], item['image_path'], item['latitude'], item['longitude'],
+             status, worker_id, assigned_at, primary_id, item['phash'], item['reported_at'], now, now))
+        created[item['client_id']] = {'id': cur.lastrowid, 'status': status, 'worker_id': worker_id,
+                                      'cluster_id': primary_id}
+    return existing, created
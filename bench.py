@@ -0,0 +1,494 @@
+"""
+Latency benchmark
+Drives every page and API route against a (seeded) database and reports
+p50/p95/p99 latency, throughput and peak RSS per route, in two modes:
+
+- client: requests one after another through the Flask test client, so the
+  numbers are the app's own cost (routing, queries, templates)
+- load: a threaded WSGI server on localhost with BENCH threads keeping
+  HTTP/1.1 connections busy, so the numbers include contention on the GIL,
+  the connection pool and the SQLite locks
+
+Results are written as JSON; --compare prints the change against an earlier
+file and exits non-zero when a route's p95 grew by more than --threshold.
+Peak RSS is sampled from /proc/self/statm while each route runs (elsewhere
+it falls back to the process-wide peak from getrusage()); it includes the
+database pages each SQLite connection has memory-mapped.
+
+Background jobs and the scheduler are switched off so they do not run in the
+middle of a measurement. Only GET routes run by default; --writes adds login,
+complaint submission and claims, which change the database - use a copy.
+
+Usage:
+    python seed_data.py --scale 100k --db bench.db --fresh
+    python bench.py --db bench.db -o baseline.json
+    python bench.py --db bench.db -o after.json --compare baseline.json [--threshold 0.2]
+    python bench.py --db bench.db --mode load --threads 16 --duration 5 --route public_reports
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import platform
+import argparse
+import threading
+import subprocess
+import http.client
+
+BENCH_REQUESTS = 50         # client mode: measured requests per route
+BENCH_WARMUP = 3            # unmeasured requests per route first (caches, templates)
+BENCH_THREADS = 8           # load mode: concurrent connections
+BENCH_DURATION = 3.0        # load mode: seconds per route
+BENCH_THRESHOLD = 0.2       # --compare: p95 growth counted as a regression
+BENCH_MIN_DELTA_MS = 1.0    # ...and only if it is at least this many ms (timer noise)
+
+_RSS_INTERVAL = 0.005
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class RssSampler:
+    """Background thread recording the highest resident set size since reset()"""
+
+    def __init__(self, interval=_RSS_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.per_route = os.path.exists('/proc/self/statm')
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * _PAGE_SIZE
+        except OSError:
+            import resource
+            # ru_maxrss is in KiB on Linux, bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def reset(self):
+        self.peak = self.current()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def start(self):
+        self.reset()
+        self._thread = threading.Thread(target=self._run, name='bench-rss', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def read(self):
+        return max(self.peak, self.current())
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies, errors, elapsed, peak_rss):
+    ordered = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'mean_ms': ms(sum(ordered) / len(ordered)) if ordered else None,
+        'p50_ms': ms(percentile(ordered, 50)),
+        'p95_ms': ms(percentile(ordered, 95)),
+        'p99_ms': ms(percentile(ordered, 99)),
+        'max_ms': ms(ordered[-1]) if ordered else None,
+        'rps': round(len(ordered) / elapsed, 1) if elapsed > 0 else None,
+        'peak_rss_mb': round(peak_rss / 1048576, 1),
+    }
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, mimetype) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {mimetype}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def _route(name, path, role=None, method='GET', body=None, content_type=None, expect=(200,)):
+    return {'name': name, 'method': method, 'path': path, 'role': role, 'body': body,
+            'content_type': content_type, 'expect': expect}
+
+
+def fixtures(cur):
+    """
+    Accounts and ids the route table points at: the busiest seeded citizen and
+    worker, one of their complaints, a stored photo and the middle of the data
+
+    Raises:
+        RuntimeError: when the database has no admin, citizen or worker with complaints
+    """
+    from storage import key_from_path
+
+    def one(sql, params=()):
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    found = {
+        'admin': one("SELECT id FROM users WHERE role='admin' ORDER BY id LIMIT 1"),
+        'user': one("SELECT scope_id FROM counters WHERE scope='user' GROUP BY scope_id ORDER BY SUM(value) DESC LIMIT 1"),
+        'worker': one("SELECT scope_id FROM counters WHERE scope='worker' GROUP BY scope_id ORDER BY SUM(value) DESC LIMIT 1"),
+    }
+    missing = [role for role, user_id in found.items() if user_id is None]
+    if missing:
+        raise RuntimeError(f"No {', '.join(missing)} account with complaints; seed the database first (seed_data.py)")
+    found['complaint'] = one('SELECT MAX(id) FROM complaints_all WHERE user_id=?', (found['user'],))
+    found['worker_complaint'] = one('SELECT MAX(id) FROM complaints_all WHERE worker_id=?', (found['worker'],))
+    photo = one("SELECT path FROM uploads WHERE refcount > 0 ORDER BY refcount DESC LIMIT 1")
+    found['upload_key'] = key_from_path(photo) if photo else None
+    found['photo'] = photo
+    cur.execute('SELECT AVG(latitude), AVG(longitude) FROM complaints WHERE latitude IS NOT NULL')
+    found['lat'], found['lon'] = cur.fetchone()
+    found['last_day'] = one("SELECT date(MAX(created_at), '-1 day') FROM complaints_all")
+    found['job'] = one('SELECT MAX(id) FROM jobs')
+    return found
+
+
+def route_table(fx, writes=False):
+    """Every route worth timing; the SSE stream and /logout are left out"""
+    lat, lon = round(fx['lat'] or 0, 5), round(fx['lon'] or 0, 5)
+    box = f"min_lat={lat - 0.02}&min_lon={lon - 0.02}&max_lat={lat + 0.02}&max_lon={lon + 0.02}"
+    routes = [
+        _route('index', '/', expect=(302,)),
+        _route('login_page', '/login'),
+        _route('register_page', '/register'),
+        _route('public_reports', '/reports/public'),
+        _route('public_reports_completed', '/reports/public?status=Completed'),
+        _route('nearby', f'/api/complaints/nearby?lat={lat}&lon={lon}&radius=1000'),
+        _route('nearby_open', f'/api/complaints/nearby?lat={lat}&lon={lon}&radius=5000&status=open'),
+        _route('bbox', f'/api/complaints/bbox?{box}'),
+        _route('search', '/api/complaints/search?q=garbage'),
+        _route('search_open', '/api/complaints/search?q=plastic+market&status=open'),
+        _route('user_dashboard', '/user/dashboard', 'user'),
+        _route('new_complaint', '/complaints/new', 'user'),
+        _route('my_complaints', '/complaints/my', 'user'),
+        _route('my_complaints_completed', '/complaints/my?status=Completed', 'user'),
+        _route('complaint_detail', f"/complaints/{fx['complaint']}", 'user'),
+        _route('profile', '/profile', 'user'),
+        _route('worker_dashboard', '/worker/dashboard', 'worker'),
+        _route('worker_open', '/worker/complaints/open', 'worker'),
+        _route('worker_completed', '/worker/complaints/completed', 'worker'),
+        _route('worker_route', '/worker/route', 'worker'),
+        _route('worker_route_api', '/api/worker/route', 'worker'),
+        _route('worker_sync', '/api/worker/sync', 'worker'),
+        _route('admin_dashboard', '/admin/dashboard', 'admin'),
+        _route('admin_reports', '/admin/reports', 'admin'),
+        _route('admin_reports_pending', '/admin/reports?filter=pending', 'admin'),
+        _route('admin_reports_completed', '/admin/reports?filter=completed', 'admin'),
+        _route('admin_reports_search', '/admin/reports?q=garbage', 'admin'),
+        _route('admin_users', '/admin/users', 'admin'),
+        _route('admin_workers', '/admin/workers', 'admin'),
+        _route('api_admin_workers', '/api/admin/workers', 'admin'),
+        _route('db_stats', '/api/admin/db-stats', 'admin'),
+        _route('upload_stats', '/api/admin/upload-stats', 'admin'),
+        _route('scheduler', '/api/admin/scheduler', 'admin'),
+        _route('events', '/api/admin/events', 'admin'),
+        _route('jobs', '/api/admin/jobs', 'admin'),
+    ]
+    if fx['worker_complaint']:
+        routes.append(_route('worker_complaint', f"/worker/complaints/{fx['worker_complaint']}", 'worker'))
+    if fx['job']:
+        routes.append(_route('job_status', f"/api/jobs/{fx['job']}", 'admin'))
+    if fx['last_day']:
+        # One day of rows keeps the export comparable with the other routes
+        routes.append(_route('export_csv', f"/api/admin/export?format=csv&since={fx['last_day']}", 'admin'))
+    if fx['upload_key']:
+        routes.append(_route('upload', f"/uploads/{fx['upload_key']}"))
+    if writes:
+        from storage import get_storage, key_from_path
+
+        body, content_type = _multipart({'email': 'seed-admin@example.com', 'password': 'password'}, {})
+        routes.append(_route('login_post', '/login', method='POST', body=body, content_type=content_type,
+                             expect=(302,)))
+        files = {}
+        if fx['photo']:
+            with get_storage().open(key_from_path(fx['photo'])) as f:
+                files['image_before'] = ('photo.jpg', f.read(), 'image/jpeg')
+        body, content_type = _multipart({'description': 'Benchmark report near the market', 'latitude': lat,
+                                         'longitude': lon}, files)
+        routes.append(_route('create_complaint', '/complaints/create', 'user', 'POST', body, content_type,
+                             expect=(302,)))
+        routes.append(_route('worker_claim', '/api/worker/claim', 'worker', 'POST', b'{}', 'application/json',
+                             expect=(200, 404, 409)))
+    return routes
+
+
+def _body_length(response):
+    # Consumes streamed bodies (export) the way a client would
+    return sum(len(chunk) for chunk in response.response)
+
+
+def run_client(app, routes, sessions, requests, warmup, sampler, progress=print):
+    """Sequential requests through the Flask test client"""
+    clients = {}
+    for role, user_id in sessions.items():
+        client = app.test_client()
+        if role:
+            with client.session_transaction() as s:
+                s['user_id'], s['role'], s['username'] = user_id, role, f'bench-{role}'
+        clients[role] = client
+    results = {}
+    for route in routes:
+        client = clients[route['role']]
+        latencies, errors = [], 0
+        sampler.reset()
+        for n in range(warmup + requests):
+            started = time.perf_counter()
+            response = client.open(route['path'], method=route['method'], data=route['body'],
+                                   content_type=route['content_type'])
+            _body_length(response)
+            response.close()
+            if n < warmup:
+                continue
+            latencies.append(time.perf_counter() - started)
+            if response.status_code not in route['expect']:
+                errors += 1
+        results[route['name']] = summarize(latencies, errors, sum(latencies), sampler.read())
+        progress(_line(route['name'], results[route['name']]))
+    return results
+
+
+def _cookies(app, sessions):
+    # Signed session cookies, so load threads can skip logging in
+    cookies = {None: None}
+    for role, user_id in sessions.items():
+        if role:
+            client = app.test_client()
+            with client.session_transaction() as s:
+                s['user_id'], s['role'], s['username'] = user_id, role, f'bench-{role}'
+            cookie = client.get_cookie('session')
+            cookies[role] = f'session={cookie.value}'
+    return cookies
+
+
+def run_load(app, routes, sessions, threads, duration, warmup, sampler, progress=print):
+    """Concurrent keep-alive HTTP connections against a threaded WSGI server"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class Handler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=Handler)
+    serving = threading.Thread(target=server.serve_forever, name='bench-server', daemon=True)
+    serving.start()
+    cookies = _cookies(app, sessions)
+    results = {}
+    try:
+        for route in routes:
+            headers = {'Content-Type': route['content_type']} if route['content_type'] else {}
+            if cookies[route['role']]:
+                headers['Cookie'] = cookies[route['role']]
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+
+            def worker(deadline, requests=None):
+                conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+                mine, failed = [], 0
+                try:
+                    # Every connection completes at least one request, however slow the route
+                    while (len(mine) < requests) if requests else (not mine or time.perf_counter() < deadline):
+                        started = time.perf_counter()
+                        try:
+                            conn.request(route['method'], route['path'], body=route['body'], headers=headers)
+                            response = conn.getresponse()
+                            response.read()
+                            ok = response.status in route['expect']
+                        except (OSError, http.client.HTTPException):
+                            conn.close()
+                            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+                            ok = False
+                        mine.append(time.perf_counter() - started)
+                        failed += not ok
+                finally:
+                    conn.close()
+                return mine, failed
+
+            def measured(deadline):
+                mine, failed = worker(deadline)
+                with lock:
+                    latencies.extend(mine)
+                    errors[0] += failed
+
+            if warmup:
+                worker(None, warmup)
+            sampler.reset()
+            started = time.perf_counter()
+            pool = [threading.Thread(target=measured, args=(started + duration,)) for _ in range(threads)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            elapsed = time.perf_counter() - started
+            results[route['name']] = summarize(latencies, errors[0], elapsed, sampler.read())
+            progress(_line(route['name'], results[route['name']]))
+    finally:
+        server.shutdown()
+        serving.join()
+    return results
+
+
+def _line(name, r):
+    fmt = lambda v: '-' if v is None else f'{v:.1f}'
+    return (f"  {name:<28} p50 {fmt(r['p50_ms']):>7} ms  p95 {fmt(r['p95_ms']):>7} ms  p99 {fmt(r['p99_ms']):>7} ms  "
+            f"{fmt(r['rps']):>7} req/s  {r['errors']} err  {r['peak_rss_mb']} MB")
+
+
+def environment(cur):
+    import sqlite3
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    counts = {}
+    for table in ('users', 'complaints', 'complaints_archive', 'uploads'):
+        cur.execute(f'SELECT COUNT(*) FROM {table}')
+        counts[table] = cur.fetchone()[0]
+    return {'commit': commit, 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'rows': counts,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(old, new, threshold=BENCH_THRESHOLD, min_delta_ms=BENCH_MIN_DELTA_MS, progress=print):
+    """
+    Print p95 and throughput changes per mode and route
+
+    Returns:
+        list: (mode, route) pairs whose p95 regressed beyond the threshold
+    """
+    regressions = []
+    if old.get('meta', {}).get('rows') != new.get('meta', {}).get('rows'):
+        progress(f"  Note: row counts differ ({old.get('meta', {}).get('rows')} vs {new.get('meta', {}).get('rows')})")
+    for mode, routes in new['results'].items():
+        before = old.get('results', {}).get(mode, {})
+        for name, r in routes.items():
+            b = before.get(name)
+            if not b or b.get('p95_ms') is None or r.get('p95_ms') is None:
+                progress(f"  {mode:<6} {name:<28} new")
+                continue
+            delta = r['p95_ms'] - b['p95_ms']
+            change = delta / b['p95_ms'] if b['p95_ms'] else 0.0
+            rps = f"{b['rps']:.0f} -> {r['rps']:.0f} req/s" if b.get('rps') and r.get('rps') else ''
+            regressed = change > threshold and delta >= min_delta_ms
+            mark = '✗' if regressed else '✓'
+            progress(f"{mark} {mode:<6} {name:<28} p95 {b['p95_ms']:.1f} -> {r['p95_ms']:.1f} ms ({change:+.0%})  {rps}")
+            if regressed:
+                regressions.append((mode, name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-route latency, throughput and memory')
+    parser.add_argument('--db', help='database file (default: WASTE_REPORT_DB or waste_report.db)')
+    parser.add_argument('--mode', choices=['client', 'load', 'both'], default='both')
+    parser.add_argument('--route', action='append', help='only this route name (repeatable)')
+    parser.add_argument('--list', action='store_true', help='list route names and exit')
+    parser.add_argument('--writes', action='store_true', help='also time login, submission and claims (changes the database)')
+    parser.add_argument('--requests', type=int, default=BENCH_REQUESTS, help='client mode: requests per route')
+    parser.add_argument('--warmup', type=int, default=BENCH_WARMUP)
+    parser.add_argument('--threads', type=int, default=BENCH_THREADS, help='load mode: concurrent connections')
+    parser.add_argument('--duration', type=float, default=BENCH_DURATION, help='load mode: seconds per route')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare with an earlier JSON result')
+    parser.add_argument('--threshold', type=float, default=BENCH_THRESHOLD, help='p95 growth counted as a regression')
+    args = parser.parse_args()
+
+    if args.db:
+        if not os.path.exists(args.db):
+            parser.error(f'{args.db} does not exist; create it with seed_data.py')
+        # Read by db.py when app is imported
+        os.environ['WASTE_REPORT_DB'] = os.path.abspath(args.db)
+    from app import app
+    import jobs
+    import scheduler
+    from db import connect
+
+    jobs.configure_jobs({'JOBS_ENABLED': False})
+    scheduler.configure_scheduler({'SCHEDULER_ENABLED': False})
+
+    conn = connect(readonly=True)
+    try:
+        cur = conn.cursor()
+        try:
+            fx = fixtures(cur)
+        except RuntimeError as e:
+            print(f"✗ {e}")
+            return 1
+        meta = environment(cur)
+    finally:
+        conn.close()
+    routes = route_table(fx, writes=args.writes)
+    if args.list:
+        for route in routes:
+            print(f"  {route['name']:<28} {route['method']:<5} {route['path']}  ({route['role'] or 'anonymous'})")
+        return 0
+    if args.route:
+        unknown = set(args.route) - {route['name'] for route in routes}
+        if unknown:
+            parser.error(f"unknown route(s): {', '.join(sorted(unknown))} (see --list)")
+        routes = [route for route in routes if route['name'] in args.route]
+
+    sessions = {None: None, 'user': fx['user'], 'worker': fx['worker'], 'admin': fx['admin']}
+    meta.update({'requests': args.requests, 'warmup': args.warmup, 'threads': args.threads, 'duration': args.duration,
+                 'writes': args.writes, 'rss_per_route': RssSampler().per_route})
+    print(f"Benchmarking {len(routes)} route(s) against {meta['rows']['complaints']} hot and "
+          f"{meta['rows']['complaints_archive']} archived complaints (commit {meta['commit'] or 'unknown'})")
+    sampler = RssSampler()
+    sampler.start()
+    results = {}
+    try:
+        if args.mode in ('client', 'both'):
+            print(f"Test client, {args.requests} sequential requests per route:")
+            results['client'] = run_client(app, routes, sessions, args.requests, args.warmup, sampler)
+        if args.mode in ('load', 'both'):
+            print(f"WSGI server, {args.threads} connections for {args.duration:g} s per route:")
+            results['load'] = run_load(app, routes, sessions, args.threads, args.duration, args.warmup, sampler)
+    finally:
+        sampler.stop()
+    report = {'meta': meta, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Results written to {args.output}")
+    errors = sum(r['errors'] for mode in results.values() for r in mode.values())
+    if errors:
+        print(f"✗ {errors} request(s) returned an unexpected status")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline.get('meta', {}).get('commit') or 'unknown'}):")
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"✗ {len(regressions)} route(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+        print("✓ No regressions.")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
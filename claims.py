@@ -0,0 +1,53 @@
+"""
+Atomic task claims
+A worker takes a pending complaint with one conditional UPDATE ... RETURNING:
+it only matches while the complaint is still Pending and unassigned (and,
+when the client sends the version it saw, still at that version). Two workers
+racing for the same complaint therefore get one success and one conflict,
+with no read-then-write window.
+
+complaints.version is bumped by every status change (claims, worker_update,
+the scheduler) so clients can detect that what they displayed is stale.
+
+Races of many workers through /api/worker/claim run under pytest in
+tests/test_claims.py (CLAIM_RACE_THREADS=64 for a larger run).
+"""
+from datetime import datetime
+
+_CLAIMABLE = "status='Pending' AND worker_id IS NULL AND cluster_id IS NULL"
+# INDEXED BY: with statistics the planner prefers idx_complaints_cluster
+# (cluster_id IS NULL matches nearly every row) and sorts all of them
+_NEXT = (f'SELECT id FROM complaints INDEXED BY idx_complaints_status_created '
+         f'WHERE {_CLAIMABLE} ORDER BY created_at, id LIMIT 1')
+
+
+def claim_complaint(conn, worker_id, complaint_id=None, version=None):
+    """
+    Claim a specific complaint, or the oldest claimable one when
+    complaint_id is None; meant to run through db.run_write()
+
+    Returns:
+        dict: id, status, worker_id and version of the claimed complaint and
+              the number of linked reports that moved with it, or None when
+              nothing matched
+    """
+    now = datetime.utcnow()
+    if complaint_id is None:
+        target = f'id = ({_NEXT})'
+        params = (worker_id, now, now)
+    else:
+        target = 'id = ?'
+        params = (worker_id, now, now, complaint_id)
+    sql = (f"UPDATE complaints SET status='Accepted', worker_id=?, version=version+1, updated_at=?, "
+           f"assigned_at=COALESCE(assigned_at, ?) WHERE {target} AND {_CLAIMABLE}")
+    if version is not None:
+        sql += ' AND version=?'
+        params += (version,)
+    row = conn.execute(sql + ' RETURNING id, status, worker_id, version', params).fetchone()
+    if row is None:
+        return None
+    # Linked duplicate reports follow their primary
+    linked = conn.execute("UPDATE complaints SET status='Accepted', worker_id=?, version=version+1, updated_at=?, "
+                          "assigned_at=COALESCE(assigned_at, ?) WHERE cluster_id=? AND status='Pending'",
+                          (worker_id, now, now, row[0])).rowcount
+    return {'id': row[0], 'status': row[1], 'worker_id': row[2], 'version': row[3], 'linked': linked}
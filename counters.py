@@ -0,0 +1,105 @@
+"""
+Materialized complaint/user counters
+The counters table is kept up to date by triggers (see migrations.py), so the
+dashboard stat helpers read a handful of rows instead of running COUNT(*) scans.
+
+Scopes:
+    complaints / 0        -> complaints per status
+    user / <user_id>      -> a reporter's complaints per status
+    worker / <worker_id>  -> complaints assigned to a worker per status
+    users / 0             -> users per role
+
+Usage:
+    python counters.py --verify    # report drift between counters and tables
+    python counters.py --rebuild   # recompute every counter from scratch
+"""
+import sys
+import sqlite3
+import argparse
+
+# Same grouping the triggers maintain, computed from the base tables;
+# complaints_all covers hot and archived complaints (see archive.py)
+_EXPECTED_QUERIES = [
+    "SELECT 'complaints', 0, status, COUNT(*) FROM {complaints} GROUP BY status",
+    "SELECT 'user', user_id, status, COUNT(*) FROM {complaints} GROUP BY user_id, status",
+    "SELECT 'worker', worker_id, status, COUNT(*) FROM {complaints} WHERE worker_id IS NOT NULL GROUP BY worker_id, status",
+    "SELECT 'users', 0, role, COUNT(*) FROM users GROUP BY role",
+]
+
+
+def read_counters(cur, scope, scope_id=0):
+    """
+    Read all counters of one scope
+
+    Returns:
+        dict: name -> value (missing names mean zero)
+    """
+    cur.execute('SELECT name, value FROM counters WHERE scope=? AND scope_id=?', (scope, scope_id))
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def rebuild_counters(cur, complaints='complaints_all'):
+    # Caller owns the transaction so the rebuild is atomic
+    cur.execute('DELETE FROM counters')
+    for query in _EXPECTED_QUERIES:
+        cur.execute('INSERT INTO counters (scope, scope_id, name, value) ' + query.format(complaints=complaints))
+
+
+def verify_counters(cur, complaints='complaints_all'):
+    """
+    Compare stored counters with a fresh count of the base tables
+
+    Returns:
+        list: (scope, scope_id, name, expected, actual) for every mismatch
+    """
+    expected = {}
+    for query in _EXPECTED_QUERIES:
+        cur.execute(query.format(complaints=complaints))
+        for scope, scope_id, name, value in cur.fetchall():
+            expected[(scope, scope_id, name)] = value
+
+    cur.execute('SELECT scope, scope_id, name, value FROM counters')
+    actual = {(scope, scope_id, name): value for scope, scope_id, name, value in cur.fetchall()}
+
+    drift = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        e, a = expected.get(key, 0), actual.get(key, 0)
+        if e != a:
+            drift.append(key + (e, a))
+    return drift
+
+
+def main():
+    from db import DB_PATH
+
+    parser = argparse.ArgumentParser(description='Verify or rebuild dashboard counters')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--verify', action='store_true', help='report counters that drifted from the tables')
+    group.add_argument('--rebuild', action='store_true', help='recompute all counters from the tables')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.isolation_level = None
+    cur = conn.cursor()
+    try:
+        if args.rebuild:
+            cur.execute('BEGIN IMMEDIATE')
+            rebuild_counters(cur)
+            cur.execute('COMMIT')
+            print("✓ Counters rebuilt.")
+            return 0
+
+        drift = verify_counters(cur)
+        if not drift:
+            print("✓ Counters match the complaints (hot and archived) and users tables.")
+            return 0
+        for scope, scope_id, name, expected, actual in drift:
+            print(f"✗ {scope}/{scope_id}/{name}: expected {expected}, stored {actual}")
+        print("Run 'python counters.py --rebuild' to fix.")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,64 +1,346 @@
 import os
+import json
+import time
+import base64
 import sqlite3
-from flask import g
+import queue
+import weakref
+import threading
+from urllib.request import pathname2url
+from concurrent.futures import Future
+from flask import g, request, has_request_context
+from migrations import apply_migrations
+import profiling
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'waste_report.db')
+DB_PATH = os.environ.get('WASTE_REPORT_DB', os.path.join(BASE_DIR, 'waste_report.db'))
+
+# Connection tuning, overridable through configure_db(app.config)
+DB_CONFIG = {
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',         # safe with WAL, far fewer fsyncs than FULL
+    'SQLITE_CACHE_SIZE_KB': 16384,
+    'SQLITE_MMAP_SIZE': 128 * 1024 * 1024,
+    'SQLITE_HEALTH_CHECK_INTERVAL': 30,     # seconds before a reused connection is probed again
+    'SQLITE_READONLY_GET': True,            # GET/HEAD requests read through mode=ro connections
+    'SQLITE_WRITER_ENABLED': True,          # route writes through the group-commit writer thread
+    'SQLITE_WRITER_MAX_BATCH': 64,          # most writes committed together in one transaction
+    'SQLITE_WRITER_MAX_LATENCY_MS': 2,      # how long the writer waits to fill a batch
+}
+
+# One connection per thread (and process), reused across requests
+_local = threading.local()
+_open_connections = weakref.WeakSet()
+_stats_lock = threading.Lock()
+_stats = {'opened': 0, 'readonly_opened': 0, 'reused': 0, 'health_check_failures': 0}
+
+
+class ManagedConnection(sqlite3.Connection):
+    # Subclass so connections can be tracked with weak references
+    pass
+
+
+def configure_db(config):
+    # Pick up SQLITE_* overrides from the Flask config
+    for key in DB_CONFIG:
+        if key in config:
+            DB_CONFIG[key] = config[key]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def connect(path=None, readonly=False, check_same_thread=True):
+    """Open a new tuned connection (WAL, busy timeout, cache and mmap pragmas)"""
+    busy_ms = int(DB_CONFIG['SQLITE_BUSY_TIMEOUT_MS'])
+    path = path or DB_PATH
+    if readonly:
+        # mode=ro: SQLite refuses writes, and WAL lets these readers run
+        # alongside the writer without taking the write lock
+        uri = 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=busy_ms / 1000.0, factory=ManagedConnection,
+                               check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(path, timeout=busy_ms / 1000.0, factory=ManagedConnection,
+                               check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    if not readonly:
+        conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={busy_ms}')
+    conn.execute(f"PRAGMA synchronous={DB_CONFIG['SQLITE_SYNCHRONOUS']}")
+    conn.execute(f"PRAGMA cache_size=-{int(DB_CONFIG['SQLITE_CACHE_SIZE_KB'])}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_CONFIG['SQLITE_MMAP_SIZE'])}")
+    _open_connections.add(conn)
+    _count('readonly_opened' if readonly else 'opened')
+    return conn
+
+
+def _healthy(conn):
+    try:
+        conn.execute('SELECT 1').fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def _thread_connection(readonly=False):
+    # Each thread keeps at most one read-write and one read-only connection
+    if getattr(_local, 'pid', None) != os.getpid():
+        # Connections inherited across fork() must not be used by the child
+        _local.conns = {}
+        _local.checked_at = {}
+        _local.pid = os.getpid()
+    conn = _local.conns.get(readonly)
+    if conn is not None:
+        interval = DB_CONFIG['SQLITE_HEALTH_CHECK_INTERVAL']
+        if time.monotonic() - _local.checked_at[readonly] >= interval:
+            if _healthy(conn):
+                _local.checked_at[readonly] = time.monotonic()
+            else:
+                _count('health_check_failures')
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                conn = None
+    if conn is None:
+        conn = connect(readonly=readonly)
+        _local.conns[readonly] = conn
+        _local.checked_at[readonly] = time.monotonic()
+    else:
+        _count('reused')
+    return conn
 
 
 def get_db():
-    # Return a connection with row access by column name
+    # Return this thread's connection, with row access by column name.
+    # GET/HEAD requests get a read-only connection so they never take the write lock.
     db = getattr(g, '_database', None)
     if db is None:
-        db = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
+        readonly = (DB_CONFIG['SQLITE_READONLY_GET'] and has_request_context()
+                    and request.method in ('GET', 'HEAD'))
+        db = _thread_connection(readonly=readonly)
         g._database = db
+        # Per-request SQL tracing (a no-op when profiling is off)
+        profiling.attach(db)
     return db
 
 
 def close_connection(e=None):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    # Release the connection back to the thread; uncommitted work is discarded
+    db = g.pop('_database', None)
+    if db is not None and db.in_transaction:
+        try:
+            db.rollback()
+        except sqlite3.Error:
+            pass
+
+
+class GroupCommitWriter:
+    """
+    Single writer thread that applies queued write functions in order.
+
+    Writes arriving within SQLITE_WRITER_MAX_LATENCY_MS of each other share
+    one transaction (group commit), so a burst of submissions costs one
+    fsync per batch instead of one per request. Each write runs inside its
+    own SAVEPOINT, so a failing write is rolled back without affecting the
+    rest of its batch.
+    """
+
+    def __init__(self, max_batch, max_latency_ms):
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.stats = {'writes': 0, 'failed': 0, 'batches': 0, 'largest_batch': 0}
+        self.thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.queue.put((future, fn, args, kwargs))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect()
+        conn.isolation_level = None
+        while True:
+            batch = self._next_batch()
+            results = []
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for future, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute('SAVEPOINT queued_write')
+                    try:
+                        result = fn(conn, *args, **kwargs)
+                        conn.execute('RELEASE queued_write')
+                        results.append((future, result, None))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO queued_write')
+                        conn.execute('RELEASE queued_write')
+                        results.append((future, None, e))
+                conn.execute('COMMIT')
+            except Exception as e:
+                # The batch as a whole failed (lock timeout, disk error): fail every write in it
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                results = [(future, None, e) for future, _, _, _ in batch if not future.cancelled()]
+
+            with _stats_lock:
+                self.stats['batches'] += 1
+                self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+                for future, result, error in results:
+                    self.stats['failed' if error else 'writes'] += 1
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        # Threads do not survive fork(), so each process starts its own writer
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = GroupCommitWriter(int(DB_CONFIG['SQLITE_WRITER_MAX_BATCH']),
+                                        float(DB_CONFIG['SQLITE_WRITER_MAX_LATENCY_MS']))
+        return _writer
+
+
+def run_write(fn, *args, **kwargs):
+    """
+    Run fn(conn, *args, **kwargs) as a write transaction and return its result.
+
+    fn must not call commit() or rollback(); the writer commits it together
+    with other queued writes. Exceptions raised by fn are re-raised here.
+    """
+    if not DB_CONFIG['SQLITE_WRITER_ENABLED']:
+        conn = _thread_connection(readonly=False)
+        if has_request_context():
+            # Runs on the request's thread: trace it like the request's own statements
+            profiling.attach(conn)
+        try:
+            result = fn(conn, *args, **kwargs)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+    return _get_writer().submit(fn, *args, **kwargs).result()
+
+
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+        if _writer is not None:
+            stats['writer'] = dict(_writer.stats, queued=_writer.queue.qsize())
+    stats['open_connections'] = len(_open_connections)
+    stats['config'] = dict(DB_CONFIG)
+    return stats
+
+
+def encode_cursor(sort_value, row_id):
+    # Opaque, URL-safe token for a keyset position (sort value, id)
+    raw = json.dumps([sort_value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    # Returns (sort_value, id) or None when the token is missing or malformed
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(raw)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def fetch_page(cur, select, where, params, sort_col, descending=True, after=None, before=None, limit=20):
+    """
+    Fetch one keyset page of `select` ordered by (sort_col, id).
+
+    Only `limit + 1` rows are read whatever the table size, so the cost of a
+    page does not depend on how deep into the list it is.
+
+    Args:
+        cur: sqlite3 cursor
+        select (str): SELECT ... FROM ... part of the query
+        where (str): extra filter condition (may be empty)
+        params (tuple): parameters for `where`
+        sort_col (str): column to order by, e.g. 'c.created_at'
+        descending (bool): newest first when True
+        after (str): cursor token, return the page following it
+        before (str): cursor token, return the page preceding it
+        limit (int): page size
+
+    Returns:
+        tuple: (rows, next_cursor, prev_cursor) - cursors are None at the ends
+    """
+    prefix = sort_col.rsplit('.', 1)[0] + '.' if '.' in sort_col else ''
+    id_col = prefix + 'id'
+    sort_key = sort_col.rsplit('.', 1)[-1]
+
+    after_pos = decode_cursor(after)
+    before_pos = decode_cursor(before) if after_pos is None else None
+    # Walking backwards flips both the comparison and the scan direction
+    backwards = before_pos is not None
+    scan_desc = descending != backwards
+
+    conditions = [where] if where else []
+    args = list(params)
+    position = before_pos if backwards else after_pos
+    if position is not None:
+        conditions.append(f"({sort_col}, {id_col}) {'<' if scan_desc else '>'} (?, ?)")
+        args.extend(position)
+
+    order = 'DESC' if scan_desc else 'ASC'
+    query = select
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(f'({c})' for c in conditions)
+    query += f' ORDER BY {sort_col} {order}, {id_col} {order} LIMIT ?'
+    args.append(limit + 1)
+
+    cur.execute(query, args)
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_more or backwards:
+            next_cursor = encode_cursor(last[sort_key], last['id'])
+        if (has_more and backwards) or after_pos is not None:
+            prev_cursor = encode_cursor(first[sort_key], first['id'])
+    return rows, next_cursor, prev_cursor
 
 
 def init_db():
-    # Create DB file and tables if missing
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Users table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        phone TEXT,
-        password_hash TEXT NOT NULL,
-        role TEXT NOT NULL,
-        created_at TEXT,
-        firebase_uid TEXT UNIQUE
-    );
-    ''')
-
-    # Complaints table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS complaints (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        worker_id INTEGER,
-        description TEXT NOT NULL,
-        image_before_path TEXT NOT NULL,
-        image_after_path TEXT,
-        latitude REAL,
-        longitude REAL,
-        status TEXT NOT NULL,
-        created_at TEXT,
-        updated_at TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (worker_id) REFERENCES users(id)
-    );
-    ''')
-
-    conn.commit()
+    # Create DB file if missing and bring the schema up to the latest version
+    conn = connect()
+    apply_migrations(conn)
     conn.close()
@@ -0,0 +1,78 @@
+"""
+Duplicate-report detection
+A new complaint near an open complaint reported within the time window is
+linked to that complaint's cluster instead of becoming separate work. When
+both photos have a perceptual hash, they must also look alike.
+
+Clusters are one level deep: linked reports carry cluster_id = id of the
+primary, the primary has cluster_id NULL. Workers only see primaries; status
+changes on a primary are copied to its linked reports (see app.worker_update).
+"""
+from datetime import datetime, timedelta
+
+import geo
+from images import hamming
+
+DUPLICATE_CONFIG = {
+    'DUPLICATE_DETECTION': True,
+    'DUPLICATE_RADIUS_M': 50,
+    'DUPLICATE_WINDOW_HOURS': 72,
+    'DUPLICATE_PHASH': True,                # hash before images and compare them
+    'DUPLICATE_PHASH_MAX_DISTANCE': 12,     # differing bits out of 64
+}
+
+_CANDIDATE_COLUMNS = 'c.id, c.latitude, c.longitude, c.created_at, c.cluster_id, c.image_phash'
+
+
+def configure_duplicates(config):
+    for key in DUPLICATE_CONFIG:
+        if key in config:
+            DUPLICATE_CONFIG[key] = config[key]
+
+
+def _coordinate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def find_primary(cur, latitude, longitude, phash=None):
+    """
+    Primary complaint a new report at (latitude, longitude) duplicates
+
+    Run it inside the write that inserts the report (run_write), so two
+    simultaneous reports of the same bin end up in one cluster.
+
+    Returns:
+        int: id of the cluster's primary complaint, or None
+    """
+    lat, lon = _coordinate(latitude), _coordinate(longitude)
+    if not DUPLICATE_CONFIG['DUPLICATE_DETECTION'] or lat is None or lon is None:
+        return None
+    since = str(datetime.utcnow() - timedelta(hours=DUPLICATE_CONFIG['DUPLICATE_WINDOW_HOURS']))
+    candidates = geo.nearby(cur, lat, lon, DUPLICATE_CONFIG['DUPLICATE_RADIUS_M'],
+                            limit=20, columns=_CANDIDATE_COLUMNS)
+    for candidate in candidates:
+        if str(candidate['created_at']) < since:
+            continue
+        if (phash and candidate['image_phash']
+                and hamming(phash, candidate['image_phash']) > DUPLICATE_CONFIG['DUPLICATE_PHASH_MAX_DISTANCE']):
+            continue
+        return candidate['cluster_id'] or candidate['id']
+    return None
+
+
+def cluster_assignment(cur, primary_id):
+    """
+    Status, worker_id and assigned_at a new report takes on: its primary's,
+    so a report linked to work already under way is assigned with it
+
+    Returns:
+        tuple: (status, worker_id, assigned_at); ('Pending', None, None)
+               without a primary
+    """
+    if primary_id is None:
+        return 'Pending', None, None
+    cur.execute('SELECT status, worker_id, assigned_at FROM complaints WHERE id=?', (primary_id,))
+    return tuple(cur.fetchone())
@@ -0,0 +1,235 @@
+"""
+Live dashboard events
+An in-process event bus feeding Server-Sent Events streams. Writers publish
+after their transaction has committed (see app.create_complaint,
+app.worker_update, app.worker_claim and scheduler.run_tick); each open
+stream gets the events through a per-role view that turns raw status deltas
+into dashboard counter deltas.
+
+Memory stays bounded both ways: the bus keeps only the last EVENTS_BUFFER
+events for replay, and a client whose queue reaches EVENTS_CLIENT_BUFFER is
+disconnected. Browsers reconnect on their own and send Last-Event-ID; events
+still in the ring buffer are replayed, otherwise the client gets a fresh
+counter snapshot.
+
+The bus lives in one process: with several server processes a dashboard sees
+the events published by the process serving its stream, and event ids from
+another process (or from before a restart) simply trigger a snapshot.
+"""
+import os
+import json
+import time
+import secrets
+import threading
+from collections import Counter, deque, namedtuple
+
+EVENTS_CONFIG = {
+    'EVENTS_ENABLED': True,
+    'EVENTS_BUFFER': 1000,              # events kept for Last-Event-ID replay
+    'EVENTS_CLIENT_BUFFER': 256,        # undelivered events per client before it is dropped
+    'EVENTS_HEARTBEAT': 15,             # seconds between keep-alive comments
+    'EVENTS_MAX_STREAM_SECONDS': 300,   # streams end after this; the browser reconnects
+    'EVENTS_RETRY_MS': 3000,            # reconnection delay suggested to the browser
+}
+
+Event = namedtuple('Event', 'seq kind data')
+
+
+def configure_events(config):
+    for key in EVENTS_CONFIG:
+        if key in config:
+            EVENTS_CONFIG[key] = config[key]
+
+
+class Subscriber:
+    """One open stream: a bounded queue of events not yet sent"""
+
+    def __init__(self, view, size):
+        self.view = view
+        self.size = size
+        self.pending = deque()
+        self.overflowed = False
+        self.wakeup = threading.Event()
+
+    def offer(self, event):
+        # Called with the bus lock held
+        if len(self.pending) >= self.size:
+            self.overflowed = True
+        else:
+            self.pending.append(event)
+        self.wakeup.set()
+
+    def wait(self, timeout):
+        """Events queued since the last call, waiting up to `timeout` seconds for one"""
+        self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        events = []
+        while self.pending:
+            events.append(self.pending.popleft())
+        return events
+
+
+class EventBus:
+    def __init__(self, buffer_size, client_buffer):
+        # Event ids are '<boot>-<seq>' so ids from another process or run are recognised
+        self.boot = secrets.token_hex(4)
+        self.pid = os.getpid()
+        self.client_buffer = client_buffer
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.ring = deque(maxlen=buffer_size)
+        self.subscribers = set()
+        self.stats = {'published': 0, 'connected': 0, 'dropped_slow': 0, 'replayed': 0, 'snapshots': 0}
+
+    def event_id(self, seq):
+        return f'{self.boot}-{seq}'
+
+    def _parse_id(self, event_id):
+        # Sequence number of one of our own ids, else None
+        boot, _, seq = (event_id or '').partition('-')
+        if boot != self.boot or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, kind, data):
+        with self.lock:
+            self.seq += 1
+            event = Event(self.seq, kind, data)
+            self.ring.append(event)
+            self.stats['published'] += 1
+            for subscriber in self.subscribers:
+                subscriber.offer(event)
+        return event
+
+    def subscribe(self, view, last_event_id=None, snapshot=None):
+        """
+        Register a stream
+
+        Args:
+            snapshot (callable): () -> snapshot data, called when the client
+                                 needs one; it runs under the bus lock, so the
+                                 snapshot and the events queued after it meet
+                                 at one sequence number and no delta is counted
+                                 twice or missed
+
+        Returns:
+            tuple: (subscriber, backlog events to replay, or None when the
+                   client needs a snapshot, current sequence number, the
+                   snapshot data or None)
+        """
+        subscriber = Subscriber(view, self.client_buffer)
+        with self.lock:
+            last_seq = self._parse_id(last_event_id)
+            # Replay only if nothing between last_seq and now has left the ring
+            oldest = self.ring[0].seq if self.ring else self.seq + 1
+            state = None
+            if last_seq is None or last_seq > self.seq or last_seq + 1 < oldest:
+                backlog = None
+                if snapshot is not None:
+                    state = snapshot()
+                self.stats['snapshots'] += 1
+            else:
+                backlog = [e for e in self.ring if e.seq > last_seq]
+                self.stats['replayed'] += len(backlog)
+            self.subscribers.add(subscriber)
+            self.stats['connected'] += 1
+            return subscriber, backlog, self.seq, state
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if subscriber.overflowed:
+                self.stats['dropped_slow'] += 1
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    """This process's bus (a forked server process gets its own)"""
+    global _bus
+    bus = _bus
+    if bus is not None and bus.pid == os.getpid():
+        return bus
+    with _bus_lock:
+        if _bus is None or _bus.pid != os.getpid():
+            _bus = EventBus(EVENTS_CONFIG['EVENTS_BUFFER'], EVENTS_CONFIG['EVENTS_CLIENT_BUFFER'])
+        return _bus
+
+
+def publish(kind, data):
+    if EVENTS_CONFIG['EVENTS_ENABLED']:
+        get_bus().publish(kind, data)
+
+
+def bus_stats():
+    bus = get_bus()
+    with bus.lock:
+        return dict(bus.stats, subscribers=len(bus.subscribers), buffered=len(bus.ring), last_id=bus.event_id(bus.seq))
+
+
+def cluster_counts(conn, complaint_id):
+    """(worker_id, status) -> rows, over a complaint and its linked reports"""
+    cur = conn.execute('SELECT worker_id, status, COUNT(*) FROM complaints WHERE id=? OR cluster_id=? '
+                       'GROUP BY worker_id, status', (complaint_id, complaint_id))
+    return Counter({(worker_id, status): count for worker_id, status, count in cur.fetchall()})
+
+
+def counter_deltas(before, after):
+    """
+    Status count changes between two cluster_counts() results
+
+    Returns:
+        dict: statuses {status: delta} and workers {worker_id: {status: delta}}
+    """
+    statuses, workers = Counter(), {}
+    for key in set(before) | set(after):
+        delta = after[key] - before[key]
+        if delta:
+            worker_id, status = key
+            statuses[status] += delta
+            if worker_id is not None:
+                workers.setdefault(str(worker_id), Counter())[status] += delta
+    return {
+        'statuses': {s: d for s, d in statuses.items() if d},
+        'workers': {w: {s: d for s, d in c.items() if d} for w, c in workers.items()},
+    }
+
+
+def _format(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def stream(view, last_event_id=None, snapshot=None):
+    """
+    Server-Sent Events body for one client
+
+    Args:
+        view (callable): event -> data to send, or None to skip the event
+        last_event_id (str): Last-Event-ID sent by a reconnecting browser
+        snapshot (callable): () -> data for a 'snapshot' event, sent when the
+                             missed events cannot be replayed
+    """
+    bus = get_bus()
+    subscriber, backlog, seq, state = bus.subscribe(view, last_event_id, snapshot)
+    try:
+        yield f"retry: {int(EVENTS_CONFIG['EVENTS_RETRY_MS'])}\n\n"
+        if backlog is None:
+            if snapshot is not None:
+                yield _format(bus.event_id(seq), 'snapshot', state)
+            backlog = []
+        deadline = time.monotonic() + EVENTS_CONFIG['EVENTS_MAX_STREAM_SECONDS']
+        while True:
+            for event in backlog:
+                data = view(event)
+                if data is not None:
+                    yield _format(bus.event_id(event.seq), event.kind, data)
+            if subscriber.overflowed or time.monotonic() >= deadline:
+                # The browser reconnects with the id of the last event it got
+                break
+            backlog = subscriber.wait(EVENTS_CONFIG['EVENTS_HEARTBEAT'])
+            if not backlog:
+                yield ': heartbeat\n\n'
+    finally:
+        bus.unsubscribe(subscriber)
@@ -0,0 +1,184 @@
+"""
+Streaming export of complaints
+Rows are read in id order, EXPORT_BATCH_SIZE at a time, each batch a short
+keyset query (id > last id seen) - no query stays open between batches, so
+an export of millions of rows neither holds memory nor keeps a read
+transaction pinning the WAL. The header goes out before the first query, so
+the download starts immediately.
+
+Usage:
+    python export.py --format csv > complaints.csv
+    python export.py --format ndjson --status Completed --since 2026-09-01 --until 2026-10-01 -o september.ndjson
+"""
+import io
+import sys
+import csv
+import json
+import argparse
+from datetime import datetime
+
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+COLUMNS = ['id', 'created_at', 'updated_at', 'reported_at', 'assigned_at', 'status', 'description',
+           'latitude', 'longitude', 'reporter', 'reporter_email', 'worker', 'cluster_id',
+           'image_before_path', 'image_after_path']
+
+_SELECT = ('SELECT c.id, c.created_at, c.updated_at, c.reported_at, c.assigned_at, c.status, c.description, '
+           'c.latitude, c.longitude, u.username AS reporter, u.email AS reporter_email, w.username AS worker, '
+           'c.cluster_id, c.image_before_path, c.image_after_path '
+           'FROM complaints_all c LEFT JOIN users u ON u.id = c.user_id LEFT JOIN users w ON w.id = c.worker_id')
+
+
+def parse_date(value):
+    """
+    YYYY-MM-DD or an ISO timestamp, as stored in created_at (None if empty)
+
+    Raises:
+        ValueError: for anything else
+    """
+    if not value:
+        return None
+    return str(datetime.fromisoformat(value))
+
+
+def _filters(cur, statuses, since, until):
+    # The unary + keeps the status and created_at indexes out of the batch
+    # query: each batch walks the id range, instead of collecting and sorting
+    # every matching row again
+    conditions, params = [], []
+    if statuses:
+        conditions.append(f"+c.status IN ({','.join('?' * len(statuses))})")
+        params += list(statuses)
+    if since or until:
+        # created_at grows with id: narrow the id range through the created_at
+        # index, and keep the exact date test for rows near the edges
+        date_conditions, date_params = [], []
+        if since:
+            date_conditions.append('created_at >= ?')
+            date_params.append(since)
+        if until:
+            date_conditions.append('created_at < ?')
+            date_params.append(until)
+        where = ' AND '.join(date_conditions)
+        cur.execute(f'SELECT MIN(id), MAX(id) FROM complaints_all WHERE {where}', date_params)
+        low, high = cur.fetchone()
+        if low is None:
+            return None, None
+        conditions.append('c.id BETWEEN ? AND ?')
+        params += [low, high]
+        conditions += ['+c.' + d for d in date_conditions]
+        params += date_params
+    return conditions, params
+
+
+def iter_rows(conn, statuses=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield complaint rows (sqlite3.Row) in id order, one keyset batch at a time
+
+    Args:
+        statuses (tuple): only these statuses (default: all)
+        since (str): created_at >= since
+        until (str): created_at < until
+    """
+    cur = conn.cursor()
+    conditions, params = _filters(cur, statuses, since, until)
+    if conditions is None:
+        return
+    last_id = 0
+    while True:
+        where = ' AND '.join(['c.id > ?'] + conditions)
+        cur.execute(f'{_SELECT} WHERE {where} ORDER BY c.id LIMIT ?', [last_id] + params + [batch_size])
+        rows = cur.fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]['id']
+        if len(rows) < batch_size:
+            return
+
+
+def _csv_cell(value):
+    # Text starting like a formula is prefixed so spreadsheets show it as text
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+
+def _csv_chunks(rows, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_cell(row[k]) for k in COLUMNS])
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows, batch_size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({k: row[k] for k in COLUMNS}, ensure_ascii=False, default=str))
+        if len(lines) == batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_export(conn, fmt='csv', statuses=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Export body as a generator of text chunks (one per batch)
+
+    Raises:
+        ValueError: for an unknown format
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format {fmt!r}')
+    rows = iter_rows(conn, statuses, since, until, batch_size)
+    chunks = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    return chunks(rows, batch_size)
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Export complaints as CSV or NDJSON')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--status', action='append', help='only this status (repeatable)')
+    parser.add_argument('--since', help='created on or after (YYYY-MM-DD)')
+    parser.add_argument('--until', help='created before (YYYY-MM-DD)')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    args = parser.parse_args()
+
+    try:
+        since, until = parse_date(args.since), parse_date(args.until)
+    except ValueError as e:
+        parser.error(str(e))
+    conn = connect(readonly=True)
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in stream_export(conn, args.format, args.status, since, until, args.batch_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Spatial queries over complaint coordinates
+Candidates come from the complaints_rtree R*Tree (kept in sync by triggers,
+see migrations.py). nearby() ranks them by an approximate (flat-earth)
+distance in SQL and computes exact great-circle distances only for the
+nearest few.
+"""
+import math
+
+EARTH_RADIUS_M = 6371008.8
+OPEN_STATUSES = ('Pending', 'Accepted', 'In Progress')
+
+_NEARBY_COLUMNS = 'c.id, c.description, c.status, c.latitude, c.longitude, c.created_at, c.image_before_path, c.image_before_thumb'
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    # Great-circle distance in metres
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_m):
+    """
+    Bounding box enclosing a circle
+
+    Returns:
+        list: (min_lat, max_lat, min_lon, max_lon) boxes; two when the circle
+              crosses the antimeridian
+    """
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    dlon = math.degrees(radius_m / (EARTH_RADIUS_M * math.cos(math.radians(lat))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def _box_where(boxes, statuses):
+    where = ' OR '.join(['(r.min_lat<=? AND r.max_lat>=? AND r.min_lon<=? AND r.max_lon>=?)'] * len(boxes))
+    params = []
+    for min_lat, max_lat, min_lon, max_lon in boxes:
+        params += [max_lat, min_lat, max_lon, min_lon]
+    where = f'({where})'
+    if statuses:
+        where += f" AND r.status IN ({','.join('?' * len(statuses))})"
+        params += list(statuses)
+    return where, params
+
+
+def _box_query(boxes, statuses, columns=_NEARBY_COLUMNS):
+    where, params = _box_where(boxes, statuses)
+    return f'SELECT {columns} FROM complaints_rtree r JOIN complaints c ON c.id=r.id WHERE {where}', params
+
+
+def _nearest_query(lat, lon, radius_m, statuses, limit, columns=_NEARBY_COLUMNS):
+    # The R*Tree stores points (min == max). Candidates in the box are ranked
+    # by squared equirectangular distance and only the first `limit` rows are
+    # joined to complaints. Longitude differences wrap at the antimeridian.
+    where, params = _box_where(bounding_box(lat, lon, radius_m), statuses)
+    sql = (f'SELECT {columns} FROM ('
+           'SELECT id FROM (SELECT r.id, r.min_lat - ? AS dlat, min(abs(r.min_lon - ?), 360 - abs(r.min_lon - ?)) AS dlon '
+           f'FROM complaints_rtree r WHERE {where}) '
+           'ORDER BY dlat * dlat + ? * dlon * dlon LIMIT ?'
+           ') n JOIN complaints c ON c.id=n.id')
+    return sql, [lat, lon, lon] + params + [math.cos(math.radians(lat)) ** 2, limit]
+
+
+def nearby(cur, lat, lon, radius_m, statuses=OPEN_STATUSES, limit=50, columns=_NEARBY_COLUMNS):
+    """
+    Complaints within `radius_m` metres of a point, nearest first
+
+    Args:
+        statuses (tuple): statuses to include, or None for all
+        columns (str): select list over complaints `c` (must include id,
+                       latitude and longitude)
+
+    Returns:
+        list: dicts of complaint columns plus distance_m
+    """
+    # The approximate order can differ from the great-circle one near the
+    # cut-off, so fetch a margin and apply the exact order below
+    sql, params = _nearest_query(lat, lon, radius_m, statuses, 2 * limit, columns)
+    cur.execute(sql, params)
+    results = []
+    for row in cur.fetchall():
+        distance = haversine_m(lat, lon, row['latitude'], row['longitude'])
+        if distance <= radius_m:
+            item = dict(row)
+            item['distance_m'] = round(distance, 1)
+            results.append(item)
+    results.sort(key=lambda item: (item['distance_m'], item['id']))
+    return results[:limit]
+
+
+def in_bbox(cur, min_lat, min_lon, max_lat, max_lon, statuses=OPEN_STATUSES, limit=500):
+    """
+    Complaints inside a map viewport (min_lon > max_lon wraps the antimeridian)
+
+    Returns:
+        list: dicts of complaint columns, newest first
+    """
+    if min_lon > max_lon:
+        boxes = [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    else:
+        boxes = [(min_lat, max_lat, min_lon, max_lon)]
+    sql, params = _box_query(boxes, statuses)
+    cur.execute(sql + ' ORDER BY c.created_at DESC, c.id DESC LIMIT ?', params + [limit])
+    return [dict(row) for row in cur.fetchall()]
@@ -0,0 +1,212 @@
+"""
+Image derivatives for uploaded photos
+Creates downscaled thumbnail and medium copies of an upload (EXIF orientation
+applied, optionally WebP) so list pages never download the phone originals.
+
+Usage:
+    python images.py --backfill    # create derivatives for existing uploads
+"""
+import io
+import os
+import sys
+import argparse
+
+from jobs import handler
+from storage import get_storage, key_from_path
+
+# Pillow is optional - without it the templates fall back to the originals
+try:
+    from PIL import Image, ImageOps, features
+    PIL_ENABLED = True
+    WEBP_SUPPORTED = features.check('webp')
+except ImportError:
+    PIL_ENABLED = False
+    WEBP_SUPPORTED = False
+
+# Longest edge in pixels for each derivative; suffix is appended to the file stem
+DERIVATIVE_SIZES = {'thumb': 320, 'medium': 960}
+SUFFIXES = {'thumb': '_thumb', 'medium': '_md'}
+
+
+def derivative_path(rel_path, kind, webp=True):
+    # 'static/uploads/ab/cd/x.jpg' -> 'static/uploads/ab/cd/x_thumb.webp'
+    stem = os.path.splitext(rel_path)[0]
+    ext = '.webp' if webp and WEBP_SUPPORTED else '.jpg'
+    return stem + SUFFIXES[kind] + ext
+
+
+def make_derivatives(rel_path, sizes=None, webp=True, quality=80):
+    """
+    Write thumbnail and medium copies next to an uploaded image (same
+    storage backend and directory as the original)
+
+    Args:
+        rel_path (str): stored path of the original, e.g. 'static/uploads/x.jpg'
+        sizes (dict): kind -> longest edge in pixels (default DERIVATIVE_SIZES)
+        webp (bool): encode as WebP when Pillow supports it, else JPEG
+        quality (int): encoder quality
+
+    Returns:
+        dict: kind -> stored path of the derivative, or {} when Pillow is
+              missing or the file cannot be decoded
+    """
+    if not PIL_ENABLED or not rel_path:
+        return {}
+    sizes = sizes or DERIVATIVE_SIZES
+    storage = get_storage()
+    try:
+        with storage.open(key_from_path(rel_path)) as src, Image.open(src) as img:
+            # Let the JPEG decoder skip straight to a reduced scale
+            img.draft('RGB', (max(sizes.values()),) * 2)
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            results = {}
+            # Largest first, each step resamples the previous (smaller) image
+            for kind, edge in sorted(sizes.items(), key=lambda kv: -kv[1]):
+                img.thumbnail((edge, edge), Image.LANCZOS)
+                out = derivative_path(rel_path, kind, webp)
+                fmt = 'WEBP' if out.endswith('.webp') else 'JPEG'
+                buf = io.BytesIO()
+                img.save(buf, fmt, quality=quality, optimize=fmt == 'JPEG')
+                buf.seek(0)
+                storage.put_stream(buf, key_from_path(out))
+                results[kind] = out
+            return results
+    except Exception as e:
+        print(f"Image derivative error for {rel_path}: {e}")
+        return {}
+
+
+def dhash(stream, size=8):
+    """
+    Difference hash of an image: 64 bits comparing neighbouring pixels of a
+    9x8 greyscale copy, robust to re-encoding and small crops
+
+    Returns:
+        str: 16 hex digits, or None when Pillow is missing or decoding fails
+    """
+    if not PIL_ENABLED:
+        return None
+    try:
+        stream.seek(0)
+        with Image.open(stream) as img:
+            img.draft('L', (size * 4, size * 4))
+            img = ImageOps.exif_transpose(img).convert('L').resize((size + 1, size), Image.LANCZOS)
+            # One byte per greyscale pixel, row by row
+            pixels = img.tobytes()
+        bits = 0
+        for row in range(size):
+            for col in range(size):
+                left = pixels[row * (size + 1) + col]
+                right = pixels[row * (size + 1) + col + 1]
+                bits = (bits << 1) | (left > right)
+        return f'{bits:0{size * size // 4}x}'
+    except Exception as e:
+        print(f"Image hash error: {e}")
+        return None
+    finally:
+        stream.seek(0)
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+@handler('images.derivatives')
+def derivatives_job(complaint_id, field, path, sizes=None, webp=True):
+    """Background job: create derivatives for one upload and record their paths"""
+    from db import run_write
+
+    storage = get_storage()
+    # Content-addressed uploads share derivatives with earlier copies of the same photo
+    existing = {kind: derivative_path(path, kind, webp) for kind in (sizes or DERIVATIVE_SIZES)}
+    if all(storage.exists(key_from_path(p)) for p in existing.values()):
+        results = existing
+    else:
+        results = make_derivatives(path, sizes, webp)
+    if not results:
+        return {}
+    if not storage.exists(key_from_path(path)):
+        # The original was released while we were resizing it
+        for p in results.values():
+            storage.delete(key_from_path(p))
+        return {}
+    # Only record them where the complaint (or a report linked to it) still points at the same upload
+    run_write(lambda conn: conn.execute(
+        f'UPDATE complaints SET image_{field}_thumb=?, image_{field}_medium=? WHERE (id=? OR cluster_id=?) AND image_{field}_path=?',
+        (results.get('thumb'), results.get('medium'), complaint_id, complaint_id, path)))
+    return results
+
+
+def backfill(conn, batch_size=100, webp=True):
+    """
+    Create derivatives for complaints uploaded before the pipeline existed
+
+    Walks complaints, then archived complaints, in id order, committing
+    after every batch.
+
+    Returns:
+        int: number of complaints updated
+    """
+    updated = 0
+    for table in ('complaints', 'complaints_archive'):
+        updated = _backfill_table(conn, table, updated, batch_size, webp)
+    return updated
+
+
+def _backfill_table(conn, table, updated, batch_size, webp):
+    last_id = 0
+    cur = conn.cursor()
+    while True:
+        cur.execute(f'''SELECT id, image_before_path, image_after_path FROM {table}
+                        WHERE id > ? AND ((image_before_path != '' AND image_before_thumb IS NULL)
+                                          OR (image_after_path IS NOT NULL AND image_after_thumb IS NULL))
+                        ORDER BY id LIMIT ?''', (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return updated
+        changes = []
+        for cid, before, after in rows:
+            b = make_derivatives(before, webp=webp) if before else {}
+            a = make_derivatives(after, webp=webp) if after else {}
+            if b or a:
+                changes.append((b.get('thumb'), b.get('medium'), a.get('thumb'), a.get('medium'), cid))
+        cur.executemany(f'''UPDATE {table} SET
+                                image_before_thumb=COALESCE(?, image_before_thumb),
+                                image_before_medium=COALESCE(?, image_before_medium),
+                                image_after_thumb=COALESCE(?, image_after_thumb),
+                                image_after_medium=COALESCE(?, image_after_medium)
+                            WHERE id=?''', changes)
+        conn.commit()
+        updated += len(changes)
+        last_id = rows[-1][0]
+        print(f"  ... {updated} complaint(s) updated (up to {table} id {last_id})")
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Image derivative tools')
+    parser.add_argument('--backfill', action='store_true', help='create derivatives for existing uploads')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--no-webp', action='store_true', help='write JPEG derivatives instead of WebP')
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+        return 0
+    if not PIL_ENABLED:
+        print("✗ Pillow is not installed. Run: pip install Pillow")
+        return 1
+    conn = connect()
+    try:
+        count = backfill(conn, batch_size=args.batch_size, webp=not args.no_webp)
+        print(f"✓ Backfill complete. {count} complaint(s) updated.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
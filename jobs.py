@@ -0,0 +1,294 @@
+"""
+Background jobs
+Durable job queue stored in the jobs table, executed off the request path by
+a thread (or process) pool. Handlers are registered with @handler('kind') in
+the modules listed in HANDLER_MODULES.
+
+A claimed job holds a lease; if its process dies the lease expires and the
+job is picked up again. Failed jobs are retried with exponential backoff
+until max_attempts is reached.
+
+Usage:
+    python jobs.py --status          # job counts by kind and status
+    python jobs.py --run             # process jobs in this process (Ctrl+C to stop)
+    python jobs.py --retry-failed    # re-queue jobs that ran out of attempts
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import importlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Modules imported before running jobs so their @handler functions are registered
+HANDLER_MODULES = ['images', 'search', 'sync', 'archive', 'upload_gc']
+
+HANDLERS = {}
+
+JOB_CONFIG = {
+    'JOBS_ENABLED': True,
+    'JOBS_EXECUTOR': 'thread',      # 'thread' or 'process'
+    'JOBS_WORKERS': 2,
+    'JOBS_POLL_INTERVAL': 1.0,      # seconds between polls when idle
+    'JOBS_LEASE_SECONDS': 300,      # a running job is re-claimed after this long
+    'JOBS_MAX_ATTEMPTS': 3,
+}
+
+# Upper bound on the pause after repeated claim/submit failures, in seconds
+_MAX_BACKOFF = 30
+
+
+def handler(kind):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def _load_handlers():
+    for name in HANDLER_MODULES:
+        importlib.import_module(name)
+
+
+def configure_jobs(config):
+    for key in JOB_CONFIG:
+        if key in config:
+            JOB_CONFIG[key] = config[key]
+
+
+def enqueue(conn, kind, payload, owner_id=None, max_attempts=None, delay=0):
+    """
+    Add a job; runs inside the caller's transaction so it commits atomically
+    with the write that needs it (e.g. inside a run_write function)
+
+    Returns:
+        int: job id
+    """
+    now = datetime.utcnow()
+    cur = conn.execute(
+        'INSERT INTO jobs (kind, payload, status, owner_id, attempts, max_attempts, run_after, created_at, updated_at) '
+        'VALUES (?,?,?,?,?,?,?,?,?)',
+        (kind, json.dumps(payload), 'queued', owner_id, 0, max_attempts or JOB_CONFIG['JOBS_MAX_ATTEMPTS'],
+         time.time() + delay, now, now))
+    return cur.lastrowid
+
+
+def get_job(cur, job_id):
+    cur.execute('SELECT id, kind, status, owner_id, attempts, max_attempts, last_error, result, created_at, updated_at '
+                'FROM jobs WHERE id=?', (job_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def job_summary(cur):
+    cur.execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status')
+    summary = {}
+    for kind, status, count in cur.fetchall():
+        summary.setdefault(kind, {})[status] = count
+    return summary
+
+
+def _execute(kind, payload):
+    # Top-level so it can run in a worker process as well as a thread
+    if kind not in HANDLERS:
+        _load_handlers()
+    fn = HANDLERS.get(kind)
+    if fn is None:
+        raise LookupError(f'No handler registered for job kind {kind!r}')
+    return fn(**payload)
+
+
+class JobRunner:
+    """Claims due jobs from the table and runs them on a pool"""
+
+    def __init__(self, workers=None, executor=None, poll_interval=None, lease_seconds=None):
+        from db import connect
+
+        self.workers = workers or JOB_CONFIG['JOBS_WORKERS']
+        self.poll_interval = poll_interval or JOB_CONFIG['JOBS_POLL_INTERVAL']
+        self.lease_seconds = lease_seconds or JOB_CONFIG['JOBS_LEASE_SECONDS']
+        kind = executor or JOB_CONFIG['JOBS_EXECUTOR']
+        pool_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        self.pool = pool_class(max_workers=self.workers)
+        # Shared by the claim loop and pool completion callbacks, guarded by self.lock
+        self.conn = connect(check_same_thread=False)
+        self.conn.isolation_level = None
+        self.pid = os.getpid()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.running = 0
+        self.lock = threading.Lock()
+        self.stats = {'claimed': 0, 'done': 0, 'retried': 0, 'failed': 0}
+        self.thread = threading.Thread(target=self._loop, name='job-runner', daemon=True)
+        _load_handlers()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, wait=True):
+        self.stopping.set()
+        self.wakeup.set()
+        if wait:
+            self.thread.join()
+        self.pool.shutdown(wait=wait)
+
+    def notify(self):
+        # Called after enqueue so new jobs start without waiting for the next poll
+        self.wakeup.set()
+
+    def _claim(self, limit):
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                '''UPDATE jobs SET status='running', attempts=attempts+1, locked_until=?, updated_at=?
+                   WHERE id IN (SELECT id FROM jobs
+                                WHERE (status='queued' AND run_after<=?)
+                                   OR (status='running' AND locked_until<?)
+                                ORDER BY id LIMIT ?)
+                   RETURNING id, kind, payload, attempts, max_attempts''',
+                (now + self.lease_seconds, datetime.utcnow(), now, now, limit))
+            return cur.fetchall()
+
+    def _finish(self, job_id, attempts, max_attempts, future):
+        error = future.exception()
+        try:
+            self._record(job_id, attempts, max_attempts, future, error)
+        except Exception as e:
+            # The job keeps its lease and is picked up again once it expires
+            print(f"Job {job_id}: could not record the result: {e!r}")
+        finally:
+            with self.lock:
+                self.running -= 1
+        if error is not None:
+            print(f"Job {job_id} failed (attempt {attempts}/{max_attempts}): {error!r}")
+        self.wakeup.set()
+
+    def _record(self, job_id, attempts, max_attempts, future, error):
+        now = datetime.utcnow()
+        with self.lock:
+            if error is None:
+                self.conn.execute("UPDATE jobs SET status='done', result=?, last_error=NULL, locked_until=NULL, updated_at=? WHERE id=?",
+                                  (json.dumps(future.result()), now, job_id))
+                self.stats['done'] += 1
+            elif attempts < max_attempts:
+                # Exponential backoff: 2s, 4s, 8s, ...
+                self.conn.execute("UPDATE jobs SET status='queued', run_after=?, last_error=?, locked_until=NULL, updated_at=? WHERE id=?",
+                                  (time.time() + 2 ** attempts, repr(error), now, job_id))
+                self.stats['retried'] += 1
+            else:
+                self.conn.execute("UPDATE jobs SET status='failed', last_error=?, locked_until=NULL, updated_at=? WHERE id=?",
+                                  (repr(error), now, job_id))
+                self.stats['failed'] += 1
+
+    def _submit(self, job_id, kind, payload, attempts, max_attempts):
+        with self.lock:
+            self.running += 1
+            self.stats['claimed'] += 1
+        try:
+            future = self.pool.submit(_execute, kind, json.loads(payload))
+        except Exception as e:
+            with self.lock:
+                self.running -= 1
+            if isinstance(e, RuntimeError):
+                # The pool has been shut down (stop() or interpreter exit)
+                self.stopping.set()
+            raise
+        future.add_done_callback(lambda f, j=job_id, a=attempts, m=max_attempts: self._finish(j, a, m, f))
+
+    def _loop(self):
+        failures = 0
+        while not self.stopping.is_set():
+            try:
+                free = self.workers - self.running
+                jobs = self._claim(free) if free > 0 else []
+                for job in jobs:
+                    self._submit(*job)
+                failures = 0
+            except Exception as e:
+                if self.stopping.is_set():
+                    break
+                # e.g. 'database is locked' beyond busy_timeout: claimed jobs are
+                # retried when their lease expires; back off and keep running
+                failures += 1
+                delay = min(self.poll_interval * 2 ** failures, _MAX_BACKOFF)
+                print(f"Job runner error, retrying in {delay:.1f}s: {e!r}")
+                self.stopping.wait(delay)
+                continue
+            if not jobs:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Start this process's job runner on first use (threads do not survive fork)"""
+    global _runner
+    if not JOB_CONFIG['JOBS_ENABLED']:
+        return None
+    runner = _runner
+    if runner is not None and runner.pid == os.getpid():
+        return runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            _runner = JobRunner().start()
+        return _runner
+
+
+def notify():
+    runner = get_runner()
+    if runner is not None:
+        runner.notify()
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Background job tools')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--status', action='store_true', help='show job counts by kind and status')
+    group.add_argument('--run', action='store_true', help='process jobs in the foreground')
+    group.add_argument('--retry-failed', action='store_true', help='re-queue failed jobs')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.run:
+        runner = JobRunner(workers=args.workers).start()
+        print(f"Processing jobs with {runner.workers} worker(s). Press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            runner.stop()
+        return 0
+
+    conn = connect()
+    try:
+        if args.retry_failed:
+            cur = conn.execute("UPDATE jobs SET status='queued', attempts=0, run_after=?, updated_at=? WHERE status='failed'",
+                               (time.time(), datetime.utcnow()))
+            conn.commit()
+            print(f"✓ Re-queued {cur.rowcount} job(s).")
+            return 0
+        summary = job_summary(conn.cursor())
+        if not summary:
+            print("No jobs.")
+        for kind, counts in sorted(summary.items()):
+            print(f"{kind}: " + ', '.join(f"{status}={count}" for status, count in sorted(counts.items())))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,36 +1,73 @@
 """
-Database migration script to add firebase_uid column to existing users table
-Run this script once to update your existing database
+Database migration script
+Applies pending schema migrations (see migrations.py) to the database.
+The app also runs them on startup; use this to migrate ahead of a deploy.
+
+Usage:
+    python migrate_db.py                 # apply all pending migrations
+    python migrate_db.py --status        # show current and pending versions
+    python migrate_db.py --check-plans   # verify the routes' queries use indexes (read-only requests)
 """
 import sqlite3
-import os
+import sys
+import argparse
+
+from db import DB_PATH
+from migrations import apply_migrations, current_version, pending_migrations, check_query_plans
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'waste_report.db')
 
 def migrate_database():
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    
     try:
-        # Check if firebase_uid column exists
-        cur.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cur.fetchall()]
-        
-        if 'firebase_uid' not in columns:
-            print("Adding firebase_uid column to users table...")
-            # Add column without UNIQUE constraint first (to allow existing rows)
-            cur.execute('ALTER TABLE users ADD COLUMN firebase_uid TEXT')
-            conn.commit()
-            print("✓ Migration successful! firebase_uid column added.")
+        applied = apply_migrations(conn)
+        if applied:
+            print(f"✓ Migration successful! Applied version(s): {', '.join(map(str, applied))}")
         else:
-            print("✓ Database already up to date. firebase_uid column exists.")
-            
+            print(f"✓ Database already up to date (version {current_version(conn)}).")
     except Exception as e:
         print(f"✗ Migration error: {e}")
-        conn.rollback()
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+def show_status():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        print(f"Current schema version: {current_version(conn)}")
+        pending = pending_migrations(conn)
+        if not pending:
+            print("No pending migrations.")
+        for version, description in pending:
+            print(f"  pending {version}: {description}")
     finally:
         conn.close()
 
+
+def check_plans():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        failures = check_query_plans(conn)
+    finally:
+        conn.close()
+    if not failures:
+        print("✓ All route queries are served by an index.")
+        return True
+    for name, (sql, details) in failures.items():
+        print(f"✗ {name}: {' '.join(sql.split())[:300]}\n    {' | '.join(details)}")
+    return False
+
+
 if __name__ == '__main__':
-    migrate_database()
+    parser = argparse.ArgumentParser(description='Smart Waste database migrations')
+    parser.add_argument('--status', action='store_true', help='show schema version and pending migrations')
+    parser.add_argument('--check-plans', action='store_true', help='fail if a route query does a full table scan, or a paginated one sorts')
+    args = parser.parse_args()
+
+    if args.status:
+        show_status()
+    elif args.check_plans:
+        sys.exit(0 if migrate_database() and check_plans() else 1)
+    else:
+        sys.exit(0 if migrate_database() else 1)
@@ -0,0 +1,734 @@
+"""
+Versioned schema migrations
+Each migration runs once, in version order, and is recorded in schema_version.
+Run automatically from db.init_db() on startup, or manually with migrate_db.py
+"""
+import re
+from datetime import datetime
+
+from counters import rebuild_counters
+from jobs import enqueue
+
+# (version, description, function(cursor)) - appended by the @migration decorator
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _columns(cur, table):
+    cur.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cur.fetchall()]
+
+
+@migration(1, 'Create users and complaints tables')
+def _base_tables(cur):
+    # IF NOT EXISTS: databases created before versioning already have them
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL,
+        created_at TEXT,
+        firebase_uid TEXT UNIQUE
+    );
+    ''')
+
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS complaints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        worker_id INTEGER,
+        description TEXT NOT NULL,
+        image_before_path TEXT NOT NULL,
+        image_after_path TEXT,
+        latitude REAL,
+        longitude REAL,
+        status TEXT NOT NULL,
+        created_at TEXT,
+        updated_at TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (worker_id) REFERENCES users(id)
+    );
+    ''')
+
+
+@migration(2, 'Add firebase_uid column to users')
+def _add_firebase_uid(cur):
+    # Databases created before Firebase integration lack this column
+    if 'firebase_uid' not in _columns(cur, 'users'):
+        cur.execute('ALTER TABLE users ADD COLUMN firebase_uid TEXT')
+
+
+@migration(3, 'Indexes for complaint list, count and user list queries')
+def _complaint_indexes(cur):
+    # The implicit rowid at the end of every index makes these usable for
+    # the (sort column, id) keyset ordering of the list views
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_created ON complaints(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_status_created ON complaints(status, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_status_updated ON complaints(status, updated_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_user_created ON complaints(user_id, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_user_status ON complaints(user_id, status, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_worker_status ON complaints(worker_id, status, updated_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)')
+
+
+
+def _bump(scope, scope_id, name, delta, when=None):
+    # Trigger statement adding `delta` to one counter row
+    if delta > 0:
+        stmt = (f"INSERT INTO counters (scope, scope_id, name, value) SELECT '{scope}', {scope_id}, {name}, {delta} "
+                f"WHERE {when or 1} ON CONFLICT(scope, scope_id, name) DO UPDATE SET value = value + {delta};")
+    else:
+        stmt = (f"UPDATE counters SET value = value - {-delta} "
+                f"WHERE scope='{scope}' AND scope_id={scope_id} AND name={name};")
+    return stmt
+
+
+def _complaint_bumps(row, delta):
+    return '\n'.join([
+        _bump('complaints', 0, f'{row}.status', delta),
+        _bump('user', f'{row}.user_id', f'{row}.status', delta),
+        _bump('worker', f'{row}.worker_id', f'{row}.status', delta, when=f'{row}.worker_id IS NOT NULL'),
+    ])
+
+
+@migration(4, 'Trigger-maintained counters for dashboard stats')
+def _counters(cur):
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS counters (
+        scope TEXT NOT NULL,
+        scope_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, scope_id, name)
+    ) WITHOUT ROWID;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_complaint_insert AFTER INSERT ON complaints
+    BEGIN
+        {_complaint_bumps('NEW', 1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_complaint_delete AFTER DELETE ON complaints
+    BEGIN
+        {_complaint_bumps('OLD', -1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_complaint_update AFTER UPDATE OF status, user_id, worker_id ON complaints
+    WHEN OLD.status IS NOT NEW.status OR OLD.user_id IS NOT NEW.user_id OR OLD.worker_id IS NOT NEW.worker_id
+    BEGIN
+        {_complaint_bumps('OLD', -1)}
+        {_complaint_bumps('NEW', 1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_user_insert AFTER INSERT ON users
+    BEGIN
+        {_bump('users', 0, 'NEW.role', 1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_user_delete AFTER DELETE ON users
+    BEGIN
+        {_bump('users', 0, 'OLD.role', -1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_counters_user_update AFTER UPDATE OF role ON users
+    WHEN OLD.role IS NOT NEW.role
+    BEGIN
+        {_bump('users', 0, 'OLD.role', -1)}
+        {_bump('users', 0, 'NEW.role', 1)}
+    END;
+    ''')
+    # Seed from existing rows (the archive table and complaints_all come later)
+    rebuild_counters(cur, complaints='complaints')
+
+
+@migration(5, 'Thumbnail and medium image paths on complaints')
+def _image_derivatives(cur):
+    existing = _columns(cur, 'complaints')
+    for column in ('image_before_thumb', 'image_before_medium', 'image_after_thumb', 'image_after_medium'):
+        if column not in existing:
+            cur.execute(f'ALTER TABLE complaints ADD COLUMN {column} TEXT')
+
+
+@migration(6, 'Durable background job queue')
+def _jobs(cur):
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        owner_id INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        result TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    );
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run ON jobs(status, run_after)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_locked ON jobs(status, locked_until)')
+
+
+def _upload_refs(row, delta, only_changed=False):
+    # Trigger statements adjusting uploads.refcount for both image columns of `row`
+    stmts = []
+    for column in ('image_before_path', 'image_after_path'):
+        value = f'{row}.{column}'
+        changed = f' AND OLD.{column} IS NOT NEW.{column}' if only_changed else ''
+        if delta > 0:
+            stmts.append(f"INSERT INTO uploads (path, refcount, created_at) SELECT {value}, 1, datetime('now') "
+                         f"WHERE {value} IS NOT NULL AND {value} != ''{changed} "
+                         f"ON CONFLICT(path) DO UPDATE SET refcount = refcount + 1;")
+        else:
+            stmts.append(f"UPDATE uploads SET refcount = refcount - 1 WHERE path = {value}{changed};")
+    return '\n'.join(stmts)
+
+
+@migration(7, 'Reference-counted upload files')
+def _uploads(cur):
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS uploads (
+        path TEXT PRIMARY KEY,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    ) WITHOUT ROWID;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_uploads_complaint_insert AFTER INSERT ON complaints
+    BEGIN
+        {_upload_refs('NEW', 1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_uploads_complaint_delete AFTER DELETE ON complaints
+    BEGIN
+        {_upload_refs('OLD', -1)}
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_uploads_complaint_update AFTER UPDATE OF image_before_path, image_after_path ON complaints
+    BEGIN
+        {_upload_refs('OLD', -1, only_changed=True)}
+        {_upload_refs('NEW', 1, only_changed=True)}
+    END;
+    ''')
+    # Count references held by existing complaints
+    cur.execute('''
+    INSERT OR REPLACE INTO uploads (path, refcount, created_at)
+    SELECT path, COUNT(*), datetime('now') FROM (
+        SELECT image_before_path AS path FROM complaints WHERE image_before_path IS NOT NULL AND image_before_path != ''
+        UNION ALL
+        SELECT image_after_path FROM complaints WHERE image_after_path IS NOT NULL AND image_after_path != ''
+    ) GROUP BY path
+    ''')
+
+
+def _rtree_insert(row):
+    # Only rows with numeric coordinates are indexed
+    return (f"INSERT INTO complaints_rtree (id, min_lat, max_lat, min_lon, max_lon, status) "
+            f"SELECT {row}.id, {row}.latitude, {row}.latitude, {row}.longitude, {row}.longitude, {row}.status "
+            f"WHERE typeof({row}.latitude) IN ('real', 'integer') AND typeof({row}.longitude) IN ('real', 'integer');")
+
+
+@migration(8, 'R*Tree spatial index on complaint coordinates')
+def _complaints_rtree(cur):
+    # status is an auxiliary column so open-only lookups skip closed rows without a join
+    cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS complaints_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon, +status)')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_rtree_complaint_insert AFTER INSERT ON complaints
+    BEGIN
+        {_rtree_insert('NEW')}
+    END;
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_rtree_complaint_delete AFTER DELETE ON complaints
+    BEGIN
+        DELETE FROM complaints_rtree WHERE id = OLD.id;
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_rtree_complaint_update AFTER UPDATE OF latitude, longitude, status ON complaints
+    BEGIN
+        DELETE FROM complaints_rtree WHERE id = OLD.id;
+        {_rtree_insert('NEW')}
+    END;
+    ''')
+    cur.execute('''
+    INSERT OR REPLACE INTO complaints_rtree (id, min_lat, max_lat, min_lon, max_lon, status)
+    SELECT id, latitude, latitude, longitude, longitude, status FROM complaints
+    WHERE typeof(latitude) IN ('real', 'integer') AND typeof(longitude) IN ('real', 'integer')
+    ''')
+
+
+
+@migration(9, 'Duplicate-report clusters and perceptual image hash')
+def _clusters(cur):
+    existing = _columns(cur, 'complaints')
+    # cluster_id points at the primary complaint; NULL for primaries and independent reports
+    if 'cluster_id' not in existing:
+        cur.execute('ALTER TABLE complaints ADD COLUMN cluster_id INTEGER')
+    if 'image_phash' not in existing:
+        cur.execute('ALTER TABLE complaints ADD COLUMN image_phash TEXT')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_cluster ON complaints(cluster_id)')
+    # A deleted primary hands its cluster to the oldest linked report
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_cluster_primary_delete AFTER DELETE ON complaints
+    WHEN EXISTS (SELECT 1 FROM complaints WHERE cluster_id = OLD.id)
+    BEGIN
+        UPDATE complaints SET cluster_id = (SELECT MIN(id) FROM complaints WHERE cluster_id = OLD.id)
+        WHERE cluster_id = OLD.id AND id != (SELECT MIN(id) FROM complaints WHERE cluster_id = OLD.id);
+        UPDATE complaints SET cluster_id = NULL WHERE cluster_id = OLD.id;
+    END;
+    ''')
+
+
+
+@migration(10, 'Assignment scheduler state and assigned_at')
+def _scheduler(cur):
+    if 'assigned_at' not in _columns(cur, 'complaints'):
+        cur.execute('ALTER TABLE complaints ADD COLUMN assigned_at TEXT')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS scheduler_state (
+        name TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TEXT
+    ) WITHOUT ROWID;
+    ''')
+
+
+
+@migration(11, 'Row version for optimistic concurrency on complaints')
+def _complaint_version(cur):
+    if 'version' not in _columns(cur, 'complaints'):
+        cur.execute('ALTER TABLE complaints ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+
+
+@migration(12, 'Full-text search index over complaint descriptions and reporters')
+def _complaints_fts(cur):
+    # rowid = complaints.id; prefix indexes keep search-as-you-type queries cheap
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS complaints_fts USING fts5("
+                "description, reporter, tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')")
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_complaint_insert AFTER INSERT ON complaints
+    BEGIN
+        INSERT INTO complaints_fts (rowid, description, reporter)
+        VALUES (NEW.id, NEW.description, (SELECT username FROM users WHERE id = NEW.user_id));
+    END;
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_complaint_delete AFTER DELETE ON complaints
+    BEGIN
+        DELETE FROM complaints_fts WHERE rowid = OLD.id;
+    END;
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_complaint_update AFTER UPDATE OF description ON complaints
+    BEGIN
+        UPDATE complaints_fts SET description = NEW.description WHERE rowid = NEW.id;
+    END;
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_fts_user_rename AFTER UPDATE OF username ON users
+    BEGIN
+        UPDATE complaints_fts SET reporter = NEW.username
+        WHERE rowid IN (SELECT id FROM complaints WHERE user_id = NEW.id);
+    END;
+    ''')
+    # Existing rows are indexed in batches by the search.backfill job (see search.py)
+    cur.execute('SELECT 1 FROM complaints LIMIT 1')
+    if cur.fetchone():
+        enqueue(cur, 'search.backfill', {'after_id': 0})
+
+
+
+@migration(13, 'Complaint change log for worker delta sync')
+def _complaint_changes(cur):
+    # AUTOINCREMENT: sequence numbers are never reused, even after pruning
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS complaint_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        complaint_id INTEGER NOT NULL,
+        changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    ''')
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_complaint_{event.lower()} AFTER {event} ON complaints
+        BEGIN
+            INSERT INTO complaint_changes (complaint_id) VALUES ({row}.id);
+        END;
+        ''')
+    # Old entries are dropped by the daily sync.prune job (see sync.py)
+    enqueue(cur, 'sync.prune', {})
+
+
+
+@migration(14, 'Client-generated ids for idempotent batch submission')
+def _client_ids(cur):
+    existing = _columns(cur, 'complaints')
+    if 'client_id' not in existing:
+        cur.execute('ALTER TABLE complaints ADD COLUMN client_id TEXT')
+    # When the citizen saw it, by the device clock; created_at stays server time
+    if 'reported_at' not in existing:
+        cur.execute('ALTER TABLE complaints ADD COLUMN reported_at TEXT')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_complaints_client ON complaints(user_id, client_id) '
+                'WHERE client_id IS NOT NULL')
+
+
+@migration(15, 'Archive table for old completed complaints')
+def _complaints_archive(cur):
+    # Same columns in the same order as complaints, so complaints_all can
+    # UNION ALL them; a migration adding a complaints column must add it here too
+    cur.execute('PRAGMA table_info(complaints)')
+    columns = []
+    for _, name, decl_type, notnull, default, _ in cur.fetchall():
+        if name == 'id':
+            # Archived rows keep their id; AUTOINCREMENT on complaints never reuses it
+            columns.append('id INTEGER PRIMARY KEY')
+            continue
+        column = f'{name} {decl_type}'
+        if notnull:
+            column += ' NOT NULL'
+        if default is not None:
+            column += f' DEFAULT {default}'
+        columns.append(column)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS complaints_archive ({', '.join(columns)})")
+    # The list views that also read archived rows, see PLAN_ROUTES
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_created ON complaints_archive(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_status_created ON complaints_archive(status, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_status_updated ON complaints_archive(status, updated_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_user_created ON complaints_archive(user_id, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_user_status ON complaints_archive(user_id, status, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archive_worker_status ON complaints_archive(worker_id, status, updated_at)')
+    # Unified read path over hot and archived rows
+    cur.execute('CREATE VIEW IF NOT EXISTS complaints_all AS '
+                'SELECT * FROM complaints UNION ALL SELECT * FROM complaints_archive')
+    # Moving a row inserts it here and deletes it from complaints: these
+    # triggers count it back into the counters and upload references that the
+    # complaints delete triggers take it out of. Archived rows are read-only,
+    # so there are no update triggers.
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_archive_insert AFTER INSERT ON complaints_archive
+    BEGIN
+        {_complaint_bumps('NEW', 1)}
+        {_upload_refs('NEW', 1)}
+        INSERT INTO complaints_fts (rowid, description, reporter)
+        SELECT NEW.id, NEW.description, (SELECT username FROM users WHERE id = NEW.user_id)
+        WHERE NOT EXISTS (SELECT 1 FROM complaints_fts WHERE rowid = NEW.id);
+    END;
+    ''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_archive_delete AFTER DELETE ON complaints_archive
+    BEGIN
+        {_complaint_bumps('OLD', -1)}
+        {_upload_refs('OLD', -1)}
+        DELETE FROM complaints_fts WHERE rowid = OLD.id;
+    END;
+    ''')
+    # An archived row keeps its search index entry when it leaves complaints
+    cur.execute('DROP TRIGGER IF EXISTS trg_fts_complaint_delete')
+    cur.execute('''
+    CREATE TRIGGER trg_fts_complaint_delete AFTER DELETE ON complaints
+    WHEN NOT EXISTS (SELECT 1 FROM complaints_archive WHERE id = OLD.id)
+    BEGIN
+        DELETE FROM complaints_fts WHERE rowid = OLD.id;
+    END;
+    ''')
+    cur.execute('DROP TRIGGER IF EXISTS trg_fts_user_rename')
+    cur.execute('''
+    CREATE TRIGGER trg_fts_user_rename AFTER UPDATE OF username ON users
+    BEGIN
+        UPDATE complaints_fts SET reporter = NEW.username
+        WHERE rowid IN (SELECT id FROM complaints_all WHERE user_id = NEW.id);
+    END;
+    ''')
+    # Completed complaints are moved by the daily archive.run job (see archive.py)
+    enqueue(cur, 'archive.run', {})
+
+
+@migration(16, 'Schedule the orphaned upload collector')
+def _upload_gc(cur):
+    # Daily uploads.gc job (see upload_gc.py); it queues its own next run
+    enqueue(cur, 'uploads.gc', {})
+
+
+@migration(17, 'Partial indexes for the open-work keyset pages')
+def _open_work_indexes(cur):
+    # Index order matches ORDER BY created_at, id (id is the rowid), so a page
+    # reads `limit` entries instead of sorting every open complaint. The WHERE
+    # clauses must match the routes' filters term for term to be usable.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_complaints_open_primary ON complaints(created_at) "
+                "WHERE status IN ('Pending','Accepted','In Progress') AND cluster_id IS NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_complaints_inprogress ON complaints(created_at) "
+                "WHERE status IN ('Accepted','In Progress')")
+
+
+@migration(18, 'Index for the latest complaint of each worker')
+def _worker_updated_index(cur):
+    # The scheduler reads each worker's last position from the end of this index
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_complaints_worker_updated ON complaints(worker_id, updated_at)')
+
+
+@migration(19, 'Client id index on archived complaints')
+def _archive_client_index(cur):
+    # Batch retries look a client_id up in complaints_all, archived rows included
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_archive_client ON complaints_archive(user_id, client_id) '
+                'WHERE client_id IS NOT NULL')
+
+
+def current_version(conn):
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)')
+    cur.execute('SELECT MAX(version) FROM schema_version')
+    return cur.fetchone()[0] or 0
+
+
+def apply_migrations(conn, target=None):
+    """
+    Apply pending migrations in order, each in its own transaction
+
+    Args:
+        conn: sqlite3 connection to migrate
+        target (int): stop after this version (default: latest)
+
+    Returns:
+        list: versions applied by this call
+    """
+    applied = []
+    previous_isolation = conn.isolation_level
+    # Manage transactions explicitly so DDL is covered too
+    conn.isolation_level = None
+    try:
+        current_version(conn)
+        for version, description, fn in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            cur = conn.cursor()
+            # IMMEDIATE takes the write lock up front, so concurrent app
+            # processes starting together apply each migration only once
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute('SELECT 1 FROM schema_version WHERE version=?', (version,))
+                if cur.fetchone():
+                    cur.execute('COMMIT')
+                    continue
+                fn(cur)
+                cur.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?,?,?)',
+                            (version, description, datetime.utcnow()))
+                cur.execute('COMMIT')
+                applied.append(version)
+            except Exception:
+                cur.execute('ROLLBACK')
+                raise
+    finally:
+        conn.isolation_level = previous_isolation
+    return applied
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [(v, d) for v, d, _ in MIGRATIONS if v > version]
+
+
+# Requests whose SQL check_query_plans() captures and explains, in order:
+# name -> (session role, method, path). {cursor} is a keyset cursor (the
+# page-2 shape of a list), {complaint} and {worker} existing ids. Requests
+# other than GET change data and only run with writes=True.
+PLAN_ROUTES = {
+    'public_reports': (None, 'GET', '/reports/public'),
+    'public_reports?after': (None, 'GET', '/reports/public?after={cursor}'),
+    'public_reports?status': (None, 'GET', '/reports/public?status=Completed'),
+    'public_reports?q': (None, 'GET', '/reports/public?q=garbage'),
+    'complaint_detail': ('user', 'GET', '/complaints/{complaint}'),
+    'user_dashboard': ('user', 'GET', '/user/dashboard'),
+    'my_complaints': ('user', 'GET', '/complaints/my'),
+    'my_complaints?after': ('user', 'GET', '/complaints/my?after={cursor}'),
+    'my_complaints?status=open': ('user', 'GET', '/complaints/my?status=open'),
+    'my_complaints?status=Completed': ('user', 'GET', '/complaints/my?status=Completed'),
+    'admin_dashboard': ('admin', 'GET', '/admin/dashboard'),
+    'admin_reports': ('admin', 'GET', '/admin/reports'),
+    'admin_reports?filter=pending': ('admin', 'GET', '/admin/reports?filter=pending'),
+    'admin_reports?filter=inprogress': ('admin', 'GET', '/admin/reports?filter=inprogress&after={cursor}'),
+    'admin_reports?filter=completed': ('admin', 'GET', '/admin/reports?filter=completed&after={cursor}'),
+    'admin_users': ('admin', 'GET', '/admin/users'),
+    'admin_workers': ('admin', 'GET', '/admin/workers'),
+    'api_admin_workers': ('admin', 'GET', '/api/admin/workers'),
+    'worker_dashboard': ('worker', 'GET', '/worker/dashboard'),
+    'worker_open_complaints': ('worker', 'GET', '/worker/complaints/open'),
+    'worker_open_complaints?after': ('worker', 'GET', '/worker/complaints/open?after={cursor}'),
+    'worker_completed_complaints': ('worker', 'GET', '/worker/complaints/completed?after={cursor}'),
+    'worker_complaint': ('worker', 'GET', '/worker/complaints/{complaint}'),
+    'worker_route': ('worker', 'GET', '/api/worker/route'),
+    'sync_snapshot': ('worker', 'GET', '/api/worker/sync?since=0.{complaint}'),
+    # A poll's worth of changes: a full page over a small table is rightly a scan
+    'sync_changes': ('worker', 'GET', '/api/worker/sync?since=0&limit=20'),
+    'search': (None, 'GET', '/api/complaints/search?q=garbage&status=open'),
+    'nearby': (None, 'GET', '/api/complaints/nearby?lat=12.97&lon=77.59&radius=5000'),
+    'bbox': (None, 'GET', '/api/complaints/bbox?min_lat=12.9&min_lon=77.5&max_lat=13.0&max_lon=77.6'),
+    'claim': ('worker', 'POST', '/api/worker/claim'),
+    'remove_worker': ('admin', 'DELETE', '/api/admin/remove-worker/{worker}'),
+    'delete_account': ('user', 'POST', '/profile/delete'),
+}
+
+# Requests ordering what the full-text or R*Tree index matched (by bm25
+# rank, distance, or date inside a map viewport): no index provides that
+# order, and the sort covers only the matches, so check_query_plans allows it
+PLAN_SORTED = {'public_reports?q', 'search', 'nearby', 'bbox'}
+
+# Tables small enough to scan (one row per AUTOINCREMENT table)
+_SCANNABLE = {'sqlite_sequence'}
+
+# The schema-qualified, quoted form virtual table modules use for their own SQL
+_VTAB_INTERNAL = re.compile(r"\b(FROM|INTO|UPDATE)\s+'main'\.", re.IGNORECASE)
+
+
+def _background_statements():
+    # Queries of jobs and the scheduler, which no request runs; taken from
+    # the modules themselves so the check follows every change to them
+    import archive
+    import batch
+    import claims
+    import scheduler
+
+    return {
+        'claim_next': claims._NEXT,
+        'scheduler_pending': scheduler._PENDING,
+        'scheduler_positions': scheduler._POSITIONS,
+        'archive_candidates': archive._CANDIDATES,
+        'batch_existing': batch._EXISTING.format(marks='?,?,?'),
+    }
+
+
+def capture_route_statements(writes=False):
+    """
+    Send the PLAN_ROUTES requests through the app's test client and collect
+    the SQL each one ran, from the trace hook that profiling.py installs
+
+    The requests run against the app's database (WASTE_REPORT_DB) as its
+    first admin, worker and citizen. The job runner and scheduler stay off.
+
+    Args:
+        writes (bool): also send the requests that change data (and run
+                       db.run_write() inline, so its statements are traced
+                       too); only for scratch databases
+
+    The export streams its rows after the request's trace is detached, so
+    its statements come from running export.iter_rows() on a traced
+    connection instead, under the name 'export'.
+
+    Returns:
+        dict: name -> list of SQL strings with their bound values
+    """
+    import app as webapp
+    import export
+    import profiling
+    from db import DB_CONFIG, configure_db, connect, encode_cursor
+
+    webapp.app.config.update(JOBS_ENABLED=False, SCHEDULER_ENABLED=False)
+    webapp.jobs.configure_jobs(webapp.app.config)
+    webapp.scheduler.configure_scheduler(webapp.app.config)
+    conn = connect()
+    try:
+        users = {role: conn.execute('SELECT id FROM users WHERE role=? ORDER BY id LIMIT 1', (role,)).fetchone()
+                 for role in ('admin', 'worker', 'user')}
+        complaint = conn.execute('SELECT MIN(id) FROM complaints').fetchone()[0] or 1
+    finally:
+        conn.close()
+    values = {'cursor': encode_cursor('2100-01-01 00:00:00', 1 << 40), 'complaint': complaint,
+              'worker': users['worker'][0] if users['worker'] else 0}
+    writer_enabled = DB_CONFIG['SQLITE_WRITER_ENABLED']
+    if writes:
+        configure_db({'SQLITE_WRITER_ENABLED': False})
+    statements = {}
+    try:
+        with profiling.capture_statements() as captured:
+            for name, (role, method, path) in PLAN_ROUTES.items():
+                if method != 'GET' and not writes:
+                    continue
+                client = webapp.app.test_client()
+                if role:
+                    with client.session_transaction() as sess:
+                        sess['user_id'] = users[role][0] if users[role] else 0
+                        sess['role'] = role
+                start = len(captured)
+                response = client.open(path.format(**values), method=method)
+                # Streamed bodies (the export) run their queries while being read
+                response.get_data()
+                response.close()
+                statements[name] = captured[start:]
+    finally:
+        configure_db({'SQLITE_WRITER_ENABLED': writer_enabled})
+    conn = connect()
+    try:
+        conn.set_trace_callback(statements.setdefault('export', []).append)
+        for _ in export.iter_rows(conn, ('Completed',), export.parse_date('2000-01-01'), batch_size=100):
+            pass
+    finally:
+        conn.close()
+    return statements
+
+
+def _plan_failure(conn, name, sql, params=()):
+    # Plan lines of `sql` when it breaks the rules of check_query_plans(), else None
+    details = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+    # Scanning a subquery's own result (e.g. nearby's LIMITed candidates) is not a table scan
+    subqueries = {d.split()[-1] for d in details if d.startswith(('MATERIALIZE ', 'CO-ROUTINE '))}
+    if any(d.startswith('SCAN') and 'INDEX' not in d and d.split()[1] not in subqueries | _SCANNABLE for d in details):
+        return details
+    if (' LIMIT ' in sql.upper() and name not in PLAN_SORTED
+            and any('TEMP B-TREE' in d or d.startswith('MATERIALIZE') for d in details)):
+        return details
+    return None
+
+
+def check_query_plans(conn, writes=False):
+    """
+    EXPLAIN QUERY PLAN, on `conn`, the statements the PLAN_ROUTES requests
+    actually ran (see capture_route_statements) and the background queries
+
+    A statement fails when it scans a whole table. A paginated one (LIMIT)
+    also fails when it sorts or materializes its rows instead of reading them
+    in index order, since that costs the full result set on every page; see
+    PLAN_SORTED for the exceptions.
+
+    Returns:
+        dict: name -> (SQL, plan lines) of the first failing statement per
+              request or query (an empty dict means all are served by indexes)
+    """
+    failures = {}
+    for name, statements in capture_route_statements(writes).items():
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+                continue
+            if _VTAB_INTERNAL.search(sql):
+                # Run by the FTS5 / R*Tree modules themselves on their shadow tables
+                continue
+            details = _plan_failure(conn, name, sql)
+            if details is not None:
+                failures[name] = (sql, details)
+                break
+    for name, sql in _background_statements().items():
+        details = _plan_failure(conn, name, sql, [1] * sql.count('?'))
+        if details is not None:
+            failures[name] = (sql, details)
+    return failures
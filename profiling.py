@@ -0,0 +1,361 @@
+"""
+Per-request profiling and Prometheus metrics
+start_request()/finish_request() bracket every request (see app.py) and
+record its wall time per endpoint. db.get_db() calls attach() on the
+request's connection, which installs a trace callback (each statement as it
+starts) and a progress handler (called every PROFILING_PROGRESS_OPCODES
+SQLite VM instructions). A statement's time runs from its start to the last
+progress tick it got, so statements shorter than one tick count as ~0 and a
+cursor consumed lazily also counts the Python work between its rows. Writes
+queued through db.run_write() run on the writer's connection: the request
+only sees them as wall time.
+
+From these each request yields:
+- the number of statements and their total time (histograms per endpoint);
+- slow statements (over PROFILING_SLOW_QUERY_MS), logged with their EXPLAIN
+  QUERY PLAN, at most once per PROFILING_LOG_INTERVAL for the same statement;
+- N+1 patterns: one statement shape (literals stripped) run at least
+  PROFILING_N_PLUS_ONE_THRESHOLD times, logged the same way.
+
+The trace and progress callbacks run Python inside SQLite's loop, so they
+cost in proportion to the work a query does: light pages show no
+measurable difference, while search and map requests over 100k complaints
+took about 50% longer. Profiling is therefore off by default (app.py turns
+it on with PROFILING_ENABLED=1 in the environment).
+
+render_metrics() writes it all in the Prometheus text format for
+/admin/metrics. Numbers are per process; with several workers each reports
+its own, as Prometheus expects from separate targets.
+
+PROFILING_CPROFILE_SAMPLE_RATE (default 0, off) runs that fraction of
+requests under cProfile, one at a time, and dumps each profile to
+PROFILING_CPROFILE_DIR as <endpoint>-<time>-<pid>-<n>.prof.
+
+capture_statements() collects the traced statements themselves, whether or
+not profiling is enabled; migrations.check_query_plans() explains the SQL
+the routes really ran that way.
+
+Usage:
+    python profiling.py profiles/*.prof [--sort cumulative] [--limit 30]
+"""
+import os
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+import itertools
+import threading
+from contextlib import contextmanager
+from flask import g
+
+logger = logging.getLogger(__name__)
+
+PROFILING_CONFIG = {
+    'PROFILING_ENABLED': False,                 # costs up to ~50% on heavy queries, see above
+    'PROFILING_PROGRESS_OPCODES': 1000,         # VM instructions between progress ticks
+    'PROFILING_SLOW_QUERY_MS': 100,
+    'PROFILING_N_PLUS_ONE_THRESHOLD': 10,       # same statement shape this often in one request
+    'PROFILING_LOG_INTERVAL': 300,              # seconds before the same finding is logged again
+    'PROFILING_CPROFILE_SAMPLE_RATE': 0.0,      # fraction of requests run under cProfile
+    'PROFILING_CPROFILE_DIR': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'),
+}
+
+METRIC_PREFIX = 'waste_report_'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def configure_profiling(config):
+    for key in PROFILING_CONFIG:
+        if key in config:
+            PROFILING_CONFIG[key] = config[key]
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.values = {}
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labels, label_values)} {_number(value)}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        self.values = {}        # label values -> [bucket counts..., sum, count]
+
+    def observe(self, label_values, value):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + (_number(bound),))} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + ("+Inf",))} {series[-1]}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-2])}'
+            yield f'{self.name}_count{_labels(self.labels, label_values)} {series[-1]}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{n}="{escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+_lock = threading.Lock()
+REQUESTS = Counter(METRIC_PREFIX + 'http_requests_total', 'Requests by endpoint, method and status',
+                   ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram(METRIC_PREFIX + 'http_request_duration_seconds', 'Request wall time',
+                            ('endpoint',), LATENCY_BUCKETS)
+SQL_STATEMENTS = Histogram(METRIC_PREFIX + 'sql_statements_per_request', 'SQL statements run by one request',
+                           ('endpoint',), COUNT_BUCKETS)
+SQL_SECONDS = Histogram(METRIC_PREFIX + 'sql_request_duration_seconds', 'Time spent in SQL statements by one request',
+                        ('endpoint',), LATENCY_BUCKETS)
+SQL_STATEMENT_SECONDS = Histogram(METRIC_PREFIX + 'sql_statement_duration_seconds', 'Time of single SQL statements',
+                                  ('endpoint',), LATENCY_BUCKETS)
+SLOW_STATEMENTS = Counter(METRIC_PREFIX + 'sql_slow_statements_total', 'Statements over PROFILING_SLOW_QUERY_MS',
+                          ('endpoint',))
+REPEATED_STATEMENTS = Counter(METRIC_PREFIX + 'sql_repeated_statements_total',
+                              'Requests running one statement shape at least PROFILING_N_PLUS_ONE_THRESHOLD times',
+                              ('endpoint',))
+PROFILED = Counter(METRIC_PREFIX + 'cprofile_requests_total', 'Requests run under cProfile', ('endpoint',))
+METRICS = (REQUESTS, REQUEST_SECONDS, SQL_STATEMENTS, SQL_SECONDS, SQL_STATEMENT_SECONDS, SLOW_STATEMENTS,
+           REPEATED_STATEMENTS, PROFILED)
+
+# (kind, endpoint, statement shape) -> when it was last logged
+_logged_at = {}
+# cProfile allows one active profiler per process on recent Pythons
+_cprofile_lock = threading.Lock()
+_profile_numbers = itertools.count(1)
+
+# Lists receiving every traced statement while capture_statements() is active
+_captures = []
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|x'[0-9a-f]*'|\b\d+(?:\.\d+)?\b", re.IGNORECASE)
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def statement_shape(sql):
+    """`sql` with literals and IN lists replaced, so repeats of one query compare equal"""
+    shape = _LISTS.sub('(?)', _LITERALS.sub('?', sql))
+    return ' '.join(shape.split())
+
+
+class RequestProfile:
+    """SQL statements seen on the request's connection: [sql, started, last tick]"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []
+        self.conn = None
+        self.profiler = None
+
+    def on_statement(self, sql):
+        # Trigger programs report as '-- TRIGGER name', or on some Python
+        # versions as the firing statement's text again, once per row; their
+        # time is the firing statement's
+        now = time.perf_counter()
+        if sql.startswith('--') or (self.statements and self.statements[-1][0] == sql):
+            if self.statements:
+                self.statements[-1][2] = now
+        else:
+            self.statements.append([sql, now, now])
+            for captured in _captures:
+                captured.append(sql)
+
+    def on_progress(self):
+        if self.statements:
+            self.statements[-1][2] = time.perf_counter()
+        return 0
+
+    def detach(self):
+        if self.conn is not None:
+            self.conn.set_trace_callback(None)
+            self.conn.set_progress_handler(None, 0)
+
+
+@contextmanager
+def capture_statements():
+    """
+    Collect the statements traced on request connections while active (bound
+    values expanded, trigger programs left out)
+
+    Yields:
+        list: SQL strings, appended as they run
+    """
+    captured = []
+    with _lock:
+        _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        with _lock:
+            _captures.remove(captured)
+
+
+def start_request():
+    if not PROFILING_CONFIG['PROFILING_ENABLED'] and not _captures:
+        return
+    profile = g._profile = RequestProfile()
+    rate = PROFILING_CONFIG['PROFILING_CPROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate and _cprofile_lock.acquire(blocking=False):
+        import cProfile
+        profile.profiler = cProfile.Profile()
+        try:
+            profile.profiler.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage) is active
+            profile.profiler = None
+            _cprofile_lock.release()
+
+
+def attach(conn):
+    """Trace statements on the request's connection; called by db.get_db()"""
+    profile = g.get('_profile')
+    if profile is None or profile.conn is not None:
+        return
+    profile.conn = conn
+    conn.set_trace_callback(profile.on_statement)
+    conn.set_progress_handler(profile.on_progress, PROFILING_CONFIG['PROFILING_PROGRESS_OPCODES'])
+
+
+def _should_log(kind, endpoint, shape):
+    key = (kind, endpoint, shape)
+    now = time.monotonic()
+    with _lock:
+        if now - _logged_at.get(key, -1e9) < PROFILING_CONFIG['PROFILING_LOG_INTERVAL']:
+            return False
+        _logged_at[key] = now
+    return True
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN lines of an (expanded) statement; empty if it cannot be explained"""
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+    except Exception as e:
+        return [f'(no plan: {e})']
+
+
+def _dump_profile(profile, endpoint):
+    profiler, profile.profiler = profile.profiler, None
+    try:
+        profiler.disable()
+        folder = PROFILING_CONFIG['PROFILING_CPROFILE_DIR']
+        os.makedirs(folder, exist_ok=True)
+        name = f"{endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_numbers)}.prof"
+        profiler.dump_stats(os.path.join(folder, name))
+    except OSError as e:
+        print(f"Could not write profile: {e}")
+    finally:
+        _cprofile_lock.release()
+
+
+def finish_request(endpoint, method, status):
+    """Record the request's metrics and log its slow and repeated statements"""
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return
+    profile.detach()
+    wall = time.perf_counter() - profile.started
+    endpoint = endpoint or 'unmatched'
+    sampled = profile.profiler is not None
+    if sampled:
+        _dump_profile(profile, endpoint)
+
+    slow_ms = PROFILING_CONFIG['PROFILING_SLOW_QUERY_MS']
+    durations = [last - started for _, started, last in profile.statements]
+    slow = [(sql, d) for (sql, _, _), d in zip(profile.statements, durations) if d * 1000 >= slow_ms]
+    shapes = {}
+    for sql, _, _ in profile.statements:
+        shape = statement_shape(sql)
+        shapes[shape] = shapes.get(shape, 0) + 1
+    repeated = [(shape, n) for shape, n in shapes.items() if n >= PROFILING_CONFIG['PROFILING_N_PLUS_ONE_THRESHOLD']]
+
+    label = (endpoint,)
+    with _lock:
+        REQUESTS.inc((endpoint, method, str(status)))
+        REQUEST_SECONDS.observe(label, wall)
+        SQL_STATEMENTS.observe(label, len(durations))
+        SQL_SECONDS.observe(label, sum(durations))
+        for d in durations:
+            SQL_STATEMENT_SECONDS.observe(label, d)
+        if slow:
+            SLOW_STATEMENTS.inc(label, len(slow))
+        if repeated:
+            REPEATED_STATEMENTS.inc(label)
+        if sampled:
+            PROFILED.inc(label)
+    for sql, d in slow:
+        if _should_log('slow', endpoint, statement_shape(sql)):
+            plan = explain(profile.conn, sql) if profile.conn is not None else []
+            logger.warning("Slow query (%.1f ms) in %s: %s\n  plan: %s", d * 1000, endpoint, ' '.join(sql.split())[:1000],
+                           ' | '.join(plan))
+    for shape, n in repeated:
+        if _should_log('repeated', endpoint, shape):
+            logger.warning("Possible N+1 in %s: %d statements like %s", endpoint, n, shape[:1000])
+
+
+def render_metrics(extra=()):
+    """
+    Prometheus text exposition of the request and SQL metrics
+
+    Args:
+        extra: (name, help, type, value) tuples appended as they are, e.g. gauges
+               from other modules
+    """
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    for name, help_text, kind, value in extra:
+        lines += [f'# HELP {METRIC_PREFIX}{name} {help_text}', f'# TYPE {METRIC_PREFIX}{name} {kind}',
+                  f'{METRIC_PREFIX}{name} {_number(value)}']
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    import pstats
+
+    parser = argparse.ArgumentParser(description='Summarize cProfile dumps written by sampled requests')
+    parser.add_argument('files', nargs='+', help='.prof files (see PROFILING_CPROFILE_DIR)')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key (cumulative, tottime, calls, ...)')
+    parser.add_argument('--limit', type=int, default=30, help='functions to show')
+    args = parser.parse_args()
+
+    try:
+        stats = pstats.Stats(*args.files)
+    except (OSError, TypeError, EOFError) as e:
+        print(f"✗ Could not read profiles: {e}")
+        return 1
+    print(f"{len(args.files)} profile(s):")
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Route planning for a worker's open complaints
+Orders the stops starting from the worker's position: a nearest-neighbour
+tour is improved with 2-opt (segment reversal) and Or-opt (moving runs of
+1-3 stops) until no move shortens it or the time budget runs out. The route
+is open - it ends at the last stop instead of returning to the start.
+
+NumPy evaluates all candidate moves for one position at once; without it
+the same algorithm runs in pure Python (fine for a few dozen stops).
+
+Usage:
+    python routing.py --bench 500          # synthetic 500-stop benchmark
+    python routing.py --bench 200 --pure   # without NumPy
+"""
+import sys
+import math
+import time
+import random
+import argparse
+
+# NumPy is optional - without it the planner falls back to pure Python
+try:
+    import numpy as np
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
+from geo import EARTH_RADIUS_M, haversine_m
+
+ROUTE_TIME_LIMIT = 1.0      # seconds spent improving a route
+_EPS = 1e-6
+
+
+def distance_matrix(points, use_numpy=None):
+    """
+    Great-circle distances in metres between all points, plus a final dummy
+    node at distance 0 from everything so an open path can be improved like
+    a closed tour ending at the dummy
+
+    Args:
+        points (list): (lat, lon) tuples
+    """
+    use_numpy = NUMPY_ENABLED if use_numpy is None else use_numpy
+    n = len(points)
+    if use_numpy:
+        coords = np.radians(np.asarray(points, dtype=float).reshape(n, 2))
+        lat, lon = coords[:, 0:1], coords[:, 1:2]
+        a = np.sin((lat - lat.T) / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin((lon - lon.T) / 2) ** 2
+        dist = np.zeros((n + 1, n + 1))
+        dist[:n, :n] = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        return dist
+    dist = [[0.0] * (n + 1) for _ in range(n + 1)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            dist[i][j] = dist[j][i] = haversine_m(points[i][0], points[i][1], points[j][0], points[j][1])
+    return dist
+
+
+def path_length(path, dist):
+    return float(sum(dist[a][b] for a, b in zip(path, path[1:])))
+
+
+def nearest_neighbour(dist, n):
+    # Greedy tour over nodes 0..n-1 starting at node 0
+    if NUMPY_ENABLED and not isinstance(dist, list):
+        visited = np.zeros(n, dtype=bool)
+        path = [0]
+        visited[0] = True
+        for _ in range(n - 1):
+            row = np.where(visited, np.inf, dist[path[-1], :n])
+            nxt = int(row.argmin())
+            visited[nxt] = True
+            path.append(nxt)
+        return path
+    remaining = set(range(1, n))
+    path = [0]
+    while remaining:
+        last = dist[path[-1]]
+        nxt = min(remaining, key=lambda j: (last[j], j))
+        remaining.remove(nxt)
+        path.append(nxt)
+    return path
+
+
+def _two_opt_np(path, dist, deadline):
+    # path ends with the dummy node; reverse path[i..j] for 1 <= i < j <= len-2
+    p = np.asarray(path)
+    m = len(p)
+    improved = False
+    for i in range(1, m - 2):
+        j = np.arange(i + 1, m - 1)
+        a, b = p[i - 1], p[i]
+        c, d = p[j], p[j + 1]
+        delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+        k = int(delta.argmin())
+        if delta[k] < -_EPS:
+            jj = i + 1 + k
+            p[i:jj + 1] = p[i:jj + 1][::-1]
+            improved = True
+        if time.monotonic() > deadline:
+            break
+    return p.tolist(), improved
+
+
+def _two_opt_py(path, dist, deadline):
+    p = list(path)
+    m = len(p)
+    improved = False
+    for i in range(1, m - 2):
+        a, b = p[i - 1], p[i]
+        best, best_j = -_EPS, None
+        for j in range(i + 1, m - 1):
+            c, d = p[j], p[j + 1]
+            delta = dist[a][c] + dist[b][d] - dist[a][b] - dist[c][d]
+            if delta < best:
+                best, best_j = delta, j
+        if best_j is not None:
+            p[i:best_j + 1] = reversed(p[i:best_j + 1])
+            improved = True
+        if time.monotonic() > deadline:
+            break
+    return p, improved
+
+
+def _or_opt_np(path, dist, deadline, max_segment=3):
+    p = np.asarray(path)
+    improved = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length < len(p):
+            s0, s1 = p[i], p[i + length - 1]
+            prev, nxt = p[i - 1], p[i + length]
+            gain = dist[prev, s0] + dist[s1, nxt] - dist[prev, nxt]
+            rest = np.concatenate((p[:i], p[i + length:]))
+            u, v = rest[:-1], rest[1:]
+            forward = dist[u, s0] + dist[s1, v] - dist[u, v]
+            backward = dist[u, s1] + dist[s0, v] - dist[u, v]
+            cost = np.minimum(forward, backward)
+            k = int(cost.argmin())
+            if cost[k] < gain - _EPS:
+                segment = p[i:i + length]
+                if backward[k] < forward[k]:
+                    segment = segment[::-1]
+                p = np.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                improved = True
+            else:
+                i += 1
+            if time.monotonic() > deadline:
+                return p.tolist(), improved
+    return p.tolist(), improved
+
+
+def _or_opt_py(path, dist, deadline, max_segment=3):
+    p = list(path)
+    improved = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length < len(p):
+            s0, s1 = p[i], p[i + length - 1]
+            prev, nxt = p[i - 1], p[i + length]
+            gain = dist[prev][s0] + dist[s1][nxt] - dist[prev][nxt]
+            rest = p[:i] + p[i + length:]
+            best, best_k, reverse = gain - _EPS, None, False
+            for k in range(len(rest) - 1):
+                u, v = rest[k], rest[k + 1]
+                forward = dist[u][s0] + dist[s1][v] - dist[u][v]
+                backward = dist[u][s1] + dist[s0][v] - dist[u][v]
+                if min(forward, backward) < best:
+                    best, best_k, reverse = min(forward, backward), k, backward < forward
+            if best_k is not None:
+                segment = p[i:i + length]
+                if reverse:
+                    segment.reverse()
+                p = rest[:best_k + 1] + segment + rest[best_k + 1:]
+                improved = True
+            else:
+                i += 1
+            if time.monotonic() > deadline:
+                return p, improved
+    return p, improved
+
+
+def plan_route(start, stops, time_limit=ROUTE_TIME_LIMIT, use_numpy=None):
+    """
+    Visiting order for `stops` starting at `start`
+
+    Args:
+        start (tuple): (lat, lon) of the worker
+        stops (list): (lat, lon) of each stop
+        time_limit (float): seconds allowed for the improvement phase
+
+    Returns:
+        dict: order (indices into stops), legs (metres to each stop),
+              distance_m (total)
+    """
+    use_numpy = NUMPY_ENABLED if use_numpy is None else use_numpy
+    n = len(stops) + 1
+    if n == 1:
+        return {'order': [], 'legs': [], 'distance_m': 0.0}
+    dist = distance_matrix([start] + list(stops), use_numpy)
+    path = nearest_neighbour(dist, n) + [n]
+    two_opt, or_opt = (_two_opt_np, _or_opt_np) if use_numpy else (_two_opt_py, _or_opt_py)
+    deadline = time.monotonic() + time_limit
+    improved = True
+    while improved and time.monotonic() < deadline:
+        path, a = two_opt(path, dist, deadline)
+        path, b = or_opt(path, dist, deadline)
+        improved = a or b
+    path = path[:-1]
+    legs = [float(dist[a][b]) for a, b in zip(path, path[1:])]
+    return {'order': [i - 1 for i in path[1:]], 'legs': legs, 'distance_m': sum(legs)}
+
+
+def _bench(count, pure, seed, time_limit):
+    rng = random.Random(seed)
+    # Stops scattered over a ~15 x 15 km city
+    start = (12.97, 77.59)
+    stops = [(start[0] + rng.uniform(-0.07, 0.07), start[1] + rng.uniform(-0.07, 0.07)) for _ in range(count)]
+    use_numpy = NUMPY_ENABLED and not pure
+
+    t0 = time.perf_counter()
+    dist = distance_matrix([start] + stops, use_numpy)
+    t1 = time.perf_counter()
+    nn = path_length(nearest_neighbour(dist, count + 1), dist)
+    t2 = time.perf_counter()
+    result = plan_route(start, stops, time_limit=time_limit, use_numpy=use_numpy)
+    t3 = time.perf_counter()
+    fifo = path_length(list(range(count + 1)), dist)
+
+    print(f"{count} stops, {'NumPy' if use_numpy else 'pure Python'}")
+    print(f"  distance matrix      {1000 * (t1 - t0):8.1f} ms")
+    print(f"  nearest neighbour    {1000 * (t2 - t1):8.1f} ms  {nn / 1000:8.1f} km")
+    print(f"  full plan            {1000 * (t3 - t2):8.1f} ms  {result['distance_m'] / 1000:8.1f} km")
+    print(f"  report order (FIFO)                {fifo / 1000:8.1f} km")
+    print(f"  saving vs FIFO {100 * (1 - result['distance_m'] / fifo):.1f}%, vs nearest neighbour {100 * (1 - result['distance_m'] / nn):.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route planning tools')
+    parser.add_argument('--bench', type=int, metavar='STOPS', help='plan a route over synthetic stops')
+    parser.add_argument('--pure', action='store_true', help='do not use NumPy')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--time-limit', type=float, default=ROUTE_TIME_LIMIT * 10)
+    args = parser.parse_args()
+
+    if not args.bench:
+        parser.print_help()
+        return 0
+    _bench(args.bench, args.pure, args.seed, args.time_limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Automatic assignment of pending complaints
+Each tick takes the pending complaints created since the last tick (a
+watermark on complaints.id kept in scheduler_state) and assigns each one,
+oldest first, to the worker with the lowest cost:
+
+    cost = LOAD_WEIGHT * open complaints of the worker
+         + DISTANCE_WEIGHT * km from the worker's last known position / age factor
+
+where age factor = 1 + age_hours / AGE_HOURS, so the longer a complaint has
+waited the less proximity matters. Workers at SCHEDULER_MAX_OPEN are skipped;
+when nobody has capacity the tick stops and the watermark stays put, so the
+same complaints are tried again next tick.
+
+The scheduler is off by default (SCHEDULER_ENABLED): turning it on changes
+how work is handed out, from workers claiming complaints to assignment.
+
+Assignment is a conditional UPDATE (still Pending and unassigned), so a
+worker accepting the complaint by hand at the same moment wins cleanly.
+
+Usage:
+    python scheduler.py --once      # run a single tick
+    python scheduler.py --status    # watermark and recent assignment latency
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+
+import events
+from geo import haversine_m
+
+OPEN_STATUSES = ('Pending', 'Accepted', 'In Progress')
+
+SCHEDULER_CONFIG = {
+    'SCHEDULER_ENABLED': False,       # off: workers claim complaints themselves
+    'SCHEDULER_INTERVAL': 30,           # seconds between ticks
+    'SCHEDULER_BATCH_SIZE': 100,        # pending complaints looked at per tick
+    'SCHEDULER_MAX_OPEN': 10,           # open complaints a worker may hold
+    'SCHEDULER_LOAD_WEIGHT': 1.0,
+    'SCHEDULER_DISTANCE_WEIGHT': 0.5,   # per km
+    'SCHEDULER_AGE_HOURS': 24,
+}
+
+WATERMARK = 'assign.last_id'
+
+_lock = threading.Lock()
+_latencies = deque(maxlen=1000)
+STATS = {'ticks': 0, 'assigned': 0, 'skipped_no_capacity': 0, 'last_tick_ms': None, 'last_tick_at': None}
+
+
+def configure_scheduler(config):
+    for key in SCHEDULER_CONFIG:
+        if key in config:
+            SCHEDULER_CONFIG[key] = config[key]
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def get_state(cur, name, default=None):
+    cur.execute('SELECT value FROM scheduler_state WHERE name=?', (name,))
+    row = cur.fetchone()
+    return row[0] if row else default
+
+
+def set_state(cur, name, value):
+    cur.execute('INSERT INTO scheduler_state (name, value, updated_at) VALUES (?,?,?) '
+                'ON CONFLICT(name) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at',
+                (name, str(value), datetime.utcnow()))
+
+
+_PENDING = ("SELECT id, latitude, longitude, created_at FROM complaints "
+            "WHERE id > ? AND status='Pending' AND worker_id IS NULL AND cluster_id IS NULL ORDER BY id LIMIT ?")
+
+_POSITIONS = ("SELECT u.id, c.latitude, c.longitude FROM users u JOIN complaints c ON c.id = "
+              "(SELECT id FROM complaints WHERE worker_id = u.id AND latitude IS NOT NULL ORDER BY updated_at DESC LIMIT 1) "
+              "WHERE u.role = 'worker'")
+
+
+def _workers(cur):
+    """Worker id -> {'load': open complaints, 'pos': (lat, lon) or None}"""
+    cur.execute("SELECT id FROM users WHERE role='worker'")
+    workers = {row[0]: {'load': 0, 'pos': None} for row in cur.fetchall()}
+    if not workers:
+        return workers
+    # Open load comes from the trigger-maintained counters
+    cur.execute(f"SELECT scope_id, SUM(value) FROM counters WHERE scope='worker' "
+                f"AND name IN ({','.join('?' * len(OPEN_STATUSES))}) GROUP BY scope_id", OPEN_STATUSES)
+    for worker_id, load in cur.fetchall():
+        if worker_id in workers:
+            workers[worker_id]['load'] = load
+    # Last known positions in one statement; each worker's latest complaint is
+    # read from the end of idx_complaints_worker_updated, no sort of its history
+    cur.execute(_POSITIONS)
+    for worker_id, lat, lon in cur.fetchall():
+        if worker_id in workers and isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            workers[worker_id]['pos'] = (lat, lon)
+    return workers
+
+
+def _cost(info, lat, lon, age_hours):
+    cost = SCHEDULER_CONFIG['SCHEDULER_LOAD_WEIGHT'] * info['load']
+    if info['pos'] is not None and isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+        km = haversine_m(info['pos'][0], info['pos'][1], lat, lon) / 1000
+        cost += SCHEDULER_CONFIG['SCHEDULER_DISTANCE_WEIGHT'] * km / (1 + age_hours / SCHEDULER_CONFIG['SCHEDULER_AGE_HOURS'])
+    return cost
+
+
+def assign_pending(conn):
+    """
+    One scheduler tick; meant to run through db.run_write() so the whole tick
+    is a single transaction
+
+    Returns:
+        list: (complaint_id, worker_id, latency_seconds, rows_moved) for each
+              assignment; rows_moved counts the primary and its linked reports
+    """
+    cur = conn.cursor()
+    last_id = int(get_state(cur, WATERMARK, 0))
+    cur.execute(_PENDING, (last_id, SCHEDULER_CONFIG['SCHEDULER_BATCH_SIZE']))
+    pending = cur.fetchall()
+    if not pending:
+        return []
+    workers = _workers(cur)
+    now = datetime.utcnow()
+    assigned = []
+    watermark = last_id
+    for complaint_id, lat, lon, created_at in pending:
+        created = _parse_time(created_at)
+        age_hours = (now - created).total_seconds() / 3600 if created else 0.0
+        candidates = [(_cost(info, lat, lon, age_hours), worker_id) for worker_id, info in workers.items()
+                      if info['load'] < SCHEDULER_CONFIG['SCHEDULER_MAX_OPEN']]
+        if not candidates:
+            # Nobody has capacity: retry from this complaint next tick
+            with _lock:
+                STATS['skipped_no_capacity'] += 1
+            break
+        _, worker_id = min(candidates)
+        cur.execute("UPDATE complaints SET status='Accepted', worker_id=?, assigned_at=?, updated_at=?, version=version+1 "
+                    "WHERE id=? AND status='Pending' AND worker_id IS NULL",
+                    (worker_id, now, now, complaint_id))
+        if cur.rowcount:
+            # Linked duplicate reports follow their primary
+            cur.execute("UPDATE complaints SET status='Accepted', worker_id=?, assigned_at=?, updated_at=?, version=version+1 "
+                        "WHERE cluster_id=? AND status='Pending'", (worker_id, now, now, complaint_id))
+            moved = 1 + cur.rowcount
+            # Same measure as the counters: linked reports count towards the load
+            workers[worker_id]['load'] += moved
+            if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+                workers[worker_id]['pos'] = (lat, lon)
+            latency = (now - created).total_seconds() if created else None
+            assigned.append((complaint_id, worker_id, latency, moved))
+        watermark = complaint_id
+    set_state(cur, WATERMARK, watermark)
+    return assigned
+
+
+def run_tick():
+    """Run one tick through the writer and record its metrics"""
+    from db import run_write
+
+    started = time.perf_counter()
+    assigned = run_write(assign_pending)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        STATS['ticks'] += 1
+        STATS['assigned'] += len(assigned)
+        STATS['last_tick_ms'] = round(elapsed_ms, 2)
+        STATS['last_tick_at'] = datetime.utcnow().isoformat()
+        _latencies.extend(latency for _, _, latency, _ in assigned if latency is not None)
+    for complaint_id, worker_id, _, moved in assigned:
+        events.publish('complaint', {
+            'action': 'assigned',
+            'complaint': {'id': complaint_id, 'status': 'Accepted', 'worker_id': worker_id},
+            'deltas': {'statuses': {'Pending': -moved, 'Accepted': moved}, 'workers': {str(worker_id): {'Accepted': moved}}},
+        })
+    return assigned
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def scheduler_stats():
+    """Tick counters plus assignment latency (seconds from report to assignment)"""
+    with _lock:
+        latencies = list(_latencies)
+        stats = dict(STATS)
+    stats['latency_seconds'] = {
+        'samples': len(latencies),
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'max': max(latencies) if latencies else None,
+    }
+    return stats
+
+
+class SchedulerThread:
+    """Runs a tick every SCHEDULER_INTERVAL seconds in a daemon thread"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or SCHEDULER_CONFIG['SCHEDULER_INTERVAL']
+        self.pid = os.getpid()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _loop(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                run_tick()
+            except Exception as e:
+                print(f"Scheduler tick failed: {e!r}")
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Start this process's scheduler thread on first use"""
+    global _thread
+    if not SCHEDULER_CONFIG['SCHEDULER_ENABLED']:
+        return None
+    thread = _thread
+    if thread is not None and thread.pid == os.getpid():
+        return thread
+    with _thread_lock:
+        if _thread is None or _thread.pid != os.getpid():
+            _thread = SchedulerThread().start()
+        return _thread
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Complaint assignment scheduler')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--once', action='store_true', help='run one scheduler tick')
+    group.add_argument('--status', action='store_true', help='show the watermark and assignment latency')
+    args = parser.parse_args()
+
+    if args.once:
+        assigned = run_tick()
+        for complaint_id, worker_id, latency, _ in assigned:
+            print(f"  complaint {complaint_id} -> worker {worker_id}" + (f" after {latency / 3600:.1f} h" if latency is not None else ''))
+        print(f"✓ Assigned {len(assigned)} complaint(s) in {STATS['last_tick_ms']} ms.")
+        return 0
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        print(f"Watermark: complaint id {get_state(cur, WATERMARK, 0)}")
+        cur.execute("SELECT COUNT(*), AVG((julianday(assigned_at) - julianday(created_at)) * 86400), "
+                    "MAX((julianday(assigned_at) - julianday(created_at)) * 86400) "
+                    "FROM complaints WHERE assigned_at IS NOT NULL AND assigned_at >= datetime('now', '-1 day')")
+        count, avg, worst = cur.fetchone()
+        if count:
+            print(f"Last 24 h: {count} assigned, latency avg {avg / 60:.1f} min, max {worst / 60:.1f} min")
+        else:
+            print("No assignments in the last 24 h.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
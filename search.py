@@ -0,0 +1,188 @@
+"""
+Full-text search over complaints
+complaints_fts (FTS5, see migrations.py) indexes each complaint's description
+and its reporter's username under rowid = complaints.id. Triggers keep it in
+step with new, edited and deleted complaints and renamed users; complaints
+that existed before the index was created are added by the search.backfill
+job, one short write per batch, so reports can still be filed meanwhile.
+
+Results are ranked with bm25 (description matches weigh more than the
+reporter name) and paged with the usual keyset cursors on (score, id).
+
+Usage:
+    python search.py --status               # indexed vs. total complaints
+    python search.py --backfill             # index missing rows now
+    python search.py "overflowing bin"      # run a query
+"""
+import re
+import sys
+import argparse
+
+from markupsafe import Markup, escape
+
+from db import fetch_page
+from jobs import handler, enqueue
+
+SEARCH_CONFIG = {
+    'SEARCH_BACKFILL_BATCH': 500,       # complaints indexed per backfill write
+    'SEARCH_SNIPPET_TOKENS': 16,
+    'SEARCH_MAX_TERMS': 16,
+}
+
+# Column weights for bm25(): description, reporter
+_WEIGHTS = (2.0, 1.0)
+# Control characters mark the hits in snippets until the text has been escaped
+_HIT_START, _HIT_END = '\x02', '\x03'
+
+
+def configure_search(config):
+    for key in SEARCH_CONFIG:
+        if key in config:
+            SEARCH_CONFIG[key] = config[key]
+
+
+def match_expression(text):
+    """
+    FTS5 query for free text typed by a user: every word must match, the
+    last one as a prefix. FTS5 syntax in the input is not interpreted.
+
+    Returns:
+        str: MATCH expression, or None when the text has no searchable words
+    """
+    terms = re.findall(r'\w+', text or '')[:SEARCH_CONFIG['SEARCH_MAX_TERMS']]
+    if not terms:
+        return None
+    return ' '.join(f'"{t}"' for t in terms) + '*'
+
+
+def highlight(snippet):
+    # Escape the snippet, then turn the hit markers into <mark> tags
+    if snippet is None:
+        return None
+    return Markup(str(escape(snippet)).replace(_HIT_START, '<mark>').replace(_HIT_END, '</mark>'))
+
+
+def search_page(cur, text, where='', params=(), after=None, before=None, limit=20):
+    """
+    One keyset page of complaints matching `text`, best match first
+
+    Args:
+        where (str): extra filter over complaints `c` / users `u`
+        params (tuple): parameters for `where`
+
+    Returns:
+        tuple: (rows, next_cursor, prev_cursor) like db.fetch_page(); rows are
+               dicts with the complaint columns, reporter, score and snippet
+               (HTML with the matches in <mark>)
+    """
+    match = match_expression(text)
+    if match is None:
+        return [], None, None
+    # One arm per table rather than the complaints_all view: with a filter
+    # SQLite would materialize the whole view instead of probing each rowid
+    arms = []
+    for table in ('complaints', 'complaints_archive'):
+        arm = (f"SELECT c.*, u.username AS reporter, bm25(complaints_fts, {_WEIGHTS[0]}, {_WEIGHTS[1]}) AS score, "
+               f"snippet(complaints_fts, 0, char(2), char(3), '…', {int(SEARCH_CONFIG['SEARCH_SNIPPET_TOKENS'])}) AS snippet "
+               f"FROM complaints_fts JOIN {table} c ON c.id = complaints_fts.rowid JOIN users u ON c.user_id = u.id "
+               f"WHERE complaints_fts MATCH ?")
+        if where:
+            arm += f' AND ({where})'
+        arms.append(arm)
+    arm_params = (match,) + tuple(params)
+    rows, next_cursor, prev_cursor = fetch_page(cur, f"SELECT * FROM ({' UNION ALL '.join(arms)}) s", '', arm_params * 2,
+                                                's.score', descending=False, after=after, before=before, limit=limit)
+    results = []
+    for row in rows:
+        item = dict(row)
+        item['snippet'] = str(highlight(item['snippet']))
+        results.append(item)
+    return results, next_cursor, prev_cursor
+
+
+def index_batch(conn, after_id=0, batch_size=None):
+    """
+    Index complaints with id > after_id that are not in complaints_fts yet;
+    meant to run through db.run_write()
+
+    Returns:
+        tuple: (last id looked at or None when there are no more rows, rows indexed)
+    """
+    batch_size = batch_size or SEARCH_CONFIG['SEARCH_BACKFILL_BATCH']
+    row = conn.execute('SELECT MAX(id) FROM (SELECT id FROM complaints WHERE id > ? ORDER BY id LIMIT ?)',
+                       (after_id, batch_size)).fetchone()
+    last_id = row[0]
+    if last_id is None:
+        return None, 0
+    # Rows inserted since the index was created are already there via the trigger
+    cur = conn.execute(
+        'INSERT INTO complaints_fts (rowid, description, reporter) '
+        'SELECT c.id, c.description, u.username FROM complaints c LEFT JOIN users u ON u.id = c.user_id '
+        'WHERE c.id > ? AND c.id <= ? AND c.id NOT IN (SELECT rowid FROM complaints_fts WHERE rowid > ? AND rowid <= ?)',
+        (after_id, last_id, after_id, last_id))
+    return last_id, cur.rowcount
+
+
+def _backfill_step(conn, after_id, batch_size):
+    last_id, indexed = index_batch(conn, after_id, batch_size)
+    if last_id is not None:
+        # Queue the next batch in the same transaction, so progress is never lost
+        enqueue(conn, 'search.backfill', {'after_id': last_id, 'batch_size': batch_size})
+    return last_id, indexed
+
+
+@handler('search.backfill')
+def backfill_job(after_id=0, batch_size=None):
+    """Background job: index one batch of existing complaints, then queue the next"""
+    from db import run_write
+
+    batch_size = batch_size or SEARCH_CONFIG['SEARCH_BACKFILL_BATCH']
+    last_id, indexed = run_write(_backfill_step, after_id, batch_size)
+    return {'after_id': after_id, 'last_id': last_id, 'indexed': indexed, 'done': last_id is None}
+
+
+def index_status(cur):
+    cur.execute('SELECT COUNT(*) FROM complaints_all')
+    total = cur.fetchone()[0]
+    cur.execute('SELECT COUNT(*) FROM complaints_fts')
+    return {'indexed': cur.fetchone()[0], 'total': total}
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Complaint search tools')
+    parser.add_argument('query', nargs='?', help='search text')
+    parser.add_argument('--status', action='store_true', help='show how much of the table is indexed')
+    parser.add_argument('--backfill', action='store_true', help='index missing complaints now')
+    parser.add_argument('--batch-size', type=int, default=SEARCH_CONFIG['SEARCH_BACKFILL_BATCH'])
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.backfill:
+            after_id, total = 0, 0
+            while after_id is not None:
+                after_id, indexed = index_batch(conn, after_id, args.batch_size)
+                conn.commit()
+                total += indexed
+            print(f"✓ Indexed {total} complaint(s).")
+        if args.status or args.backfill:
+            status = index_status(conn.cursor())
+            print(f"Indexed {status['indexed']} of {status['total']} complaint(s).")
+        if args.query:
+            rows, _, _ = search_page(conn.cursor(), args.query, limit=args.limit)
+            for row in rows:
+                snippet = row['snippet'].replace('<mark>', '[').replace('</mark>', ']')
+                print(f"  #{row['id']:<6} {row['score']:8.3f}  {row['status']:<12} {snippet}")
+            print(f"{len(rows)} result(s).")
+        if not (args.query or args.status or args.backfill):
+            parser.print_help()
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Synthetic data for load tests and benchmarks
+Fills a database with citizens, workers and complaints that look like real
+use: reports bunch up around a few dozen hot spots, ids grow with created_at,
+most complaints are completed, a few are linked duplicate reports, and every
+complaint points at one of a small pool of placeholder photos (stored like
+real uploads, with derivatives when Pillow is installed). All seeded accounts
+share the password 'password'; the admin is seed-admin@example.com, citizens
+seed-user-<n>@example.com and workers seed-worker-<n>@example.com.
+
+Complaints go in SEED_CHUNK_SIZE rows per transaction. Within each one the
+complaint insert triggers are dropped, the rows inserted, and what the
+triggers would have done (counters, upload references, R*Tree, search index,
+change log) is done with a few set-based statements before the triggers are
+recreated - several times faster than firing five triggers per row, and no
+committed state ever lacks a trigger.
+
+Usage:
+    python seed_data.py --scale 10k --db bench.db --fresh
+    python seed_data.py --complaints 250000 --users 20000 --workers 150 --db bench.db
+    python archive.py --run    # with WASTE_REPORT_DB=bench.db: move old completed complaints
+"""
+import io
+import os
+import sys
+import math
+import time
+import random
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+SCALES = {
+    '10k': {'complaints': 10000, 'users': 1000, 'workers': 20},
+    '100k': {'complaints': 100000, 'users': 10000, 'workers': 100},
+    '1m': {'complaints': 1000000, 'users': 100000, 'workers': 500},
+}
+
+SEED_CHUNK_SIZE = 5000
+SEED_PASSWORD = 'password'
+
+STATUS_WEIGHTS = {'Completed': 60, 'In Progress': 8, 'Accepted': 7, 'Pending': 25}
+LINKED_SHARE = 0.03         # reports linked to a nearby earlier complaint
+HOTSPOT_SHARE = 0.9         # reports near a hot spot, the rest anywhere in the city
+HOTSPOT_SIGMA_M = 300
+
+_PROBLEMS = ['Overflowing garbage bin', 'Plastic waste dumped', 'Construction debris', 'Burning garbage',
+             'Uncollected household waste', 'Dead animal', 'Blocked drain full of litter', 'Broken dustbin',
+             'Medical waste dumped', 'E-waste left on the pavement', 'Garden waste piled up', 'Sewage overflow']
+_PLACES = ['near the bus stop', 'behind the market', 'outside the school gate', 'at the park entrance',
+           'next to the temple', 'on the main road', 'by the lake', 'in front of the hospital',
+           'at the street corner', 'near the metro station', 'beside the playground', 'under the flyover']
+_DETAILS = ['', '', '', ' It smells terrible.', ' Stray dogs are spreading it around.', ' It has been there for a week.',
+            ' Blocking the footpath.', ' Children play nearby.', ' Second report this month.']
+_NAMES = ['asha', 'ravi', 'meera', 'arjun', 'fatima', 'john', 'lakshmi', 'vikram', 'priya', 'imran', 'neha', 'suresh']
+
+
+def _placeholder_bytes(index, rng):
+    # A JPEG with a colour field and a few shapes; a tiny GIF without Pillow
+    from images import PIL_ENABLED
+    if not PIL_ENABLED:
+        return b'GIF89a\x01\x00\x01\x00\x80\x00\x00' + bytes([index % 256, 120, 60]) + b'\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;', 'gif'
+    from PIL import Image, ImageDraw
+    img = Image.new('RGB', (800, 600), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(800), rng.randrange(600)
+        draw.rectangle([x, y, x + rng.randrange(40, 200), y + rng.randrange(40, 160)],
+                       fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=80)
+    return out.getvalue(), 'jpg'
+
+
+def make_placeholders(count, rng):
+    """
+    Store `count` placeholder photos like real uploads
+
+    Returns:
+        list: dicts with path, thumb, medium and phash
+    """
+    from images import make_derivatives, dhash
+    from storage import get_storage, shard_key, path_from_key
+
+    storage = get_storage()
+    photos = []
+    for index in range(count):
+        data, ext = _placeholder_bytes(index, rng)
+        key = shard_key(f'{hashlib.sha256(data).hexdigest()}.{ext}')
+        if not storage.exists(key):
+            storage.put_stream(io.BytesIO(data), key)
+        path = path_from_key(key)
+        derivatives = make_derivatives(path)
+        photos.append({'path': path, 'thumb': derivatives.get('thumb'), 'medium': derivatives.get('medium'),
+                       'phash': dhash(io.BytesIO(data))})
+    return photos
+
+
+def _offset(lat, lon, sigma_m, rng):
+    # Gaussian scatter of about sigma_m metres around (lat, lon)
+    dlat = rng.gauss(0, sigma_m) / 111320.0
+    dlon = rng.gauss(0, sigma_m) / (111320.0 * max(math.cos(math.radians(lat)), 0.01))
+    return round(lat + dlat, 6), round(lon + dlon, 6)
+
+
+def seed_users(conn, count, workers, now, rng):
+    """
+    Insert one admin, `count` citizens and `workers` workers
+
+    Returns:
+        tuple: (citizen ids, worker ids)
+    """
+    from werkzeug.security import generate_password_hash
+
+    # One hash for everybody: hashing a million passwords would dominate the run
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    conn.execute("INSERT OR IGNORE INTO users (username, email, password_hash, role, created_at) VALUES (?,?,?,?,?)",
+                 ('seed-admin', 'seed-admin@example.com', password_hash, 'admin', now - timedelta(days=400)))
+    rows = []
+    for role, n in (('worker', workers), ('user', count)):
+        for i in range(n):
+            name = f"{rng.choice(_NAMES)}{start + len(rows)}"
+            rows.append((name, f'seed-{role}-{start + len(rows)}@example.com', f'9{rng.randrange(10 ** 9):09d}',
+                         password_hash, role, now - timedelta(days=rng.uniform(30, 400))))
+    for i in range(0, len(rows), SEED_CHUNK_SIZE):
+        conn.executemany('INSERT INTO users (username, email, phone, password_hash, role, created_at) VALUES (?,?,?,?,?,?)',
+                         rows[i:i + SEED_CHUNK_SIZE])
+        conn.commit()
+    emails = [row[1] for row in rows]
+    ids = {}
+    for i in range(0, len(emails), 500):
+        chunk = emails[i:i + 500]
+        ids.update(conn.execute(f"SELECT email, id FROM users WHERE email IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+    worker_ids = [ids[row[1]] for row in rows if row[4] == 'worker']
+    user_ids = [ids[row[1]] for row in rows if row[4] == 'user']
+    return user_ids, worker_ids
+
+
+def complaint_rows(count, first_id, user_ids, worker_ids, photos, center, radius_m, days, now, rng):
+    """Yield complaint tuples (see _COLUMNS) in id order, created_at growing with id"""
+    hotspots = [_offset(center[0], center[1], radius_m / 2, rng) for _ in range(max(5, count // 2500))]
+    statuses, weights = zip(*STATUS_WEIGHTS.items())
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(count, 1)
+    recent = []     # (id, status, worker, lat, lon) of the last primaries, for linked reports
+    for n in range(count):
+        complaint_id = first_id + n
+        created = start + step * n + step * rng.random()
+        if recent and rng.random() < LINKED_SHARE:
+            primary_id, status, worker_id, lat, lon = rng.choice(recent)
+            lat, lon = _offset(lat, lon, 15, rng)
+            cluster_id = primary_id
+        else:
+            status = rng.choices(statuses, weights)[0]
+            worker_id = None if status == 'Pending' else rng.choice(worker_ids) if worker_ids else None
+            if rng.random() < HOTSPOT_SHARE:
+                lat, lon = _offset(*rng.choice(hotspots), HOTSPOT_SIGMA_M, rng)
+            else:
+                lat, lon = _offset(center[0], center[1], radius_m, rng)
+            cluster_id = None
+            recent.append((complaint_id, status, worker_id, lat, lon))
+            del recent[:-50]
+        if status == 'Pending':
+            updated, assigned = created, None
+        else:
+            assigned = created + timedelta(minutes=rng.uniform(1, 600))
+            updated = min(assigned + timedelta(hours=rng.uniform(1, 240)), now)
+        before = rng.choice(photos)
+        after = rng.choice(photos) if status == 'Completed' else None
+        description = f"{rng.choice(_PROBLEMS)} {rng.choice(_PLACES)}.{rng.choice(_DETAILS)}"
+        yield (complaint_id, rng.choice(user_ids), worker_id, description, before['path'], before['thumb'],
+               before['medium'], before['phash'], after and after['path'], after and after['thumb'],
+               after and after['medium'], lat, lon, status, cluster_id, created, updated, assigned,
+               0 if status == 'Pending' else rng.randint(1, 3))
+
+
+# Complaint insert triggers replaced by _DERIVED (see migrations.py); any
+# other trigger is left in place and fires as usual
+_BULK_TRIGGERS = ('trg_counters_complaint_insert', 'trg_uploads_complaint_insert', 'trg_rtree_complaint_insert',
+                  'trg_fts_complaint_insert', 'trg_changes_complaint_insert')
+
+_IN_CHUNK = 'id BETWEEN :first AND :last'
+_DERIVED = [
+    "INSERT INTO counters (scope, scope_id, name, value) "
+    f"SELECT 'complaints', 0, status, COUNT(*) FROM complaints WHERE {_IN_CHUNK} GROUP BY status "
+    "ON CONFLICT(scope, scope_id, name) DO UPDATE SET value = value + excluded.value",
+    "INSERT INTO counters (scope, scope_id, name, value) "
+    f"SELECT 'user', user_id, status, COUNT(*) FROM complaints WHERE {_IN_CHUNK} GROUP BY user_id, status "
+    "ON CONFLICT(scope, scope_id, name) DO UPDATE SET value = value + excluded.value",
+    "INSERT INTO counters (scope, scope_id, name, value) "
+    f"SELECT 'worker', worker_id, status, COUNT(*) FROM complaints WHERE {_IN_CHUNK} AND worker_id IS NOT NULL "
+    "GROUP BY worker_id, status ON CONFLICT(scope, scope_id, name) DO UPDATE SET value = value + excluded.value",
+    "INSERT INTO uploads (path, refcount, created_at) SELECT path, COUNT(*), datetime('now') FROM ("
+    f"SELECT image_before_path AS path FROM complaints WHERE {_IN_CHUNK} UNION ALL "
+    f"SELECT image_after_path FROM complaints WHERE {_IN_CHUNK}) WHERE path IS NOT NULL AND path != '' GROUP BY path "
+    "ON CONFLICT(path) DO UPDATE SET refcount = refcount + excluded.refcount",
+    "INSERT INTO complaints_rtree (id, min_lat, max_lat, min_lon, max_lon, status) "
+    f"SELECT id, latitude, latitude, longitude, longitude, status FROM complaints WHERE {_IN_CHUNK} "
+    "AND typeof(latitude) IN ('real', 'integer') AND typeof(longitude) IN ('real', 'integer')",
+    "INSERT INTO complaints_fts (rowid, description, reporter) SELECT c.id, c.description, u.username "
+    f"FROM complaints c LEFT JOIN users u ON u.id = c.user_id WHERE c.{_IN_CHUNK}",
+    f"INSERT INTO complaint_changes (complaint_id) SELECT id FROM complaints WHERE {_IN_CHUNK} ORDER BY id",
+]
+
+_COLUMNS = ('id, user_id, worker_id, description, image_before_path, image_before_thumb, image_before_medium, '
+            'image_phash, image_after_path, image_after_thumb, image_after_medium, latitude, longitude, status, '
+            'cluster_id, created_at, updated_at, assigned_at, version')
+
+
+def insert_complaints(conn, rows):
+    """Insert one chunk of complaint tuples (ascending ids) as one transaction"""
+    placeholders = ','.join('?' * len(_COLUMNS.split(',')))
+    triggers = conn.execute(f"SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name='complaints' "
+                            f"AND name IN ({','.join('?' * len(_BULK_TRIGGERS))})", _BULK_TRIGGERS).fetchall()
+    try:
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.executemany(f'INSERT INTO complaints ({_COLUMNS}) VALUES ({placeholders})', rows)
+        chunk = {'first': rows[0][0], 'last': rows[-1][0]}
+        for statement in _DERIVED:
+            conn.execute(statement, chunk)
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+    except Exception:
+        # The rollback brings the dropped triggers back as well
+        conn.rollback()
+        raise
+
+
+def seed(conn, complaints, users, workers, center=(12.9716, 77.5946), radius_m=12000, days=365, photos=24,
+         seed_value=42, progress=print):
+    """
+    Add synthetic users and complaints to an (already migrated) database
+
+    Returns:
+        dict: counts of what was inserted and how long it took
+    """
+    rng = random.Random(seed_value)
+    now = datetime.utcnow().replace(microsecond=0)
+    started = time.perf_counter()
+    pool = make_placeholders(photos, rng)
+    user_ids, worker_ids = seed_users(conn, users, workers, now, rng)
+    progress(f"  {len(user_ids)} citizens, {len(worker_ids)} workers, {len(pool)} placeholder photos")
+    # Ids are assigned here so linked reports can point at their primary
+    first_id = conn.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name='complaints'), 0) + 1").fetchone()[0]
+    rows = complaint_rows(complaints, first_id, user_ids, worker_ids, pool, center, radius_m, days, now, rng)
+    inserted = 0
+    while inserted < complaints:
+        chunk = [row for _, row in zip(range(SEED_CHUNK_SIZE), rows)]
+        insert_complaints(conn, chunk)
+        inserted += len(chunk)
+        elapsed = time.perf_counter() - started
+        progress(f"  ... {inserted}/{complaints} complaints ({inserted / elapsed:,.0f}/s)")
+    return {'users': len(user_ids), 'workers': len(worker_ids), 'complaints': inserted,
+            'seconds': round(time.perf_counter() - started, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database with synthetic users and complaints')
+    parser.add_argument('--scale', choices=sorted(SCALES), help='preset sizes (overridden by the options below)')
+    parser.add_argument('--complaints', type=int)
+    parser.add_argument('--users', type=int, help='citizen accounts')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--db', help='database file (default: WASTE_REPORT_DB or waste_report.db)')
+    parser.add_argument('--fresh', action='store_true', help='delete the --db file first')
+    parser.add_argument('--center', default='12.9716,77.5946', help='city centre as lat,lon')
+    parser.add_argument('--radius', type=float, default=12000, help='city radius in metres')
+    parser.add_argument('--days', type=int, default=365, help='spread created_at over this many days')
+    parser.add_argument('--photos', type=int, default=24, help='placeholder photos to share between complaints')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (same seed, same data)')
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale or '10k'])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    if args.fresh:
+        if not args.db:
+            parser.error('--fresh needs an explicit --db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    if args.db:
+        # Read by db.py at import time
+        os.environ['WASTE_REPORT_DB'] = os.path.abspath(args.db)
+    try:
+        center = tuple(float(v) for v in args.center.split(','))
+    except ValueError:
+        parser.error('--center must be lat,lon')
+    from db import connect, init_db, DB_PATH
+
+    init_db()
+    conn = connect()
+    try:
+        print(f"Seeding {DB_PATH}: {sizes['complaints']} complaints, {sizes['users']} citizens, {sizes['workers']} workers")
+        result = seed(conn, sizes['complaints'], sizes['users'], sizes['workers'], center=center, radius_m=args.radius,
+                      days=args.days, photos=args.photos, seed_value=args.seed)
+    finally:
+        conn.close()
+    print(f"✓ Seeded {result['complaints']} complaints in {result['seconds']} s.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,6 +26,58 @@ document.addEventListener('DOMContentLoaded', function () {
       }, { enableHighAccuracy: true, timeout: 10000 });
     });
   }
+  // Route page: reload the plan starting from the worker's position
+  var routeBtn = document.getElementById('routeLocateBtn');
+  if (routeBtn) {
+    routeBtn.addEventListener('click', function () {
+      var status = document.getElementById('routeLocateStatus');
+      if (!navigator.geolocation) {
+        status.textContent = 'Geolocation not supported by your browser.';
+        return;
+      }
+      status.textContent = 'Locating...';
+      navigator.geolocation.getCurrentPosition(function (position) {
+        var params = new URLSearchParams(window.location.search);
+        params.set('lat', position.coords.latitude.toFixed(6));
+        params.set('lon', position.coords.longitude.toFixed(6));
+        window.location.search = params.toString();
+      }, function (err) {
+        status.textContent = 'Unable to retrieve location: ' + err.message;
+      }, { enableHighAccuracy: true, timeout: 10000 });
+    });
+  }
+  // Dashboards: live counters and activity over Server-Sent Events
+  var live = document.querySelector('[data-events-url]');
+  if (live && window.EventSource) {
+    var source = new EventSource(live.dataset.eventsUrl);
+    var feed = document.querySelector('[data-live-feed]');
+    var setStat = function (key, value) {
+      document.querySelectorAll('[data-stat="' + key + '"]').forEach(function (el) { el.textContent = value; });
+    };
+    source.addEventListener('snapshot', function (e) {
+      var stats = JSON.parse(e.data).stats;
+      Object.keys(stats).forEach(function (key) { setStat(key, stats[key]); });
+    });
+    source.addEventListener('complaint', function (e) {
+      var data = JSON.parse(e.data);
+      Object.keys(data.stats).forEach(function (key) {
+        document.querySelectorAll('[data-stat="' + key + '"]').forEach(function (el) {
+          el.textContent = (parseInt(el.textContent, 10) || 0) + data.stats[key];
+        });
+      });
+      if (feed) {
+        var placeholder = feed.querySelector('.muted');
+        if (placeholder) placeholder.remove();
+        var item = document.createElement('li');
+        var c = data.complaint;
+        item.textContent = data.action === 'created'
+          ? 'New report #' + c.id + ': ' + truncateText(c.description || '', 80)
+          : 'Complaint #' + c.id + ' ' + data.action + ' (' + c.status + ')';
+        feed.insertBefore(item, feed.firstChild);
+        while (feed.children.length > 10) feed.removeChild(feed.lastChild);
+      }
+    });
+  }
   // Auto-dismiss flash notifications after 2 seconds
   var flashes = document.querySelectorAll('.flash');
   if (flashes && flashes.length) {
@@ -0,0 +1,334 @@
+"""
+Upload storage backends
+Stored image paths look like 'static/uploads/<key>' whatever the backend; the
+key is sharded by hash prefix ('ab/cd/<name>') so no directory (or S3 listing
+prefix) grows without bound.
+
+Backends:
+    LocalStorage - files under static/uploads, served by Flask/the web server
+    S3Storage    - any S3-compatible store (AWS, MinIO, ...) through boto3
+
+Usage:
+    python storage.py --migrate             # move flat uploads into the sharded layout
+    python storage.py --migrate --dry-run   # show what would move
+"""
+import os
+import io
+import re
+import sys
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+# boto3 is optional - only needed for the S3 backend
+try:
+    import boto3
+    BOTO3_ENABLED = True
+except ImportError:
+    BOTO3_ENABLED = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_PREFIX = 'static/uploads'
+CHUNK_SIZE = 64 * 1024
+
+STORAGE_CONFIG = {
+    'STORAGE_BACKEND': 'local',         # 'local' or 's3'
+    'STORAGE_SHARD_DEPTH': 2,           # directory levels of 2 hex chars each
+    'UPLOAD_FOLDER': os.path.join(BASE_DIR, 'static', 'uploads'),
+    'UPLOAD_URL_PREFIX': '/uploads',    # route that serves local uploads (see app.serve_upload)
+    'S3_BUCKET': None,
+    'S3_PREFIX': '',
+    'S3_ENDPOINT_URL': None,            # e.g. http://localhost:9000 for a local MinIO
+    'S3_PUBLIC_URL': None,              # base URL the bucket is served from
+}
+
+_HASH_NAME = re.compile(r'^[0-9a-f]{8,}')
+
+
+def key_from_path(rel_path):
+    # 'static/uploads/ab/cd/x.jpg' -> 'ab/cd/x.jpg'
+    prefix = UPLOAD_PREFIX + '/'
+    return rel_path[len(prefix):] if rel_path.startswith(prefix) else rel_path
+
+
+def path_from_key(key):
+    return f'{UPLOAD_PREFIX}/{key}'
+
+
+def shard_key(name, depth=None):
+    """Sharded key for a file name: content-hash names shard on their own prefix"""
+    depth = STORAGE_CONFIG['STORAGE_SHARD_DEPTH'] if depth is None else depth
+    digest = name if _HASH_NAME.match(name) else hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return '/'.join([digest[i * 2:i * 2 + 2] for i in range(depth)] + [name])
+
+
+class LocalStorage:
+    """Files on the local filesystem below `root`"""
+
+    def __init__(self, root, url_prefix='/' + UPLOAD_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def _abs(self, key):
+        return os.path.join(self.root, key.replace('/', os.sep))
+
+    def local_path(self, key):
+        return self._abs(key)
+
+    def exists(self, key):
+        return os.path.exists(self._abs(key))
+
+    def open(self, key):
+        return open(self._abs(key), 'rb')
+
+    def put_stream(self, stream, key):
+        # Temp file in the target directory + rename, so readers never see partial files
+        dest = self._abs(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+            os.replace(tmp, dest)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def put_file(self, src, key):
+        # Hard link when possible (no data copied); the caller removes src afterwards
+        dest = self._abs(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.exists(dest):
+            return
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def delete(self, key):
+        try:
+            os.remove(self._abs(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url(self, key):
+        return f'{self.url_prefix}/{key}'
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, public_url=None, client=None):
+        if client is None:
+            if not BOTO3_ENABLED:
+                raise RuntimeError('The S3 storage backend requires boto3 (pip install boto3)')
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.public_url = (public_url or f"{endpoint_url or 'https://s3.amazonaws.com'}/{bucket}").rstrip('/')
+
+    def _object(self, key):
+        return self.prefix + key
+
+    def local_path(self, key):
+        return None
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except Exception as e:
+            status = getattr(e, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if status == 404:
+                return False
+            if status == 403:
+                # Without s3:ListBucket a missing object is a 403, not a 404.
+                # Callers then (re)write it, which is harmless for
+                # content-addressed keys.
+                return False
+            raise
+
+    def open(self, key):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object(key))['Body']
+        return io.BytesIO(body.read())
+
+    def put_stream(self, stream, key):
+        self.client.upload_fileobj(stream, self.bucket, self._object(key))
+
+    def put_file(self, src, key):
+        self.client.upload_file(src, self.bucket, self._object(key))
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        return True
+
+    def url(self, key):
+        return f'{self.public_url}/{self._object(key)}'
+
+
+_storage = None
+
+
+def configure_storage(config):
+    global _storage
+    for key in STORAGE_CONFIG:
+        if key in config:
+            STORAGE_CONFIG[key] = config[key]
+    _storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        if STORAGE_CONFIG['STORAGE_BACKEND'] == 's3':
+            _storage = S3Storage(STORAGE_CONFIG['S3_BUCKET'], STORAGE_CONFIG['S3_PREFIX'],
+                                 STORAGE_CONFIG['S3_ENDPOINT_URL'], STORAGE_CONFIG['S3_PUBLIC_URL'])
+        else:
+            _storage = LocalStorage(STORAGE_CONFIG['UPLOAD_FOLDER'], STORAGE_CONFIG['UPLOAD_URL_PREFIX'])
+    return _storage
+
+
+# Names that never change content: '<sha256>...' and legacy '<kind>_<unix time>_<name>'
+_IMMUTABLE_NAME = re.compile(r'^(?:[0-9a-f]{64}|(?:before|after)_\d{9,}_)')
+
+
+def is_immutable(key):
+    return bool(_IMMUTABLE_NAME.match(os.path.basename(key)))
+
+
+def upload_url(rel_path):
+    # Jinja filter: stored image path -> URL the browser can fetch
+    return get_storage().url(key_from_path(rel_path)) if rel_path else ''
+
+
+# Stored path columns of complaints and complaints_archive, originals first
+_PATH_COLUMNS = ('image_before_path', 'image_before_thumb', 'image_before_medium',
+                 'image_after_path', 'image_after_thumb', 'image_after_medium')
+
+
+def migrate_layout(conn, batch_size=200, dry_run=False):
+    """
+    Move uploads stored outside the sharded layout (or on local disk when the
+    backend is S3) to their sharded key, rewriting the stored paths in batches
+
+    Each file is first linked/copied to its new key, the paths are rewritten
+    and committed, and only then is the old file removed - an interrupted run
+    can simply be started again. Archived complaints are migrated after the
+    live ones.
+
+    Returns:
+        int: number of files moved
+    """
+    moved = 0
+    for table in ('complaints', 'complaints_archive'):
+        moved = _migrate_table(conn, table, moved, batch_size, dry_run)
+    return moved
+
+
+def _migrate_table(conn, table, moved, batch_size, dry_run):
+    from images import derivative_path
+
+    storage = get_storage()
+    legacy = LocalStorage(STORAGE_CONFIG['UPLOAD_FOLDER'])
+    on_local = isinstance(storage, LocalStorage)
+    assignments = ', '.join(f'{column}=?' for column in _PATH_COLUMNS)
+    last_id = 0
+    cur = conn.cursor()
+    while True:
+        cur.execute(f"SELECT id, {', '.join(_PATH_COLUMNS)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return moved
+        last_id = rows[-1][0]
+
+        renames = {}
+        for row in rows:
+            for i in range(2):
+                original, thumb, medium = row[1 + i * 3], row[2 + i * 3], row[3 + i * 3]
+                if not original or original in renames:
+                    continue
+                old_key = key_from_path(original)
+                new_key = shard_key(os.path.basename(old_key))
+                if old_key == new_key and (on_local or not legacy.exists(old_key)):
+                    continue
+                new_path = path_from_key(new_key)
+                renames[original] = new_path
+                for old_derivative, kind in ((thumb, 'thumb'), (medium, 'medium')):
+                    if old_derivative:
+                        ext = os.path.splitext(old_derivative)[1]
+                        renames[old_derivative] = os.path.splitext(derivative_path(new_path, kind))[0] + ext
+        if not renames:
+            continue
+        if dry_run:
+            for old, new in renames.items():
+                print(f"  {old} -> {new}")
+            moved += len(renames)
+            continue
+
+        # One primary-key UPDATE per affected row of this batch; rows in later
+        # batches still holding a path renamed here are rewritten when reached
+        updates = []
+        for row in rows:
+            values = [renames.get(value, value) for value in row[1:]]
+            if values != list(row[1:]):
+                updates.append((row, values))
+
+        copied = []
+        for old, new in renames.items():
+            src = legacy.local_path(key_from_path(old))
+            if os.path.exists(src):
+                storage.put_file(src, key_from_path(new))
+                copied.append(old)
+
+        cur.execute('BEGIN IMMEDIATE')
+        cur.executemany(f'UPDATE {table} SET {assignments} WHERE id=?',
+                        [(*values, row[0]) for row, values in updates])
+        if table == 'complaints_archive':
+            # No update triggers on archived rows: move their references by hand
+            for row, values in updates:
+                for i in (0, 3):
+                    old, new = row[1 + i], values[i]
+                    if old != new:
+                        cur.execute('UPDATE uploads SET refcount = refcount - 1 WHERE path=?', (old,))
+                        cur.execute("INSERT INTO uploads (path, refcount, created_at) VALUES (?, 1, datetime('now')) "
+                                    'ON CONFLICT(path) DO UPDATE SET refcount = refcount + 1', (new,))
+        # Triggers moved the reference counts; drop the emptied rows of old paths
+        cur.executemany('DELETE FROM uploads WHERE path=? AND refcount<=0', [(old,) for old in renames])
+        cur.execute('COMMIT')
+
+        for old in copied:
+            legacy.delete(key_from_path(old))
+        moved += len(copied)
+        print(f"  ... {moved} file(s) moved (up to {table} id {last_id})")
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Upload storage tools')
+    parser.add_argument('--migrate', action='store_true', help='move uploads into the sharded layout of the configured backend')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    if not args.migrate:
+        parser.print_help()
+        return 0
+    conn = connect()
+    conn.isolation_level = None
+    try:
+        count = migrate_layout(conn, batch_size=args.batch_size, dry_run=args.dry_run)
+        print(f"✓ {'Would move' if args.dry_run else 'Moved'} {count} file(s).")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
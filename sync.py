@@ -0,0 +1,208 @@
+"""
+Delta sync for worker clients
+Every insert, update and delete on complaints appends the complaint id to
+complaint_changes (triggers, see migrations.py). A client keeps the cursor
+from its last response and asks only for what changed after it:
+
+    GET /api/worker/sync                 -> snapshot of the open complaints (paged)
+    GET /api/worker/sync?since=<cursor>  -> complaints changed since then
+
+Each response lists `upserted` complaints (current state, still open) and
+`removed` ids (completed, merged into a cluster or deleted). Cursors are
+opaque to clients: '<seq>' once up to date with the change log,
+'<seq>.<id>' while still paging through the snapshot. A cursor older than
+the retained log gets a fresh snapshot with reset = true.
+
+Usage:
+    python sync.py --status          # change log size and head
+    python sync.py --prune [--days]  # drop entries older than the retention
+"""
+import sys
+import argparse
+
+from jobs import handler, enqueue
+from storage import upload_url
+
+SYNC_CONFIG = {
+    'SYNC_PAGE_SIZE': 500,          # complaints per response
+    'SYNC_RETENTION_DAYS': 30,      # change log kept this long; older cursors resync
+}
+
+OPEN_STATUSES = ('Pending', 'Accepted', 'In Progress')
+_COLUMNS = ('id, description, status, worker_id, latitude, longitude, created_at, updated_at, version, '
+            'cluster_id, image_before_path, image_before_thumb')
+_PRUNE_INTERVAL = 24 * 3600
+
+
+def configure_sync(config):
+    for key in SYNC_CONFIG:
+        if key in config:
+            SYNC_CONFIG[key] = config[key]
+
+
+def parse_cursor(token):
+    """
+    Returns:
+        tuple: (seq, snapshot_after_id) - snapshot_after_id is None in delta
+               mode; (None, 0) for a new snapshot
+
+    Raises:
+        ValueError: for a malformed cursor
+    """
+    if not token:
+        return None, 0
+    seq, _, after_id = token.partition('.')
+    if not seq.isdigit() or (after_id and not after_id.isdigit()):
+        raise ValueError(f'invalid cursor {token!r}')
+    return int(seq), (int(after_id) if after_id else None)
+
+
+def head(cur):
+    # Last sequence number handed out (kept by AUTOINCREMENT even if pruned)
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name='complaint_changes'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _pruned_through(cur, head_seq):
+    cur.execute('SELECT MIN(seq) FROM complaint_changes')
+    oldest = cur.fetchone()[0]
+    return head_seq if oldest is None else oldest - 1
+
+
+def etag(token, head_seq, limit):
+    # A response is fully determined by the cursor, the log head and the page size
+    return f'sync-{token or "start"}-{head_seq}-{limit}'
+
+
+def _visible(row):
+    return row['status'] in OPEN_STATUSES and row['cluster_id'] is None
+
+
+def _serialize(row):
+    item = {k: row[k] for k in row.keys() if k not in ('image_before_path', 'image_before_thumb', 'cluster_id')}
+    item['image_url'] = upload_url(row['image_before_thumb'] or row['image_before_path'])
+    return item
+
+
+def _snapshot(cur, head_seq, after_id, limit):
+    cur.execute(f"SELECT {_COLUMNS} FROM complaints WHERE id > ? AND status IN ({','.join('?' * len(OPEN_STATUSES))}) "
+                f"AND cluster_id IS NULL ORDER BY id LIMIT ?", (after_id, *OPEN_STATUSES, limit + 1))
+    rows = cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'reset': after_id == 0,
+        'upserted': [_serialize(r) for r in rows],
+        'removed': [],
+        # Changes made while the snapshot is paged are replayed from head_seq afterwards
+        'cursor': f'{head_seq}.{rows[-1]["id"]}' if more else str(head_seq),
+        'more': more,
+    }
+
+
+def sync_page(cur, token, limit, head_seq=None):
+    """
+    One sync response for `token` (see the module docstring)
+
+    Returns:
+        dict: reset, upserted, removed, cursor, more
+
+    Raises:
+        ValueError: for a malformed cursor
+    """
+    seq, after_id = parse_cursor(token)
+    head_seq = head(cur) if head_seq is None else head_seq
+    if seq is None or seq > head_seq or (after_id is None and seq < _pruned_through(cur, head_seq)):
+        # New client, a cursor from another database, or changes already pruned
+        return _snapshot(cur, head_seq, 0, limit)
+    if after_id is not None:
+        return _snapshot(cur, seq, after_id, limit)
+
+    cur.execute('SELECT seq, complaint_id FROM complaint_changes WHERE seq > ? ORDER BY seq LIMIT ?', (seq, limit + 1))
+    changes = cur.fetchall()
+    more = len(changes) > limit
+    changes = changes[:limit]
+    ids = list(dict.fromkeys(c['complaint_id'] for c in changes))
+    current = {}
+    if ids:
+        cur.execute(f"SELECT {_COLUMNS} FROM complaints WHERE id IN ({','.join('?' * len(ids))})", ids)
+        current = {row['id']: row for row in cur.fetchall()}
+    upserted, removed = [], []
+    for complaint_id in ids:
+        row = current.get(complaint_id)
+        if row is not None and _visible(row):
+            upserted.append(_serialize(row))
+        else:
+            removed.append(complaint_id)
+    return {
+        'reset': False,
+        'upserted': upserted,
+        'removed': removed,
+        'cursor': str(changes[-1]['seq']) if changes else str(seq),
+        'more': more,
+    }
+
+
+def prune_changes(conn, days=None):
+    """
+    Delete change log entries older than `days`; meant to run through
+    db.run_write(). The log is in time order, so only the deleted prefix is
+    scanned.
+
+    Returns:
+        int: entries deleted
+    """
+    days = SYNC_CONFIG['SYNC_RETENTION_DAYS'] if days is None else days
+    cur = conn.execute(
+        "DELETE FROM complaint_changes WHERE seq < COALESCE("
+        "(SELECT seq FROM complaint_changes WHERE changed_at >= datetime('now', ?) ORDER BY seq LIMIT 1), "
+        "(SELECT seq + 1 FROM sqlite_sequence WHERE name='complaint_changes'), 0)",
+        (f'-{int(days)} days',))
+    return cur.rowcount
+
+
+def _prune_step(conn, days):
+    deleted = prune_changes(conn, days)
+    # The next run is queued in the same transaction, so the daily chain never breaks
+    enqueue(conn, 'sync.prune', {}, delay=_PRUNE_INTERVAL)
+    return deleted
+
+
+@handler('sync.prune')
+def prune_job(days=None):
+    """Background job: prune the change log, then schedule the next run"""
+    from db import run_write
+
+    return {'deleted': run_write(_prune_step, days)}
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Worker sync change log tools')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--status', action='store_true', help='show change log size and head')
+    group.add_argument('--prune', action='store_true', help='delete entries older than the retention period')
+    parser.add_argument('--days', type=int, default=SYNC_CONFIG['SYNC_RETENTION_DAYS'])
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        if args.prune:
+            deleted = prune_changes(conn, args.days)
+            conn.commit()
+            print(f"✓ Deleted {deleted} change log entr{'y' if deleted == 1 else 'ies'} older than {args.days} days.")
+        head_seq = head(cur)
+        cur.execute('SELECT COUNT(*), MIN(changed_at) FROM complaint_changes')
+        count, oldest = cur.fetchone()
+        print(f"Head: {head_seq}, pruned through: {_pruned_through(cur, head_seq)}, "
+              f"{count} entries" + (f" since {oldest}" if oldest else ''))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
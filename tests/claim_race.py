@@ -0,0 +1,52 @@
+"""
+Helpers for racing workers through /api/worker/claim (tests/test_claims.py)
+"""
+import os
+import threading
+
+
+def race_claims(app, worker_ids, payload_for, rounds=1):
+    """
+    POST /api/worker/claim `rounds` times from one thread per worker, all
+    threads released together
+
+    Args:
+        payload_for: worker id -> JSON body to send
+
+    Returns:
+        list: (worker_id, status code, JSON response) per request
+    """
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(worker_ids))
+
+    def worker(worker_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = worker_id
+            sess['role'] = 'worker'
+        barrier.wait()
+        for _ in range(rounds):
+            response = client.post('/api/worker/claim', json=payload_for(worker_id))
+            with lock:
+                results.append((worker_id, response.status_code, response.get_json()))
+
+    pool = [threading.Thread(target=worker, args=(w,)) for w in worker_ids]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results
+
+
+def isolate_app(webapp, workdir):
+    """
+    Configure the imported app module for a scratch database: no scheduler,
+    no job runner, uploads below `workdir`. The upload collector would
+    otherwise treat every real upload as an orphan of the empty database.
+    """
+    webapp.app.config.update(SCHEDULER_ENABLED=False, JOBS_ENABLED=False,
+                             UPLOAD_FOLDER=os.path.join(workdir, 'uploads'))
+    webapp.scheduler.configure_scheduler(webapp.app.config)
+    webapp.jobs.configure_jobs(webapp.app.config)
+    webapp.configure_storage(webapp.app.config)
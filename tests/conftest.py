@@ -0,0 +1,40 @@
+"""
+Shared test setup
+Tests import the flat root modules and never touch waste_report.db: db.py
+reads WASTE_REPORT_DB at import time, so it is pointed at a scratch file
+before any test module imports it.
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_WORKDIR = tempfile.mkdtemp(prefix='waste-report-tests-')
+os.environ['WASTE_REPORT_DB'] = os.path.join(_WORKDIR, 'test.db')
+
+
+@pytest.fixture
+def migrated_db(tmp_path):
+    """A fresh database at the latest migration"""
+    from migrations import apply_migrations
+
+    conn = sqlite3.connect(str(tmp_path / 'migrated.db'))
+    apply_migrations(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def upload_folder(tmp_path):
+    """Local upload storage in a scratch directory for the test's duration"""
+    import storage
+
+    previous = storage.STORAGE_CONFIG['UPLOAD_FOLDER']
+    storage.configure_storage({'UPLOAD_FOLDER': str(tmp_path / 'uploads')})
+    yield tmp_path / 'uploads'
+    storage.configure_storage({'UPLOAD_FOLDER': previous})
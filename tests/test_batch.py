@@ -0,0 +1,56 @@
+"""
+Batch submission (batch.insert_batch): linked reports take over their
+primary's assignment, also when the primary came earlier in the same batch
+"""
+import sqlite3
+from datetime import datetime
+
+from batch import insert_batch
+
+
+def _item(client_id, latitude, longitude):
+    return {'client_id': client_id, 'description': f'bin {client_id}', 'image_path': '', 'latitude': latitude,
+            'longitude': longitude, 'phash': None, 'reported_at': None}
+
+
+def test_linked_items_follow_their_primary(migrated_db):
+    migrated_db.row_factory = sqlite3.Row  # as db.connect() sets it
+    now = datetime.utcnow()
+    citizen = migrated_db.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                                  "VALUES ('batch-citizen', 'c@example.com', '-', 'user', ?)", (now,)).lastrowid
+    worker = migrated_db.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                                 "VALUES ('batch-worker', 'w@example.com', '-', 'worker', ?)", (now,)).lastrowid
+    primary = migrated_db.execute(
+        "INSERT INTO complaints (user_id, worker_id, description, image_before_path, latitude, longitude, status, "
+        "assigned_at, created_at, updated_at) VALUES (?, ?, 'overflowing', '', 12.9716, 77.5946, 'Accepted', ?, ?, ?)",
+        (citizen, worker, now, now, now)).lastrowid
+
+    existing, created = insert_batch(migrated_db, citizen, [
+        _item('near-assigned', 12.97161, 77.59461),
+        _item('new-1', 13.0500, 77.6200),
+        _item('new-2', 13.05001, 77.62001),
+    ])
+
+    assert existing == {}
+    assert created['near-assigned']['cluster_id'] == primary
+    row = migrated_db.execute('SELECT status, worker_id, assigned_at FROM complaints WHERE id=?',
+                              (created['near-assigned']['id'],)).fetchone()
+    assert tuple(row) == ('Accepted', worker, str(now))
+    # Two reports of one new spot in the same batch form one cluster
+    assert created['new-1']['cluster_id'] is None
+    assert created['new-2']['cluster_id'] == created['new-1']['id']
+
+
+def test_retry_after_archiving_is_a_duplicate(migrated_db):
+    migrated_db.row_factory = sqlite3.Row
+    citizen = migrated_db.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                                  "VALUES ('batch-citizen', 'c@example.com', '-', 'user', ?)", (datetime.utcnow(),)).lastrowid
+    _, created = insert_batch(migrated_db, citizen, [_item('sent-once', None, None)])
+    complaint_id = created['sent-once']['id']
+    # As archive.archive_batch moves a row
+    migrated_db.execute('INSERT INTO complaints_archive SELECT * FROM complaints WHERE id=?', (complaint_id,))
+    migrated_db.execute('DELETE FROM complaints WHERE id=?', (complaint_id,))
+
+    existing, created = insert_batch(migrated_db, citizen, [_item('sent-once', None, None)])
+
+    assert existing == {'sent-once': complaint_id} and created == {}
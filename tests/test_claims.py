@@ -0,0 +1,87 @@
+"""
+Concurrent claims through /api/worker/claim: however many workers race,
+each complaint ends up with exactly one of them (see claims.py)
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from claim_race import race_claims, isolate_app
+from claims import claim_complaint
+
+# CLAIM_RACE_THREADS raises the number of racing workers for a harder run
+WORKERS = int(os.environ.get('CLAIM_RACE_THREADS', 16))
+
+
+@pytest.fixture(scope='module')
+def claim_app(tmp_path_factory):
+    import app as webapp
+    from db import connect
+
+    isolate_app(webapp, str(tmp_path_factory.mktemp('claims')))
+    webapp.init_db()
+    conn = connect()
+    now = datetime.utcnow()
+    for i in range(WORKERS):
+        conn.execute("INSERT INTO users (username, email, password_hash, role, created_at) VALUES (?,?,'-','worker',?)",
+                     (f'claims-worker{i}', f'claims-worker{i}@example.com', now))
+    conn.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                 "VALUES ('claims-citizen', 'claims-citizen@example.com', '-', 'user', ?)", (now,))
+    conn.commit()
+    worker_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'claims-worker%' ORDER BY id")]
+    citizen = conn.execute("SELECT id FROM users WHERE username='claims-citizen'").fetchone()[0]
+    yield webapp.app, conn, worker_ids, citizen
+    conn.close()
+
+
+def _report(conn, citizen, count):
+    ids = []
+    for i in range(count):
+        now = datetime.utcnow()
+        ids.append(conn.execute("INSERT INTO complaints (user_id, description, image_before_path, status, created_at, updated_at) "
+                                "VALUES (?, ?, '', 'Pending', ?, ?)", (citizen, f'claim race {i}', now, now)).lastrowid)
+    conn.commit()
+    return ids
+
+
+def test_one_winner_per_complaint(claim_app):
+    app, conn, worker_ids, citizen = claim_app
+    complaint_id, = _report(conn, citizen, 1)
+
+    results = race_claims(app, worker_ids, lambda w: {'complaint_id': complaint_id, 'version': 0})
+
+    winners = [worker for worker, status, _ in results if status == 200]
+    assert len(winners) == 1
+    assert sorted(status for _, status, _ in results) == [200] + [409] * (WORKERS - 1)
+    row = conn.execute('SELECT status, worker_id, version FROM complaints WHERE id=?', (complaint_id,)).fetchone()
+    assert tuple(row) == ('Accepted', winners[0], 1)
+
+
+def test_next_available_until_empty(claim_app):
+    app, conn, worker_ids, citizen = claim_app
+    _report(conn, citizen, 100)
+    claimable = {row[0] for row in conn.execute(
+        "SELECT id FROM complaints WHERE status='Pending' AND worker_id IS NULL AND cluster_id IS NULL")}
+
+    results = race_claims(app, worker_ids, lambda w: {}, rounds=len(claimable) // WORKERS + 2)
+
+    claimed = [(worker, body['complaint']['id']) for worker, status, body in results if status == 200]
+    ids = [complaint_id for _, complaint_id in claimed]
+    assert len(ids) == len(set(ids)) and set(ids) == claimable
+    assert all(status in (200, 404) for _, status, _ in results)
+    owners = dict(conn.execute("SELECT id, worker_id FROM complaints WHERE status='Accepted'").fetchall())
+    assert all(owners[complaint_id] == worker for worker, complaint_id in claimed)
+
+
+def test_linked_reports_follow_the_claim(claim_app):
+    app, conn, worker_ids, citizen = claim_app
+    primary, linked = _report(conn, citizen, 2)
+    conn.execute('UPDATE complaints SET cluster_id=? WHERE id=?', (primary, linked))
+
+    claimed = claim_complaint(conn, worker_ids[0], primary)
+    conn.commit()
+
+    assert claimed['linked'] == 1
+    row = conn.execute('SELECT status, worker_id, assigned_at FROM complaints WHERE id=?', (linked,)).fetchone()
+    assert row[0] == 'Accepted' and row[1] == worker_ids[0] and row[2] is not None
@@ -0,0 +1,54 @@
+"""
+Event streams: a dashboard's counters are its snapshot plus the deltas
+streamed after it, so every committed change must be in exactly one of them
+(see events.stream)
+"""
+import json
+
+import pytest
+
+import events
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    bus = events.EventBus(100, 100)
+    monkeypatch.setattr(events, '_bus', bus)
+    return bus
+
+
+def _data(message):
+    return json.loads(message.split('data: ', 1)[1])
+
+
+def test_event_published_while_connecting_is_counted_once(bus):
+    committed = {'count': 0}
+
+    def write():
+        # A writer commits, then publishes its delta
+        committed['count'] += 1
+        bus.publish('complaint', {'delta': 1})
+
+    body = events.stream(lambda event: event.data, snapshot=lambda: {'count': committed['count']})
+    assert next(body).startswith('retry:')
+    write()
+    snapshot = next(body)
+    delta = next(body)
+    body.close()
+
+    assert 'event: snapshot' in snapshot and 'event: complaint' in delta
+    assert _data(snapshot)['count'] + _data(delta)['delta'] == committed['count']
+    assert bus.subscribers == set()
+
+
+def test_reconnect_replays_missed_events(bus):
+    first = bus.publish('complaint', {'delta': 1})
+    bus.publish('complaint', {'delta': 2})
+
+    body = events.stream(lambda event: event.data, last_event_id=bus.event_id(first.seq),
+                         snapshot=lambda: pytest.fail('a replayable reconnect needs no snapshot'))
+    next(body)
+    replayed = next(body)
+    body.close()
+
+    assert _data(replayed) == {'delta': 2}
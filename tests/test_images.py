@@ -0,0 +1,43 @@
+"""
+Image derivatives: the backfill reaches archived complaints, and the
+perceptual hash needs no deprecated Pillow API
+"""
+import io
+import warnings
+from datetime import datetime
+
+from PIL import Image
+
+from images import backfill, dhash
+from storage import get_storage
+
+
+def _jpeg(colour):
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), colour).save(data, 'JPEG')
+    return data.getvalue()
+
+
+def test_backfill_covers_archived_complaints(upload_folder, migrated_db):
+    now = datetime.utcnow()
+    user = migrated_db.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                               "VALUES ('img-citizen', 'img@example.com', '-', 'user', ?)", (now,)).lastrowid
+    for table, key, colour in (('complaints', 'aa/bb/live.jpg', 'red'), ('complaints_archive', 'cc/dd/old.jpg', 'blue')):
+        get_storage().put_stream(io.BytesIO(_jpeg(colour)), key)
+        migrated_db.execute(f"INSERT INTO {table} (user_id, description, image_before_path, status, created_at, updated_at) "
+                            f"VALUES (?, 'bin', ?, 'Completed', ?, ?)", (user, f'static/uploads/{key}', now, now))
+    migrated_db.commit()
+
+    assert backfill(migrated_db, webp=False) == 2
+
+    for table in ('complaints', 'complaints_archive'):
+        thumb, medium = migrated_db.execute(f'SELECT image_before_thumb, image_before_medium FROM {table}').fetchone()
+        assert thumb and medium
+        assert get_storage().exists(thumb.split('static/uploads/', 1)[1])
+
+
+def test_dhash_without_deprecation_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        # dhash() returns None on any error, a warning turned into one included
+        assert dhash(io.BytesIO(_jpeg('green'))) is not None
@@ -0,0 +1,56 @@
+"""
+Route queries stay on their indexes: the check behind
+`python migrate_db.py --check-plans`. The PLAN_ROUTES requests run against
+a seeded, partly archived database; the statements they ran are explained
+there after ANALYZE (the planner's choices change with statistics) and on
+a freshly migrated one.
+"""
+import pytest
+
+from migrations import PLAN_ROUTES, capture_route_statements, check_query_plans
+
+
+@pytest.fixture(scope='module')
+def seeded_app_db(tmp_path_factory):
+    import storage
+    from archive import archive_batch
+    from db import connect, init_db
+    from seed_data import seed
+
+    previous = storage.STORAGE_CONFIG['UPLOAD_FOLDER']
+    storage.configure_storage({'UPLOAD_FOLDER': str(tmp_path_factory.mktemp('uploads'))})
+    init_db()
+    conn = connect()
+    try:
+        seed(conn, 3000, 200, 10, photos=2, progress=lambda message: None)
+        archive_batch(conn, days=90, batch_size=3000)
+        conn.commit()
+        assert conn.execute('SELECT COUNT(*) FROM complaints_archive').fetchone()[0] > 0
+        conn.execute('ANALYZE')
+        yield conn
+    finally:
+        conn.close()
+        storage.configure_storage({'UPLOAD_FOLDER': previous})
+
+
+def test_every_route_runs_sql(seeded_app_db):
+    statements = capture_route_statements(writes=True)
+    assert set(statements) == set(PLAN_ROUTES) | {'export'}
+    assert [name for name, sql in statements.items() if not sql] == []
+
+
+def test_plans_on_seeded_database(seeded_app_db):
+    assert check_query_plans(seeded_app_db, writes=True) == {}
+
+
+def test_plans_on_empty_database(seeded_app_db, migrated_db):
+    assert check_query_plans(migrated_db) == {}
+
+
+def test_sorted_page_is_reported(seeded_app_db, migrated_db):
+    # Without its archive index the completed list sorts every completed row per page
+    migrated_db.execute('DROP INDEX idx_archive_status_updated')
+    failures = check_query_plans(migrated_db)
+    assert list(failures) == ['admin_reports?filter=completed']
+    sql, details = failures['admin_reports?filter=completed']
+    assert 'complaints_all' in sql and any('TEMP B-TREE' in line for line in details)
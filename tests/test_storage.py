@@ -0,0 +1,121 @@
+"""
+S3Storage against a fake boto3 client (no bucket or network needed), and
+migrate_layout moving local uploads into it
+"""
+import io
+import os
+from datetime import datetime
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import storage
+from storage import S3Storage, migrate_layout, shard_key
+
+
+class FakeS3Client:
+    """The boto3 S3 client calls S3Storage makes, kept in a dict"""
+
+    def __init__(self, forbidden=()):
+        self.objects = {}
+        # Keys HeadObject answers 403 for, as S3 does without s3:ListBucket
+        self.forbidden = set(forbidden)
+        self.fail_with = None
+
+    @staticmethod
+    def _error(status):
+        error = Exception(f'HTTP {status}')
+        error.response = {'ResponseMetadata': {'HTTPStatusCode': status}}
+        return error
+
+    def head_object(self, Bucket, Key):
+        if self.fail_with:
+            raise self._error(self.fail_with)
+        if Key in self.forbidden:
+            raise self._error(403)
+        if (Bucket, Key) not in self.objects:
+            raise self._error(404)
+        return {'ContentLength': len(self.objects[Bucket, Key])}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._error(404)
+        return {'Body': io.BytesIO(self.objects[Bucket, Key])}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        self.objects[Bucket, Key] = Fileobj.read()
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.objects[Bucket, Key] = f.read()
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture
+def s3(monkeypatch, upload_folder):
+    client = FakeS3Client()
+    backend = S3Storage('bucket', prefix='/uploads/', public_url='https://cdn.example.com/', client=client)
+    monkeypatch.setitem(storage.STORAGE_CONFIG, 'STORAGE_BACKEND', 's3')
+    monkeypatch.setattr(storage, '_storage', backend)
+    return backend
+
+
+def test_objects_round_trip(s3, tmp_path):
+    s3.put_stream(io.BytesIO(b'streamed'), 'ab/cd/one.jpg')
+    src = tmp_path / 'two.jpg'
+    src.write_bytes(b'from a file')
+    s3.put_file(str(src), 'ef/01/two.jpg')
+
+    assert s3.client.objects == {('bucket', 'uploads/ab/cd/one.jpg'): b'streamed',
+                                 ('bucket', 'uploads/ef/01/two.jpg'): b'from a file'}
+    assert s3.exists('ab/cd/one.jpg') and not s3.exists('ab/cd/missing.jpg')
+    assert s3.open('ef/01/two.jpg').read() == b'from a file'
+    assert s3.url('ab/cd/one.jpg') == 'https://cdn.example.com/uploads/ab/cd/one.jpg'
+    assert s3.local_path('ab/cd/one.jpg') is None
+    assert s3.delete('ab/cd/one.jpg') and not s3.exists('ab/cd/one.jpg')
+
+
+def test_forbidden_head_counts_as_missing(s3):
+    from uploads import store_upload
+
+    s3.client.forbidden.add('uploads/ab/cd/one.jpg')
+    assert not s3.exists('ab/cd/one.jpg')
+    # An upload still goes through: its HeadObject is refused, the object is written
+    s3.client.fail_with = 403
+    path = store_upload(FileStorage(io.BytesIO(b'\xff\xd8\xff\xe0 photo'), filename='bin.jpg'))
+    assert ('bucket', 'uploads/' + storage.key_from_path(path)) in s3.client.objects
+
+
+def test_other_head_errors_are_raised(s3):
+    s3.client.fail_with = 500
+    with pytest.raises(Exception, match='HTTP 500'):
+        s3.exists('ab/cd/one.jpg')
+
+
+def test_migrate_layout_to_s3(s3, upload_folder, migrated_db):
+    now = datetime.utcnow()
+    user = migrated_db.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                               "VALUES ('s3-citizen', 's3@example.com', '-', 'user', ?)", (now,)).lastrowid
+    os.makedirs(upload_folder)
+    paths = {}
+    for table, name in (('complaints', 'before_1700000000_live.jpg'), ('complaints_archive', 'before_1600000000_old.jpg')):
+        (upload_folder / name).write_bytes(name.encode())
+        paths[table] = f'static/uploads/{name}'
+        migrated_db.execute(f"INSERT INTO {table} (id, user_id, description, image_before_path, status, created_at, updated_at) "
+                            f"VALUES (?, ?, 'bin', ?, 'Completed', ?, ?)",
+                            (len(paths), user, paths[table], now, now))
+    migrated_db.commit()
+    migrated_db.isolation_level = None
+
+    assert migrate_layout(migrated_db) == 2
+
+    for table, old in paths.items():
+        name = os.path.basename(old)
+        new = migrated_db.execute(f'SELECT image_before_path FROM {table}').fetchone()[0]
+        assert new == 'static/uploads/' + shard_key(name)
+        assert s3.client.objects['bucket', 'uploads/' + shard_key(name)] == name.encode()
+        assert not (upload_folder / name).exists()
+        refcounts = dict(migrated_db.execute('SELECT path, refcount FROM uploads WHERE path IN (?, ?)', (old, new)))
+        assert refcounts == {new: 1}
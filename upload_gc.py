@@ -0,0 +1,218 @@
+"""
+Upload garbage collection
+Stored files are normally unlinked by release_uploads() once their last
+reference is gone (see uploads.py); requests queue that as an uploads.release
+job instead of doing the disk I/O themselves. Files can still be left behind:
+an upload stored before an insert that then failed, a crash between a
+release and the unlink, derivatives of a file removed by hand.
+
+collect() finds those by walking the upload folder with os.scandir, one
+directory at a time, and looking each file up in the uploads table
+(derivatives count as referenced while their original is). Files younger
+than UPLOAD_GC_GRACE_SECONDS are skipped - an upload is stored before the
+complaint referencing it is committed. Orphans are removed in batches
+through the writer, which checks each path again, so a file that gains a
+reference in the meantime is kept.
+
+Usage:
+    python upload_gc.py --dry-run           # list orphaned files
+    python upload_gc.py [--grace SECONDS]   # remove them
+"""
+import os
+import sys
+import time
+import argparse
+
+from jobs import handler, enqueue
+from images import SUFFIXES
+from storage import LocalStorage, get_storage, key_from_path, path_from_key
+from uploads import release_uploads
+
+GC_CONFIG = {
+    'UPLOAD_GC_ENABLED': True,
+    'UPLOAD_GC_GRACE_SECONDS': 3600,    # files younger than this are never removed
+    'UPLOAD_GC_BATCH_SIZE': 500,        # orphans removed per write transaction
+}
+
+_RUN_INTERVAL = 24 * 3600
+_DERIVATIVE_EXTENSIONS = ('.webp', '.jpg')
+_TEMP_PREFIX = '.upload-'       # LocalStorage.put_stream() temp files
+
+
+def configure_upload_gc(config):
+    for key in GC_CONFIG:
+        if key in config:
+            GC_CONFIG[key] = config[key]
+
+
+def enqueue_release(conn, paths, owner_id=None):
+    """
+    Queue an uploads.release job for `paths` in the caller's transaction, e.g.
+    inside the run_write() function that dropped their references
+
+    Returns:
+        int: job id, or None when there is nothing to release
+    """
+    paths = sorted(set(p for p in paths if p))
+    if not paths:
+        return None
+    return enqueue(conn, 'uploads.release', {'paths': paths}, owner_id=owner_id)
+
+
+@handler('uploads.release')
+def release_job(paths):
+    """Background job: unlink the files (and derivatives) nobody references any more"""
+    from db import run_write
+
+    return {'removed': run_write(release_uploads, paths)}
+
+
+def walk_files(root):
+    """Yield (key, os.DirEntry) for every file below `root`, one directory listing at a time"""
+    pending = ['']
+    while pending:
+        prefix = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, prefix) if prefix else root) as entries:
+                for entry in entries:
+                    key = f'{prefix}/{entry.name}' if prefix else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(key)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield key, entry
+        except FileNotFoundError:
+            continue
+
+
+def _original_prefix(path):
+    # 'x/abc_thumb.webp' -> 'x/abc.': derivatives belong to whatever 'x/abc.<ext>' is stored
+    stem, ext = os.path.splitext(path)
+    if ext not in _DERIVATIVE_EXTENSIONS:
+        return None
+    for suffix in SUFFIXES.values():
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)] + '.'
+    return None
+
+
+def is_referenced(cur, path):
+    """True if `path`, or the original it is a derivative of, has references"""
+    cur.execute('SELECT 1 FROM uploads WHERE path=? AND refcount > 0', (path,))
+    if cur.fetchone():
+        return True
+    prefix = _original_prefix(path)
+    if prefix is None:
+        return False
+    # '/' sorts right after '.', so this is every path starting with the prefix
+    cur.execute('SELECT 1 FROM uploads WHERE path >= ? AND path < ? AND refcount > 0 LIMIT 1',
+                (prefix, prefix[:-1] + '/'))
+    return cur.fetchone() is not None
+
+
+def delete_orphans(conn, paths):
+    """
+    Unlink files that are still unreferenced; meant to run through
+    db.run_write() so no reference can be committed in between
+
+    Returns:
+        list: paths that were unlinked
+    """
+    storage = get_storage()
+    cur = conn.cursor()
+    removed = []
+    for path in paths:
+        if is_referenced(cur, path):
+            continue
+        conn.execute('DELETE FROM uploads WHERE path=?', (path,))
+        if storage.delete(key_from_path(path)):
+            removed.append(path)
+    return removed
+
+
+def collect(conn, dry_run=False, grace=None, batch_size=None, verbose=False):
+    """
+    Walk the upload folder and remove orphaned files
+
+    Args:
+        conn: connection used for the read-only reference lookups
+        dry_run (bool): only count (and with verbose, list) the orphans
+
+    Returns:
+        dict: scanned, referenced, recent, orphans, removed, bytes (of orphans)
+    """
+    from db import run_write
+
+    grace = GC_CONFIG['UPLOAD_GC_GRACE_SECONDS'] if grace is None else grace
+    batch_size = batch_size or GC_CONFIG['UPLOAD_GC_BATCH_SIZE']
+    stats = {'scanned': 0, 'referenced': 0, 'recent': 0, 'orphans': 0, 'removed': 0, 'bytes': 0}
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        print("Upload GC only walks local storage; use the bucket's lifecycle rules for S3.")
+        return stats
+    cutoff = time.time() - grace
+    cur = conn.cursor()
+    batch = []
+    for key, entry in walk_files(storage.root):
+        stats['scanned'] += 1
+        st = entry.stat(follow_symlinks=False)
+        if st.st_mtime > cutoff:
+            stats['recent'] += 1
+            continue
+        path = path_from_key(key)
+        if not entry.name.startswith(_TEMP_PREFIX) and is_referenced(cur, path):
+            stats['referenced'] += 1
+            continue
+        stats['orphans'] += 1
+        stats['bytes'] += st.st_size
+        if verbose:
+            print(f"  {path} ({st.st_size} bytes)")
+        if not dry_run:
+            batch.append(path)
+            if len(batch) >= batch_size:
+                stats['removed'] += len(run_write(delete_orphans, batch))
+                batch = []
+    if batch:
+        stats['removed'] += len(run_write(delete_orphans, batch))
+    return stats
+
+
+@handler('uploads.gc')
+def gc_job():
+    """Background job: remove orphaned uploads, then schedule the next run"""
+    from db import connect, run_write
+
+    stats = None
+    if GC_CONFIG['UPLOAD_GC_ENABLED']:
+        conn = connect(readonly=True)
+        try:
+            stats = collect(conn)
+        finally:
+            conn.close()
+    run_write(enqueue, 'uploads.gc', {}, delay=_RUN_INTERVAL)
+    return stats
+
+
+def main():
+    from db import connect
+
+    parser = argparse.ArgumentParser(description='Remove uploaded files no complaint references')
+    parser.add_argument('--dry-run', action='store_true', help='list orphaned files without removing them')
+    parser.add_argument('--grace', type=int, default=GC_CONFIG['UPLOAD_GC_GRACE_SECONDS'],
+                        help='skip files modified less than this many seconds ago')
+    parser.add_argument('--batch-size', type=int, default=GC_CONFIG['UPLOAD_GC_BATCH_SIZE'])
+    args = parser.parse_args()
+
+    conn = connect(readonly=True)
+    try:
+        stats = collect(conn, dry_run=args.dry_run, grace=args.grace, batch_size=args.batch_size, verbose=args.dry_run)
+    finally:
+        conn.close()
+    print(f"Scanned {stats['scanned']} file(s): {stats['referenced']} referenced, {stats['recent']} within the grace period, "
+          f"{stats['orphans']} orphaned ({stats['bytes'] / 1e6:.1f} MB).")
+    if not args.dry_run:
+        print(f"✓ Removed {stats['removed']} file(s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Content-addressed upload storage
+Uploaded photos are stored as <sha256>.<ext> (sharded by hash prefix, see
+storage.py), so the same photo uploaded twice (e.g. retried by a flaky mobile
+client) is written to the storage backend only once.
+
+Multipart file parts are streamed into an UploadSpool as they arrive: the
+first bytes are checked against known image signatures, the size is bounded
+per route (UPLOAD_LIMITS) and the SHA-256 is computed while writing, so a
+renamed video is rejected before the rest of it is read.
+
+The uploads table counts how many complaint image columns reference each
+stored path; triggers keep the count current (see migrations.py). A file and
+its derivatives are unlinked only when the last reference is gone.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from images import SUFFIXES
+from storage import CHUNK_SIZE, get_storage, shard_key, key_from_path, path_from_key
+
+# Parts larger than this spill from memory to a temp file
+SPOOL_MAX_MEMORY = 512 * 1024
+# Room for the non-file form fields on top of a route's file limit
+FORM_OVERHEAD = 64 * 1024
+
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+# Per-process counts of rejected uploads, exposed on /api/admin/upload-stats
+REJECTIONS = {'too_large': 0, 'bad_type': 0}
+_rejections_lock = threading.Lock()
+
+
+def count_rejection(reason):
+    with _rejections_lock:
+        REJECTIONS[reason] = REJECTIONS.get(reason, 0) + 1
+
+
+def rejection_stats():
+    with _rejections_lock:
+        return dict(REJECTIONS)
+
+
+def sniff(head):
+    """
+    Image type from the leading bytes of a file
+
+    Returns:
+        str: 'jpg', 'png' or 'gif'; None if `head` cannot start an image;
+             '' if more bytes are needed to tell
+    """
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if any(signature.startswith(head) for signature, _ in IMAGE_SIGNATURES):
+        return ''
+    return None
+
+
+class UploadSpool:
+    """Write target for one multipart file part: sniffs, bounds and hashes it"""
+
+    def __init__(self, limit=None):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        self.limit = limit
+        self.size = 0
+        self.head = b''
+        self.kind = ''
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise RequestEntityTooLarge(f'Each image may be at most {self.limit // (1024 * 1024)} MB.')
+        if self.kind == '':
+            self.head = (self.head + data)[:16]
+            self.kind = sniff(self.head)
+            if self.kind is None:
+                raise UnsupportedMediaType('Only JPEG, PNG and GIF images can be uploaded.')
+        self.digest.update(data)
+        return self.file.write(data)
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams file parts into UploadSpools"""
+
+    def _upload_limit(self):
+        limits = current_app.config.get('UPLOAD_LIMITS') or {}
+        return limits.get(self.endpoint)
+
+    @property
+    def max_content_length(self):
+        # Checked against Content-Length before the body is read at all;
+        # routes taking several files set a whole-body limit in UPLOAD_BODY_LIMITS
+        body_limit = (current_app.config.get('UPLOAD_BODY_LIMITS') or {}).get(self.endpoint)
+        if body_limit is not None:
+            return body_limit
+        limit = self._upload_limit()
+        if limit is not None:
+            return limit + FORM_OVERHEAD
+        return current_app.config.get('MAX_CONTENT_LENGTH')
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = self._upload_limit()
+        return UploadSpool(limit if limit is not None else current_app.config.get('MAX_CONTENT_LENGTH'))
+
+
+def image_kind(file):
+    # Sniffed type of an uploaded FileStorage ('' or None if it is not an image)
+    stream = file.stream
+    if isinstance(stream, UploadSpool):
+        return stream.kind
+    stream.seek(0)
+    kind = sniff(stream.read(16))
+    stream.seek(0)
+    return kind
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+
+
+def hash_stream(stream):
+    # SHA-256 of a file-like object, read in fixed-size chunks
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_upload(file):
+    """
+    Store an uploaded file under its content hash
+
+    The hash is taken from the UploadSpool (computed while the part was
+    received) or else from a pass over the stream, and the file is only
+    written if no file with that hash exists yet. The extension comes from
+    the sniffed image type rather than the client's file name.
+
+    Args:
+        file: werkzeug FileStorage
+
+    Returns:
+        str: stored path, e.g. 'static/uploads/ab/cd/<sha256>.jpg'
+    """
+    stream = file.stream
+    if isinstance(stream, UploadSpool):
+        digest = stream.sha256
+    else:
+        stream.seek(0)
+        digest = hash_stream(stream)
+    key = shard_key(f"{digest}.{image_kind(file) or _extension(file.filename)}")
+    storage = get_storage()
+    if not storage.exists(key):
+        stream.seek(0)
+        storage.put_stream(stream, key)
+    return path_from_key(key)
+
+
+def ensure_stored(file, rel_path):
+    # Re-write a blob released between store_upload() and the insert referencing it
+    storage = get_storage()
+    key = key_from_path(rel_path)
+    if not storage.exists(key):
+        file.stream.seek(0)
+        storage.put_stream(file.stream, key)
+
+
+def _unlink_with_derivatives(rel_path):
+    stem = os.path.splitext(rel_path)[0]
+    candidates = [rel_path] + [stem + suffix + ext for suffix in SUFFIXES.values() for ext in ('.webp', '.jpg')]
+    storage = get_storage()
+    for path in candidates:
+        try:
+            storage.delete(key_from_path(path))
+        except Exception as e:
+            print(f"Error removing upload {path}: {e}")
+
+
+def release_uploads(conn, paths):
+    """
+    Unlink stored files that are no longer referenced by any complaint
+
+    Meant to run through db.run_write() after the referencing rows were
+    deleted or updated: the writer serializes it with inserts, so a file is
+    never removed while a new reference to it is being committed.
+
+    Returns:
+        list: paths that were unlinked
+    """
+    removed = []
+    for path in set(p for p in paths if p):
+        row = conn.execute('SELECT refcount FROM uploads WHERE path=?', (path,)).fetchone()
+        if row is not None and row[0] > 0:
+            continue
+        conn.execute('DELETE FROM uploads WHERE path=?', (path,))
+        _unlink_with_derivatives(path)
+        removed.append(path)
+    return removed